@@ -1,26 +1,37 @@
 import os
-import gradio as gr
+import json
+import asyncio
 import requests
 import inspect
-import pandas as pd
-from graph.graph_builder import graph
-from langfuse.callback import CallbackHandler
-from typing import Optional
+from graph.graph_builder import get_graph
+from typing import Optional, TYPE_CHECKING
 from langchain_core.messages import AnyMessage, HumanMessage, AIMessage
+from utils.answer_store import AnswerStore, task_input_hash
+from utils.clients import get_or_create
+from utils.tracing import tracing_callbacks
+from utils.workspace import create_workspace, release_workspace
+
+if TYPE_CHECKING:
+    import gradio as gr
 # (Keep Constants as is)
 # --- Constants ---
 DEFAULT_API_URL = "https://agents-course-unit4-scoring.hf.space"
+# Numero massimo di task eseguiti in parallelo (1 = esecuzione sequenziale)
+EVAL_MAX_CONCURRENCY = int(os.getenv("EVAL_MAX_CONCURRENCY", "4"))
+# Timeout in secondi per il singolo task (0 = nessun timeout)
+EVAL_TASK_TIMEOUT = float(os.getenv("EVAL_TASK_TIMEOUT", "600"))
+
+ANSWER_STORE_PATH = os.getenv("ANSWER_STORE_PATH", os.path.join(".cache", "answers.sqlite3"))
 
 
-langfuse_secret_key = os.getenv("LANGFUSE_SECRET_KEY")
-langfuse_public_key = os.getenv("LANGFUSE_PUBLIC_KEY")
+def get_answer_store() -> AnswerStore:
+    """
+    Archivio locale delle risposte: permette di riprendere una valutazione interrotta
+    e di ri-sottomettere le risposte senza rieseguire l'agente. Il database viene
+    aperto (e creato) al primo uso, non all'import del modulo.
+    """
+    return get_or_create("answer_store", lambda: AnswerStore(ANSWER_STORE_PATH))
 
-# Initialize Langfuse CallbackHandler for LangGraph/Langchain (tracing)
-langfuse_handler = CallbackHandler(
-    public_key=langfuse_public_key,
-    secret_key=langfuse_secret_key,
-    host="http://localhost:3000"
-)
 
 # --- Basic Agent Definition ---
 # ----- THIS IS WERE YOU CAN BUILD WHAT YOU WANT ------
@@ -39,7 +50,84 @@ langfuse_handler = CallbackHandler(
         print(f"Agent returning fixed answer: {fixed_answer}")
         return fixed_answer """
 
-def run_and_submit_all( profile: Optional[gr.OAuthProfile]):
+async def run_agent_on_task(item: dict) -> tuple[Optional[dict], Optional[dict]]:
+    """
+    Runs the agent on a single question.
+
+    Returns a (answer, log_entry) pair: answer is None if the agent failed,
+    both are None if the item is invalid and must be skipped.
+    """
+    task_id = item.get("task_id")
+    question_text = item.get("question")
+    file_name = item.get("file_name")  # Estrai file_name
+
+    if not task_id or question_text is None:
+        print(f"Skipping item with missing task_id or question: {item}")
+        return None, None
+    # Ogni task ha la sua cartella: i task concorrenti non si sovrascrivono ritagli e drawio_output.drawio
+    workspace = create_workspace(task_id)
+    try:
+        if file_name and isinstance(file_name, str) and file_name.strip():
+            messages = HumanMessage(content=question_text + " Path: files/" + file_name)
+        else:
+            messages = HumanMessage(content=question_text)
+        submitted_answer = await get_graph().ainvoke(input={"messages": messages, "workspace": workspace}, config={"callbacks": tracing_callbacks()})
+        answer = {
+            "task_id": task_id,
+            "submitted_answer": submitted_answer['messages'][-1].content[-1] 
+                if isinstance(submitted_answer['messages'][-1].content, list) 
+                else submitted_answer['messages'][-1].content
+        }
+        get_answer_store().save_answer(task_id, task_input_hash(question_text, file_name), question_text, file_name, json.dumps(answer["submitted_answer"]))
+        return answer, {"Task ID": task_id, "Question": question_text, "File Name": file_name if file_name and file_name.strip() else "N/A", "Submitted Answer": submitted_answer['messages'][-1].content}
+    except Exception as e:
+         print(f"Error running agent on task {task_id}: {e}")
+         get_answer_store().save_error(task_id, task_input_hash(question_text, file_name), question_text, file_name, str(e))
+         return None, {"Task ID": task_id, "Question": question_text, "Submitted Answer": f"AGENT ERROR: {e}"}
+    finally:
+        release_workspace(workspace)
+
+def cached_outcome(item: dict) -> Optional[tuple[dict, dict]]:
+    """
+    Returns the (answer, log_entry) pair stored for this task, or None if the task
+    has no successful answer for its current question and attached file.
+    """
+    task_id = item.get("task_id")
+    question_text = item.get("question")
+    file_name = item.get("file_name")
+    if not task_id or question_text is None:
+        return None
+    stored = get_answer_store().get_answer(task_id, task_input_hash(question_text, file_name))
+    if stored is None:
+        return None
+    submitted_answer = json.loads(stored)
+    return {"task_id": task_id, "submitted_answer": submitted_answer}, {"Task ID": task_id, "Question": question_text, "File Name": file_name if file_name and file_name.strip() else "N/A", "Submitted Answer": f"(cached) {submitted_answer}"}
+
+async def run_tasks_concurrently(questions_data: list[dict], max_concurrency: int, task_timeout: float) -> list[tuple[Optional[dict], Optional[dict]]]:
+    """
+    Runs the agent on every question with at most max_concurrency tasks in flight.
+
+    Each task gets task_timeout seconds from the moment it starts (0 disables the timeout).
+    Results are returned in the same order as questions_data.
+    """
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def run_one(item: dict):
+        async with semaphore:
+            try:
+                if task_timeout > 0:
+                    return await asyncio.wait_for(run_agent_on_task(item), timeout=task_timeout)
+                return await run_agent_on_task(item)
+            except asyncio.TimeoutError:
+                # wait_for cancella il grafo (graph.ainvoke) ancora in esecuzione
+                task_id = item.get("task_id")
+                print(f"Timeout running agent on task {task_id} after {task_timeout}s")
+                get_answer_store().save_error(task_id, task_input_hash(item.get("question"), item.get("file_name")), item.get("question"), item.get("file_name"), f"timeout after {task_timeout}s")
+                return None, {"Task ID": task_id, "Question": item.get("question"), "Submitted Answer": f"AGENT ERROR: timeout after {task_timeout}s"}
+
+    return await asyncio.gather(*(run_one(item) for item in questions_data))
+
+def run_and_submit_all( profile: Optional["gr.OAuthProfile"]):
     """
     Fetches all questions, runs the BasicAgent on them, submits all answers,
     and displays the results.
@@ -56,11 +144,10 @@ def run_and_submit_all( profile: Optional[gr.OAuthProfile]):
 
     api_url = DEFAULT_API_URL
     questions_url = f"{api_url}/questions"
-    submit_url = f"{api_url}/submit"
 
     # 1. Instantiate Agent ( modify this part to create your agent)
     try:
-        agent = graph
+        agent = get_graph()
     except Exception as e:
         print(f"Error instantiating agent: {e}")
         return f"Error initializing agent: {e}", None
@@ -90,41 +177,42 @@ def run_and_submit_all( profile: Optional[gr.OAuthProfile]):
         return f"An unexpected error occurred fetching questions: {e}", None
 
     # 3. Run your Agent
+    print(f"Running agent on {len(questions_data)} questions (concurrency={EVAL_MAX_CONCURRENCY}, timeout={EVAL_TASK_TIMEOUT}s)...")
+    # I task con una risposta già salvata (stessa domanda e stesso file) non vengono rieseguiti
+    outcomes = [cached_outcome(item) for item in questions_data]
+    pending_indexes = [i for i, outcome in enumerate(outcomes) if outcome is None]
+    print(f"{len(questions_data) - len(pending_indexes)} answers loaded from the answer store, {len(pending_indexes)} tasks to run.")
+    pending_outcomes = asyncio.run(run_tasks_concurrently([questions_data[i] for i in pending_indexes], EVAL_MAX_CONCURRENCY, EVAL_TASK_TIMEOUT))
+    for i, outcome in zip(pending_indexes, pending_outcomes):
+        outcomes[i] = outcome
     results_log = []
     answers_payload = []
-    print(f"Running agent on {len(questions_data)} questions...")
-    for item in questions_data:
-        task_id = item.get("task_id")
-        question_text = item.get("question")
-        file_name = item.get("file_name")  # Estrai file_name
-
-        if not task_id or question_text is None:
-            print(f"Skipping item with missing task_id or question: {item}")
+    for answer, log_entry in outcomes:
+        if log_entry is None:
             continue
-        try:
-            if file_name and isinstance(file_name, str) and file_name.strip():
-                messages = HumanMessage(content=question_text + " Path: files/" + file_name)
-            else:
-                messages = HumanMessage(content=question_text)
-            submitted_answer = graph.invoke(input={"messages": messages}, config={"callbacks": [langfuse_handler]})
-            answers_payload.append({
-                "task_id": task_id,
-                "submitted_answer": submitted_answer['messages'][-1].content[-1] 
-                    if isinstance(submitted_answer['messages'][-1].content, list) 
-                    else submitted_answer['messages'][-1].content
-            })
-            results_log.append({"Task ID": task_id, "Question": question_text, "File Name": file_name if file_name and file_name.strip() else "N/A", "Submitted Answer": submitted_answer['messages'][-1].content})
-        except Exception as e:
-             print(f"Error running agent on task {task_id}: {e}")
-             results_log.append({"Task ID": task_id, "Question": question_text, "Submitted Answer": f"AGENT ERROR: {e}"})
+        if answer is not None:
+            answers_payload.append(answer)
+        results_log.append(log_entry)
 
     if not answers_payload:
+        import pandas as pd  # Import al primo uso: pandas rallenta l'avvio
+
         print("Agent did not produce any answers to submit.")
         return "Agent did not produce any answers to submit.", pd.DataFrame(results_log)
 
+    return submit_answers(username, agent_code, answers_payload, results_log)
+
+def submit_answers(username: str, agent_code: str, answers_payload: list[dict], results_log: list[dict]):
+    """
+    Submits the answers to the scoring API and returns the (status, results table) pair.
+    """
+    import pandas as pd  # Import al primo uso: pandas rallenta l'avvio
+
+    submit_url = f"{DEFAULT_API_URL}/submit"
+
     # 4. Prepare Submission 
     submission_data = {"username": username.strip(), "agent_code": agent_code, "answers": answers_payload}
-    status_update = f"Agent finished. Submitting {len(answers_payload)} answers for user '{username}'..."
+    status_update = f"Submitting {len(answers_payload)} answers for user '{username}'..."
     print(status_update)
 
     # 5. Submit
@@ -170,37 +258,96 @@ def run_and_submit_all( profile: Optional[gr.OAuthProfile]):
         results_df = pd.DataFrame(results_log)
         return status_message, results_df
 
+def submit_cached_answers( profile: Optional["gr.OAuthProfile"]):
+    """
+    Submits the answers saved in the answer store without running the agent.
+    """
+    space_id = os.getenv("SPACE_ID")
+
+    if profile:
+        username= f"{profile.username}"
+        print(f"User logged in: {username}")
+    else:
+        print("User not logged in.")
+        return "Please Login to Hugging Face with the button.", None
+
+    agent_code = f"https://huggingface.co/spaces/{space_id}/tree/main"
+
+    stored_answers = get_answer_store().all_answers()
+    if not stored_answers:
+        print("Answer store is empty.")
+        return "No cached answers to submit. Run the evaluation first.", None
+
+    answers_payload = []
+    results_log = []
+    for stored in stored_answers:
+        submitted_answer = json.loads(stored["answer"])
+        answers_payload.append({"task_id": stored["task_id"], "submitted_answer": submitted_answer})
+        results_log.append({"Task ID": stored["task_id"], "Question": stored["question"], "File Name": stored["file_name"] or "N/A", "Submitted Answer": submitted_answer})
+
+    return submit_answers(username, agent_code, answers_payload, results_log)
+
 
 # --- Build Gradio Interface using Blocks ---
-with gr.Blocks() as demo:
-    gr.Markdown("# Basic Agent Evaluation Runner")
-    gr.Markdown(
-        """
-        **Instructions:**
+def build_demo():
+    """
+    Builds the Gradio interface. gradio is imported here, not at module import time,
+    so the evaluation helpers can be imported without loading the UI stack.
+    """
+    # Reso globale perché Gradio risolve le annotazioni "gr.OAuthProfile" dei callback nel namespace del modulo
+    global gr
+    import gradio as gr
+
+    with gr.Blocks() as demo:
+        gr.Markdown("# Basic Agent Evaluation Runner")
+        gr.Markdown(
+            """
+            **Instructions:**
 
-        1.  Please clone this space, then modify the code to define your agent's logic, the tools, the necessary packages, etc ...
-        2.  Log in to your Hugging Face account using the button below. This uses your HF username for submission.
-        3.  Click 'Run Evaluation & Submit All Answers' to fetch questions, run your agent, submit answers, and see the score.
+            1.  Please clone this space, then modify the code to define your agent's logic, the tools, the necessary packages, etc ...
+            2.  Log in to your Hugging Face account using the button below. This uses your HF username for submission.
+            3.  Click 'Run Evaluation & Submit All Answers' to fetch questions, run your agent, submit answers, and see the score.
+                Answers are saved locally: tasks already answered are skipped, and 'Submit Cached Answers' re-submits them without running the agent.
 
-        ---
-        **Disclaimers:**
-        Once clicking on the "submit button, it can take quite some time ( this is the time for the agent to go through all the questions).
-        This space provides a basic setup and is intentionally sub-optimal to encourage you to develop your own, more robust solution. For instance for the delay process of the submit button, a solution could be to cache the answers and submit in a seperate action or even to answer the questions in async.
-        """
-    )
+            ---
+            **Disclaimers:**
+            Once clicking on the "submit button, it can take quite some time ( this is the time for the agent to go through all the questions).
+            This space provides a basic setup and is intentionally sub-optimal to encourage you to develop your own, more robust solution. For instance for the delay process of the submit button, a solution could be to cache the answers and submit in a seperate action or even to answer the questions in async.
+            """
+        )
 
-    gr.LoginButton()
+        gr.LoginButton()
 
-    run_button = gr.Button("Run Evaluation & Submit All Answers")
+        run_button = gr.Button("Run Evaluation & Submit All Answers")
+        submit_cached_button = gr.Button("Submit Cached Answers")
 
-    status_output = gr.Textbox(label="Run Status / Submission Result", lines=5, interactive=False)
-    # Removed max_rows=10 from DataFrame constructor
-    results_table = gr.DataFrame(label="Questions and Agent Answers", wrap=True)
+        status_output = gr.Textbox(label="Run Status / Submission Result", lines=5, interactive=False)
+        # Removed max_rows=10 from DataFrame constructor
+        results_table = gr.DataFrame(label="Questions and Agent Answers", wrap=True)
+
+        run_button.click(
+            fn=run_and_submit_all,
+            outputs=[status_output, results_table]
+        )
+        submit_cached_button.click(
+            fn=submit_cached_answers,
+            outputs=[status_output, results_table]
+        )
+    return demo
+
+def get_demo():
+    """
+    Restituisce l'interfaccia Gradio, costruita una sola volta al primo uso.
+    """
+    return get_or_create("gradio_demo", build_demo)
 
-    run_button.click(
-        fn=run_and_submit_all,
-        outputs=[status_output, results_table]
-    )
+def __getattr__(name: str):
+    # "demo" resta disponibile per "gradio app_for_submission.py", costruito al primo accesso
+    if name == "demo":
+        return get_demo()
+    if name == "answer_store":
+        return get_answer_store()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == "__main__":
     print("\n" + "-"*30 + " App Starting " + "-"*30)
@@ -224,4 +371,4 @@ if __name__ == "__main__":
     print("-"*(60 + len(" App Starting ")) + "\n")
 
     print("Launching Gradio Interface for Basic Agent Evaluation...")
-    demo.launch(debug=True, share=False)
\ No newline at end of file
+    get_demo().launch(debug=True, share=False)
\ No newline at end of file
@@ -0,0 +1,257 @@
+"""
+Benchmark offline della pipeline, senza chiamate reali a Gemini.
+
+Misura ogni stadio (decodifica, thumbnail, ritaglio/salvataggio, post-processing XML,
+embedding base64, detection + ritaglio e generazione Draw.io con e senza streaming, graph.invoke completo e CONCURRENT_REQUESTS richieste concorrenti con graph.ainvoke) su diagrammi sintetici di dimensione e numero
+di oggetti crescenti, usando i backend finti di benchmarks/fake_gemini.py.
+
+Uso (dalla root del repository):
+    python -m benchmarks.bench_pipeline --output benchmarks/results/current.json
+    python -m benchmarks.bench_pipeline --compare benchmarks/results/baseline.json --threshold 0.2
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("GEMINI_API_KEY", "offline-benchmark")
+
+from langchain_core.messages import HumanMessage
+from PIL import Image
+
+import tools.drawio_tools
+import tools.object_detection_tools
+from benchmarks.fake_gemini import FakeChatModel, FakeGenaiClient
+from benchmarks.synthetic import make_diagram
+from graph.graph_builder import graph
+from tools.drawio_tools import embed_images_streaming, optimize_assets
+from utils import clients
+from utils.asset_store import AssetStore, get_asset_store
+from utils.utils import save_cropped_images
+from utils.workspace import create_workspace, release_workspace
+
+DEFAULT_SIZES = [(800, 600), (1600, 1200), (3200, 2400)]
+DEFAULT_OBJECT_COUNTS = [5, 20, 50]
+# Richieste multiplexate sullo stesso event loop nello stadio graph_ainvoke_concurrent
+CONCURRENT_REQUESTS = 4
+
+
+def _time(fn, repeats: int) -> list[float]:
+    runs = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def install_fakes(scenario: dict, latency: float) -> FakeGenaiClient:
+    """
+    Sostituisce i client Gemini dei tool e il modello chat dell'assistente con i backend finti.
+    """
+    client = FakeGenaiClient({"detection": scenario["detection"], "drawio": scenario["drawio"]}, latency=latency)
+    clients.set_instance("genai_client", client)
+    clients.set_instance("chat_with_tools", FakeChatModel(
+        image_path=scenario["image_path"], object_names=scenario["object_names"], latency=latency
+    ))
+    # Le cache su disco nasconderebbero il costo delle chiamate (finte) al modello
+    tools.object_detection_tools.detection_cache.bypass = True
+    tools.drawio_tools.drawio_cache.bypass = True
+    return client
+
+
+def bench_scenario(scenario: dict, workdir: str, repeats: int, latency: float) -> dict[str, list[float]]:
+    image_path = scenario["image_path"]
+    bounding_boxes = scenario["detection_json"]
+    xml_content = scenario["drawio_xml"]
+    crops_folder = os.path.join(workdir, "crops")
+
+    def decode():
+        with Image.open(image_path) as im:
+            im.load()
+
+    with Image.open(image_path) as full_image:
+        full_image.load()
+
+    def thumbnail():
+        im = full_image.copy()
+        im.thumbnail([1024, 1024], Image.Resampling.LANCZOS)
+
+    thumb = full_image.copy()
+    thumb.thumbnail([1024, 1024], Image.Resampling.LANCZOS)
+    store = AssetStore()
+
+    def crop_save():
+        save_cropped_images(thumb, bounding_boxes, output_folder=crops_folder, asset_store=store)
+
+    crop_save()
+    crops = {name: store.get(name) for name in store.names()}
+
+    def fresh_store() -> AssetStore:
+        fresh = AssetStore()
+        for name, asset in crops.items():
+            fresh.put(name, asset.data, asset.mime_type)
+        return fresh
+
+    def xml_postprocess():
+        optimize_assets(xml_content, fresh_store())
+
+    def base64_embed():
+        embed_images_streaming(xml_content, io.StringIO(), crops_folder, fresh_store())
+
+    install_fakes(scenario, latency)
+
+    def detect_crop(streaming: bool):
+        tools.object_detection_tools.DETECTION_STREAMING = streaming
+        try:
+            get_asset_store("output_llm").clear()
+            im, result_text, encoded_crops = tools.object_detection_tools.run_detection(image_path)
+            tools.object_detection_tools.crop_detected_objects(im, result_text, encoded_crops=encoded_crops)
+        finally:
+            tools.object_detection_tools.DETECTION_STREAMING = False
+
+    def drawio_generate(streaming: bool):
+        tools.drawio_tools.DRAWIO_STREAMING = streaming
+        try:
+            tools.drawio_tools._generate_drawio_from_image_and_objects(image_path, scenario["object_names"])
+        finally:
+            tools.drawio_tools.DRAWIO_STREAMING = False
+
+    def graph_invoke():
+        get_asset_store("output_llm").clear()
+        graph.invoke(input={"messages": HumanMessage(content=f"Generami il drawio. Path: {image_path}")})
+
+    def graph_invoke_fast():
+        get_asset_store("output_llm").clear()
+        graph.invoke(input={"messages": HumanMessage(content=f"Generami il drawio. Path: {image_path}")},
+                     config={"configurable": {"pipeline": "fast"}})
+
+    def graph_invoke_speculative():
+        get_asset_store("output_llm").clear()
+        graph.invoke(input={"messages": HumanMessage(content=f"Generami il drawio. Path: {image_path}")},
+                     config={"configurable": {"pipeline": "speculative"}})
+
+    def graph_ainvoke_concurrent():
+        # Un workspace per richiesta, come app_for_submission.py
+        workspaces = [create_workspace(f"bench{i}") for i in range(CONCURRENT_REQUESTS)]
+
+        async def run_all():
+            await asyncio.gather(*(
+                graph.ainvoke(input={"messages": HumanMessage(content=f"Generami il drawio. Path: {image_path}"),
+                                     "workspace": workspace})
+                for workspace in workspaces
+            ))
+
+        try:
+            asyncio.run(run_all())
+        finally:
+            for workspace in workspaces:
+                release_workspace(workspace)
+
+    return {
+        "decode": _time(decode, repeats),
+        "thumbnail": _time(thumbnail, repeats),
+        "crop_save": _time(crop_save, repeats),
+        "xml_postprocess": _time(xml_postprocess, repeats),
+        "base64_embed": _time(base64_embed, repeats),
+        "detect_crop": _time(lambda: detect_crop(False), repeats),
+        "detect_crop_streaming": _time(lambda: detect_crop(True), repeats),
+        "drawio_generate": _time(lambda: drawio_generate(False), repeats),
+        "drawio_generate_streaming": _time(lambda: drawio_generate(True), repeats),
+        "graph_invoke": _time(graph_invoke, repeats),
+        "graph_invoke_fast": _time(graph_invoke_fast, repeats),
+        "graph_invoke_speculative": _time(graph_invoke_speculative, repeats),
+        "graph_ainvoke_concurrent": _time(graph_ainvoke_concurrent, repeats),
+    }
+
+
+def run(sizes, object_counts, repeats: int, latency: float) -> dict:
+    results = []
+    original_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)  # output_llm/ e .cache/ finiscono nella cartella temporanea
+        try:
+            for width, height in sizes:
+                for object_count in object_counts:
+                    scenario = make_diagram(os.path.join(workdir, "inputs"), width, height, object_count)
+                    name = f"{width}x{height}_n{object_count}"
+                    print(f"Scenario {name}...", file=sys.stderr)
+                    for stage, runs in bench_scenario(scenario, workdir, repeats, latency).items():
+                        results.append({
+                            "scenario": name,
+                            "stage": stage,
+                            "median_s": statistics.median(runs),
+                            "min_s": min(runs),
+                            "runs": runs,
+                        })
+        finally:
+            os.chdir(original_cwd)
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeats": repeats,
+            "latency_s": latency,
+        },
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Confronta le mediane con una baseline e restituisce gli stadi peggiorati oltre la soglia.
+    """
+    previous = {(r["scenario"], r["stage"]): r["median_s"] for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        key = (result["scenario"], result["stage"])
+        if key not in previous or previous[key] <= 0:
+            continue
+        ratio = result["median_s"] / previous[key]
+        line = f"{key[0]:>18} {key[1]:>16}: {previous[key] * 1000:9.2f} ms -> {result['median_s'] * 1000:9.2f} ms ({ratio:5.2f}x)"
+        print(line)
+        if ratio > 1 + threshold:
+            regressions.append(line)
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark offline della pipeline drawio.")
+    parser.add_argument("--output", default=os.path.join("benchmarks", "results", "latest.json"))
+    parser.add_argument("--compare", help="File JSON di baseline con cui confrontare i risultati")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Peggioramento relativo tollerato (0.2 = +20%%)")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.0, help="Latenza simulata per chiamata al modello, in secondi")
+    parser.add_argument("--sizes", nargs="*", default=[f"{w}x{h}" for w, h in DEFAULT_SIZES])
+    parser.add_argument("--objects", nargs="*", type=int, default=DEFAULT_OBJECT_COUNTS)
+    args = parser.parse_args()
+
+    sizes = [tuple(int(v) for v in size.split("x")) for size in args.sizes]
+    current = run(sizes, args.objects, args.repeats, args.latency)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(current, f, indent=2)
+    print(f"Risultati salvati in {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} stadi peggiorati oltre il {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
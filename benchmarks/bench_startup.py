@@ -0,0 +1,79 @@
+"""
+Benchmark del tempo di import dei moduli dell'agente, basato su python -X importtime.
+
+Per ogni modulo avvia un interprete pulito, misura il tempo cumulativo di import riportato da
+-X importtime e controlla che le librerie pesanti caricate solo al primo uso (google.genai,
+langchain_google_genai, gradio, pandas) non vengano importate. Esce con codice 1 se un modulo
+supera il budget o carica una libreria pesante, così può essere eseguito in CI.
+
+Uso (dalla root del repository):
+    python -m benchmarks.bench_startup --budget-ms 1500
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+DEFAULT_MODULES = ["graph.graph_builder", "app_for_submission"]
+# Librerie che devono essere importate solo al primo uso
+LAZY_MODULES = ["google.genai", "langchain_google_genai", "gradio", "pandas"]
+
+
+def parse_importtime(stderr: str) -> dict[str, tuple[int, int]]:
+    """
+    Legge l'output di -X importtime.
+
+    Returns:
+        dict: Nome del modulo -> (tempo proprio, tempo cumulativo) in microsecondi.
+    """
+    timings = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+def measure(module: str) -> dict[str, tuple[int, int]]:
+    env = dict(os.environ)
+    env.setdefault("GEMINI_API_KEY", "offline-benchmark")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env, cwd=os.getcwd(),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Import di {module} fallito:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Tempo di import dei moduli dell'agente.")
+    parser.add_argument("--modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--budget-ms", type=float, default=1500.0, help="Tempo di import massimo per modulo (mediana)")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="Numero di import più lenti da mostrare")
+    args = parser.parse_args()
+
+    failures = []
+    for module in args.modules:
+        runs = [measure(module) for _ in range(args.repeats)]
+        total_ms = statistics.median(run[module][1] for run in runs) / 1000
+        timings = runs[-1]
+        print(f"{module}: {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+        for name, (self_us, cumulative_us) in sorted(timings.items(), key=lambda item: -item[1][0])[:args.top]:
+            print(f"    {self_us / 1000:8.1f} ms self {cumulative_us / 1000:8.1f} ms cumulative  {name}")
+        if total_ms > args.budget_ms:
+            failures.append(f"{module}: {total_ms:.1f} ms > budget {args.budget_ms:.0f} ms")
+        eager = [name for name in LAZY_MODULES if name in timings]
+        if eager:
+            failures.append(f"{module}: importa librerie da caricare al primo uso: {', '.join(eager)}")
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
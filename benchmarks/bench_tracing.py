@@ -0,0 +1,135 @@
+"""
+Benchmark dell'overhead del tracing per richiesta, senza chiamate reali a Gemini né a Langfuse.
+
+Esegue graph.invoke sullo stesso diagramma sintetico (backend finti di benchmarks/fake_gemini.py)
+senza tracing e con utils.tracing verso un collector locale veloce, lento e non raggiungibile,
+anche con campionamento parziale, e, se installato, con il CallbackHandler dell'SDK Langfuse.
+
+Uso (dalla root del repository):
+    python -m benchmarks.bench_tracing --requests 50
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault("GEMINI_API_KEY", "offline-benchmark")
+
+from langchain_core.messages import HumanMessage
+
+from benchmarks.bench_pipeline import install_fakes
+from benchmarks.synthetic import make_diagram
+from graph.graph_builder import graph
+from utils.asset_store import get_asset_store
+from utils.tracing import TraceExporter, TracingCallbackHandler
+
+
+class _Collector(BaseHTTPRequestHandler):
+    delay = 0.0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.delay)
+        self.send_response(207)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_collector(delay: float) -> ThreadingHTTPServer:
+    handler = type("Collector", (_Collector,), {"delay": delay})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def unused_port() -> int:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Collector)
+    port = server.server_address[1]
+    server.server_close()
+    return port
+
+
+def run_requests(image_path: str, requests: int, callbacks_for_request) -> list[float]:
+    runs = []
+    for _ in range(requests):
+        get_asset_store("output_llm").clear()
+        callbacks = callbacks_for_request()
+        start = time.perf_counter()
+        graph.invoke(input={"messages": HumanMessage(content=f"Generami il drawio. Path: {image_path}")},
+                     config={"callbacks": callbacks})
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Overhead per richiesta del tracing.")
+    parser.add_argument("--requests", type=int, default=30)
+    parser.add_argument("--objects", type=int, default=10)
+    parser.add_argument("--slow-delay", type=float, default=1.0, help="Latenza del collector lento, in secondi")
+    parser.add_argument("--sample-rate", type=float, default=0.1)
+    args = parser.parse_args()
+
+    random.seed(0)
+    original_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            scenario = make_diagram(os.path.join(workdir, "images"), 1600, 1200, args.objects)
+            install_fakes(scenario, latency=0.0)
+            fast = start_collector(0.0)
+            slow = start_collector(args.slow_delay)
+
+            def exporter(host: str) -> TraceExporter:
+                return TraceExporter(host=host, public_key="pk", secret_key="sk", flush_interval=0.5,
+                                     spool_path=os.path.join(workdir, f"spool-{host.rsplit(':', 1)[-1]}.jsonl"))
+
+            exporters = {
+                "traced_fast_collector": exporter(f"http://127.0.0.1:{fast.server_address[1]}"),
+                "traced_slow_collector": exporter(f"http://127.0.0.1:{slow.server_address[1]}"),
+                "traced_collector_down": exporter(f"http://127.0.0.1:{unused_port()}"),
+            }
+            modes = {"none": lambda: []}
+            for name, exp in exporters.items():
+                modes[name] = lambda exp=exp: [TracingCallbackHandler(exp)]
+            sampled = exporters["traced_slow_collector"]
+            modes[f"sampled_{args.sample_rate:g}_slow_collector"] = lambda: (
+                [TracingCallbackHandler(sampled)] if random.random() < args.sample_rate else []
+            )
+            try:
+                from langfuse.callback import CallbackHandler
+                sdk_handler = CallbackHandler(public_key="pk", secret_key="sk", host=f"http://127.0.0.1:{unused_port()}")
+                modes["langfuse_sdk_collector_down"] = lambda: [sdk_handler]
+            except ImportError:
+                pass
+
+            run_requests(scenario["image_path"], 2, modes["none"])  # Warm-up (cache delle immagini, import)
+            results = {}
+            for name, fn in modes.items():
+                results[name] = run_requests(scenario["image_path"], args.requests, fn)
+                # Il lavoro di export in sospeso non deve pesare sulla modalità successiva
+                for exp in exporters.values():
+                    exp.flush(timeout=args.slow_delay * 5)
+        finally:
+            os.chdir(original_cwd)
+
+    baseline = statistics.median(results["none"])
+    print(f"{'mode':>36} {'median ms':>10} {'p95 ms':>10} {'overhead ms':>12}")
+    for name, runs in results.items():
+        median = statistics.median(runs)
+        p95 = sorted(runs)[max(int(len(runs) * 0.95) - 1, 0)]
+        print(f"{name:>36} {median * 1000:10.2f} {p95 * 1000:10.2f} {(median - baseline) * 1000:12.2f}")
+    for name, exp in exporters.items():
+        print(f"{name}: {exp.stats()}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,145 @@
+"""
+Backend Gemini finto per i benchmark offline.
+
+FakeGenaiClient sostituisce genai.Client nei tool (stessa interfaccia client.models.generate_content)
+e restituisce risposte registrate con una latenza configurabile. FakeChatModel sostituisce il
+ChatGoogleGenerativeAI di nodes/core.py e riproduce la sequenza di tool call dell'assistente:
+detection, generazione Draw.io, risposta finale.
+"""
+import asyncio
+import time
+from typing import Any, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+# Dimensione dei pezzi restituiti da generate_content_stream
+STREAM_CHUNK_CHARS = 64
+
+
+def _chunks(text: str) -> list[str]:
+    return [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)] or [""]
+
+
+class FakeModels:
+    def __init__(self, client: "FakeGenaiClient"):
+        self._client = client
+
+    def generate_content(self, model: str, contents: Any, config: Any = None) -> FakeResponse:
+        self._client.calls += 1
+        if self._client.latency:
+            time.sleep(self._client.latency)
+        return FakeResponse(self._client.response_for(config))
+
+    def generate_content_stream(self, model: str, contents: Any, config: Any = None):
+        # Stessa latenza totale di generate_content, distribuita sui pezzi della risposta. Come un server
+        # reale il modello genera indipendentemente dal consumatore: il pezzo i è disponibile a
+        # latency * (i + 1) / n dall'inizio, anche se il chiamante lo elabora più tardi.
+        self._client.calls += 1
+        chunks = _chunks(self._client.response_for(config))
+        start = time.perf_counter()
+        for i, chunk in enumerate(chunks):
+            delay = start + self._client.latency * (i + 1) / len(chunks) - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            yield FakeResponse(chunk)
+
+
+class FakeAsyncModels:
+    def __init__(self, client: "FakeGenaiClient"):
+        self._client = client
+
+    async def generate_content(self, model: str, contents: Any, config: Any = None) -> FakeResponse:
+        self._client.calls += 1
+        if self._client.latency:
+            await asyncio.sleep(self._client.latency)
+        return FakeResponse(self._client.response_for(config))
+
+    async def generate_content_stream(self, model: str, contents: Any, config: Any = None):
+        self._client.calls += 1
+        chunks = _chunks(self._client.response_for(config))
+
+        async def stream():
+            start = time.perf_counter()
+            for i, chunk in enumerate(chunks):
+                delay = start + self._client.latency * (i + 1) / len(chunks) - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                yield FakeResponse(chunk)
+
+        return stream()
+
+
+class FakeAsyncClient:
+    def __init__(self, client: "FakeGenaiClient"):
+        self.models = FakeAsyncModels(client)
+
+
+class FakeGenaiClient:
+    """
+    Client GenAI finto: riproduce le risposte registrate per 'detection' e 'drawio'
+    (client.models sincrono e client.aio.models asincrono, anche in streaming).
+    """
+
+    def __init__(self, responses: dict[str, str], latency: float = 0.0):
+        self.responses = responses
+        self.latency = latency
+        self.calls = 0
+        self.models = FakeModels(self)
+        self.aio = FakeAsyncClient(self)
+
+    def response_for(self, config: Any) -> str:
+        system_instruction = getattr(config, "system_instruction", "") or ""
+        if "bounding boxes" in system_instruction:
+            return self.responses["detection"]
+        return self.responses["drawio"]
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Modello chat finto che guida il grafo dell'assistente lungo il percorso standard:
+    object_detection_tool -> generate_drawio_from_image_and_objects_tool -> risposta finale.
+    """
+
+    image_path: str
+    object_names: list[str]
+    latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-gemini-chat"
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "FakeChatModel":
+        return self
+
+    def _generate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._next_step(messages)
+
+    async def _agenerate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._next_step(messages)
+
+    def _next_step(self, messages: list[BaseMessage]) -> ChatResult:
+        step = sum(isinstance(m, ToolMessage) for m in messages)
+        if step == 0:
+            message = AIMessage(content="", tool_calls=[
+                {"name": "object_detection_tool", "args": {"img_path": self.image_path}, "id": "call_detect"}
+            ])
+        elif step == 1:
+            message = AIMessage(content="", tool_calls=[
+                {"name": "generate_drawio_from_image_and_objects_tool",
+                 "args": {"original_image_path": self.image_path, "object_names": self.object_names}, "id": "call_drawio"}
+            ])
+        else:
+            message = AIMessage(content="Draw.io generato.")
+        return ChatResult(generations=[ChatGeneration(message=message)])
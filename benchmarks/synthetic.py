@@ -0,0 +1,86 @@
+"""
+Diagrammi sintetici per i benchmark: icone colorate su sfondo bianco, con le risposte
+"registrate" (bounding box JSON e XML Draw.io) coerenti con l'immagine generata.
+"""
+import json
+import os
+import random
+
+from PIL import Image, ImageDraw
+
+from utils.utils import NORMALIZATION_DIVISOR
+
+
+def make_diagram(folder: str, width: int, height: int, object_count: int, seed: int = 0) -> dict:
+    """
+    Genera un diagramma sintetico e le risposte registrate del modello.
+
+    Args:
+        folder: La cartella dove salvare l'immagine.
+        width: Larghezza in pixel.
+        height: Altezza in pixel.
+        object_count: Numero di icone da disegnare.
+        seed: Seme per colori e forme.
+
+    Returns:
+        dict: image_path, object_names, detection_json e drawio_xml (le risposte senza fence),
+              detection e drawio (le stesse risposte come le restituirebbe il modello, con fence markdown).
+    """
+    rng = random.Random(seed)
+    im = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(im)
+
+    columns = max(1, int(object_count ** 0.5 + 0.999))
+    rows = max(1, (object_count + columns - 1) // columns)
+    cell_w, cell_h = width / columns, height / rows
+    boxes, cells, object_names = [], [], []
+    for i in range(object_count):
+        col, row = i % columns, i // columns
+        x1 = int(col * cell_w + cell_w * 0.2)
+        y1 = int(row * cell_h + cell_h * 0.2)
+        x2 = int(col * cell_w + cell_w * 0.8)
+        y2 = int(row * cell_h + cell_h * 0.6)
+        color = tuple(rng.randrange(0, 200) for _ in range(3))
+        if i % 2:
+            draw.ellipse((x1, y1, x2, y2), fill=color)
+        else:
+            draw.rectangle((x1, y1, x2, y2), fill=color)
+        draw.text((x1, y2 + 4), f"icon {i}", fill="black")
+
+        label = f"icon_{i}"
+        object_names.append(f"{label}.png")
+        boxes.append({
+            "box_2d": [
+                round(y1 / height * NORMALIZATION_DIVISOR), round(x1 / width * NORMALIZATION_DIVISOR),
+                round(y2 / height * NORMALIZATION_DIVISOR), round(x2 / width * NORMALIZATION_DIVISOR),
+            ],
+            "label": label,
+        })
+        # Geometria Draw.io in una pagina 1000x(1000*h/w)
+        scale = 1000 / width
+        cells.append(
+            f'<mxCell id="obj_{i}" value="{label}" style="shape=image;html=1;imageAspect=1;aspect=fixed;image={label}.png" vertex="1" parent="1">'
+            f'<mxGeometry x="{x1 * scale:.0f}" y="{y1 * scale:.0f}" width="{(x2 - x1) * scale:.0f}" height="{(y2 - y1) * scale:.0f}" as="geometry" />'
+            f'</mxCell>'
+        )
+
+    os.makedirs(folder, exist_ok=True)
+    image_path = os.path.join(folder, f"diagram_{width}x{height}_{object_count}.png")
+    im.save(image_path)
+
+    drawio = (
+        '<mxfile compressed="false" host="GeminiAgent" version="1.0" type="device">'
+        '<diagram id="diagram-1" name="Page-1"><mxGraphModel><root>'
+        '<mxCell id="0" /><mxCell id="1" parent="0" />'
+        + "".join(cells)
+        + '</root></mxGraphModel></diagram></mxfile>'
+    )
+    detection_json = json.dumps(boxes, indent=2)
+    return {
+        "image_path": image_path,
+        "object_names": object_names,
+        "detection_json": detection_json,
+        "drawio_xml": drawio,
+        "detection": "```json\n" + detection_json + "\n```",
+        "drawio": "```xml\n" + drawio + "\n```",
+    }
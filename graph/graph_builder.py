@@ -1,23 +1,127 @@
-from langgraph.graph import START, StateGraph
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from langgraph.graph import END, START, StateGraph
 from langgraph.prebuilt import tools_condition
 from langgraph.prebuilt import ToolNode
-from nodes.core import assistant, tools
 from states.state import AgentState
+from utils.clients import get_or_create
 
-## The graph
-builder = StateGraph(AgentState)
-
-# Define nodes: these do the work
-builder.add_node("assistant", assistant)
-builder.add_node("tools", ToolNode(tools))
-
-# Define edges: these determine how the control flow moves
-builder.add_edge(START, "assistant")
-builder.add_conditional_edges(
-    "assistant",
-    # If the latest message requires a tool, route to tools
-    # Otherwise, provide a direct response
-    tools_condition,
-)
-builder.add_edge("tools", "assistant")
-graph = builder.compile()
\ No newline at end of file
+# I grafi vengono compilati al primo uso (get_graph() o l'accesso a graph_builder.graph):
+# importare questo modulo non costruisce i nodi, i tool né i client.
+
+
+def build_fast_graph():
+    from nodes.pipeline import detect, adetect, crop, acrop, generate, agenerate, embed, aembed, save, asave, route_after_stage
+
+    ## The fast pipeline
+    # Percorso deterministico detect -> crop -> generate -> embed -> save: nessuna chiamata LLM di orchestrazione
+    fast_builder = StateGraph(AgentState)
+
+    fast_stages = [
+        ("detect", RunnableLambda(detect, afunc=adetect)),
+        ("crop", RunnableLambda(crop, afunc=acrop)),
+        ("generate", RunnableLambda(generate, afunc=agenerate)),
+        ("embed", RunnableLambda(embed, afunc=aembed)),
+        ("save", RunnableLambda(save, afunc=asave)),
+    ]
+    for name, node in fast_stages:
+        fast_builder.add_node(name, node)
+
+    fast_builder.add_edge(START, fast_stages[0][0])
+    for (name, _), (next_name, _) in zip(fast_stages, fast_stages[1:]):
+        # Al primo errore la pipeline termina con il messaggio di errore già nello stato
+        fast_builder.add_conditional_edges(name, route_after_stage, {"continue": next_name, "error": END})
+    fast_builder.add_edge(fast_stages[-1][0], END)
+    return fast_builder.compile()
+
+
+def build_speculative_graph():
+    from nodes.pipeline import (
+        detect, adetect, crop, acrop, embed, aembed, save, asave, route_after_stage,
+        generate_layout, agenerate_layout, merge, amerge,
+    )
+
+    ## The speculative pipeline
+    # Il layout viene generato in parallelo a detect -> crop (la latenza è il massimo delle due chiamate
+    # Gemini invece della somma); merge attende entrambi i rami e associa i ritagli alle celle
+    speculative_builder = StateGraph(AgentState)
+    speculative_builder.add_node("detect", RunnableLambda(detect, afunc=adetect))
+    speculative_builder.add_node("crop", RunnableLambda(crop, afunc=acrop))
+    speculative_builder.add_node("generate_layout", RunnableLambda(generate_layout, afunc=agenerate_layout))
+    speculative_builder.add_node("merge", RunnableLambda(merge, afunc=amerge))
+    speculative_builder.add_node("embed", RunnableLambda(embed, afunc=aembed))
+    speculative_builder.add_node("save", RunnableLambda(save, afunc=asave))
+
+    speculative_builder.add_edge(START, "detect")
+    speculative_builder.add_edge(START, "generate_layout")
+    speculative_builder.add_conditional_edges("detect", route_after_stage, {"continue": "crop", "error": END})
+    speculative_builder.add_edge(["crop", "generate_layout"], "merge")
+    speculative_builder.add_conditional_edges("merge", route_after_stage, {"continue": "embed", "error": END})
+    speculative_builder.add_conditional_edges("embed", route_after_stage, {"continue": "save", "error": END})
+    speculative_builder.add_edge("save", END)
+    return speculative_builder.compile()
+
+
+def select_pipeline(state: AgentState, config: RunnableConfig) -> str:
+    """
+    Sceglie il percorso all'invocazione: config={"configurable": {"pipeline": "fast"}}
+    usa la pipeline deterministica, "speculative" la variante con layout generato in parallelo
+    alla detection, altrimenti l'assistant decide quali tool chiamare.
+    """
+    pipeline = config.get("configurable", {}).get("pipeline", "agent")
+    if pipeline == "fast":
+        return "fast_pipeline"
+    if pipeline == "speculative":
+        return "speculative_pipeline"
+    return "assistant"
+
+
+def build_graph():
+    from nodes.core import assistant, aassistant, tools
+
+    ## The graph
+    builder = StateGraph(AgentState)
+
+    # Define nodes: these do the work
+    # assistant ha un'implementazione sincrona (invoke/stream) e una asincrona (ainvoke/astream)
+    builder.add_node("assistant", RunnableLambda(assistant, afunc=aassistant))
+    builder.add_node("tools", ToolNode(tools))
+    builder.add_node("fast_pipeline", get_fast_graph())
+    builder.add_node("speculative_pipeline", get_speculative_graph())
+
+    # Define edges: these determine how the control flow moves
+    builder.add_conditional_edges(START, select_pipeline, ["assistant", "fast_pipeline", "speculative_pipeline"])
+    builder.add_conditional_edges(
+        "assistant",
+        # If the latest message requires a tool, route to tools
+        # Otherwise, provide a direct response
+        tools_condition,
+    )
+    builder.add_edge("tools", "assistant")
+    builder.add_edge("fast_pipeline", END)
+    builder.add_edge("speculative_pipeline", END)
+    return builder.compile()
+
+
+def get_fast_graph():
+    return get_or_create("fast_graph", build_fast_graph)
+
+
+def get_speculative_graph():
+    return get_or_create("speculative_graph", build_speculative_graph)
+
+
+def get_graph():
+    """
+    Restituisce il grafo compilato condiviso dal processo, compilandolo al primo uso.
+    """
+    return get_or_create("graph", build_graph)
+
+
+_LAZY_GRAPHS = {"graph": get_graph, "fast_graph": get_fast_graph, "speculative_graph": get_speculative_graph}
+
+
+def __getattr__(name: str):
+    # "from graph.graph_builder import graph" continua a funzionare: il grafo viene compilato a quel punto
+    if name in _LAZY_GRAPHS:
+        return _LAZY_GRAPHS[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -2,45 +2,65 @@ from states.state import AgentState
 import os
 # Import the load_dotenv function from the dotenv library
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
 from tools.object_detection_tools import detect_objects_in_image as object_detection_tool
 from tools.drawio_tools import generate_drawio_from_image_and_objects as drawio_tool
 from tools.drawio_tools import save_drawio_xml as drawio_saver_tool
-from langfuse.callback import CallbackHandler
+from utils.message_compaction import compact_messages, estimate_tokens
+from utils.clients import get_or_create
 
 load_dotenv()
 
 # Read your API key from the environment variable or set it manually
 api_key = os.getenv("GEMINI_API_KEY")
-langfuse_secret_key = os.getenv("LANGFUSE_SECRET_KEY")
-langfuse_public_key = os.getenv("LANGFUSE_PUBLIC_KEY")
-
-# Initialize Langfuse CallbackHandler for LangGraph/Langchain (tracing)
-langfuse_handler = CallbackHandler(
-    public_key=langfuse_public_key,
-    secret_key=langfuse_secret_key,
-    host="http://localhost:3000"
-)
-
-chat = ChatGoogleGenerativeAI(
-    model= "gemini-2.5-flash-preview-05-20",
-    temperature=0,
-    max_retries=2,
-    google_api_key=api_key,
-    thinking_budget= 0
-)
 
 tools = [
     object_detection_tool,
     drawio_tool,
 ]
 
-chat_with_tools = chat.bind_tools(tools)
+def _create_chat():
+    # Import al primo uso: langchain_google_genai è lento da importare
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(
+        model= "gemini-2.5-flash-preview-05-20",
+        temperature=0,
+        max_retries=2,
+        google_api_key=api_key,
+        thinking_budget= 0
+    )
+
+def get_chat():
+    return get_or_create("chat", _create_chat)
+
+def get_chat_with_tools():
+    """
+    Restituisce il modello chat con i tool associati, costruito al primo uso e condiviso dal processo.
+    """
+    return get_or_create("chat_with_tools", lambda: get_chat().bind_tools(tools))
+
+def __getattr__(name: str):
+    # nodes.core.chat e nodes.core.chat_with_tools restano accessibili, costruiti al primo accesso
+    if name == "chat":
+        return get_chat()
+    if name == "chat_with_tools":
+        return get_chat_with_tools()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+sys_msg = "You are a helpful assistant with access to tools. Your goal is to generate a drawio file following the steps:" \
+"- Extract objects from the original image that user provides" \
+"- Generate a drawio using the images extracted at the previous step"
+
+def compacted_history(state: AgentState):
+    # Solo il prompt inviato viene compattato entro il budget: lo stato conserva la cronologia completa
+    return compact_messages(state["messages"], reserved_tokens=estimate_tokens(sys_msg))
 
 def assistant(state: AgentState):
-    sys_msg = "You are a helpful assistant with access to tools. Your goal is to generate a drawio file following the steps:" \
-    "- Extract objects from the original image that user provides" \
-    "- Generate a drawio using the images extracted at the previous step"
     return {
-        "messages": [chat_with_tools.invoke([sys_msg] + state["messages"])]
+        "messages": [get_chat_with_tools().invoke([sys_msg] + compacted_history(state))]
+    }
+
+async def aassistant(state: AgentState):
+    return {
+        "messages": [await get_chat_with_tools().ainvoke([sys_msg] + compacted_history(state))]
     }
\ No newline at end of file
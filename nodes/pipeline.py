@@ -0,0 +1,184 @@
+import asyncio
+import os
+import re
+from typing import Optional
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from states.state import AgentState
+from tools.object_detection_tools import run_detection, arun_detection, crop_detected_objects, load_detection_image
+from utils.boxes import BoundingBoxes
+from utils.layout_merge import bind_crops_to_layout
+from tools.drawio_tools import (
+    DRAWIO_COMPRESSED,
+    PROMPT_IMAGE_FOLDER,
+    generate_drawio_xml,
+    agenerate_drawio_xml,
+    optimize_drawio_assets,
+    save_drawio_xml_streaming,
+)
+from utils.workspace import workspace_of
+
+# Pipeline deterministica detect -> crop -> generate -> embed -> save, senza passare dall'assistant:
+# ogni nodo legge e scrive i campi dedicati di AgentState e in caso di errore valorizza "error".
+# I file della richiesta (ritagli, drawio_output.drawio) vanno nel suo workspace (utils.workspace).
+
+# Stesso formato usato da app.py e app_for_submission.py: "<domanda> Path: files/<nome file>"
+IMAGE_PATH_PATTERN = re.compile(r"Path:\s*(\S+)")
+
+
+def find_image_path(state: AgentState) -> Optional[str]:
+    """
+    Restituisce il percorso dell'immagine dallo stato o, in mancanza, dall'ultimo messaggio utente.
+    """
+    if state.get("image_path"):
+        return state["image_path"]
+    for message in reversed(state["messages"]):
+        if isinstance(message, HumanMessage) and isinstance(message.content, str):
+            match = IMAGE_PATH_PATTERN.search(message.content)
+            if match:
+                return match.group(1)
+    return None
+
+
+def pipeline_error(message: str) -> dict:
+    print(message)
+    return {"error": message, "messages": [AIMessage(content=message)]}
+
+
+def detect(state: AgentState) -> dict:
+    image_path = find_image_path(state)
+    if not image_path:
+        return pipeline_error("Error: no image path found in the request.")
+    try:
+        _, result_text, _ = run_detection(image_path)
+    except FileNotFoundError:
+        return pipeline_error(f"Error: Image file not found at {image_path}.")
+    except Exception as e:
+        return pipeline_error(f"Error detecting objects: {str(e)}")
+    return {"image_path": image_path, "detection_json": result_text, "error": None}
+
+
+async def adetect(state: AgentState) -> dict:
+    image_path = find_image_path(state)
+    if not image_path:
+        return pipeline_error("Error: no image path found in the request.")
+    try:
+        _, result_text, _ = await arun_detection(image_path)
+    except FileNotFoundError:
+        return pipeline_error(f"Error: Image file not found at {image_path}.")
+    except Exception as e:
+        return pipeline_error(f"Error detecting objects: {str(e)}")
+    return {"image_path": image_path, "detection_json": result_text, "error": None}
+
+
+def crop(state: AgentState) -> dict:
+    try:
+        # L'immagine ridimensionata è già nella cache del processo dopo la detection
+        im = load_detection_image(state["image_path"])
+        saved_paths = crop_detected_objects(im, state["detection_json"], workspace_of(state))
+    except Exception as e:
+        return pipeline_error(f"Error detecting objects: invalid model response ({e})")
+    if not saved_paths:
+        return pipeline_error("Error: no objects detected in the image.")
+    return {"object_names": [os.path.basename(path) for path in saved_paths]}
+
+
+async def acrop(state: AgentState) -> dict:
+    return await asyncio.to_thread(crop, state)
+
+
+def generate(state: AgentState) -> dict:
+    try:
+        xml_output = generate_drawio_xml(state["image_path"], state["object_names"], PROMPT_IMAGE_FOLDER)
+    except Exception as e:
+        return pipeline_error(f"Errore durante la generazione dell'XML Draw.io: {str(e)}")
+    return {"drawio_xml": xml_output}
+
+
+async def agenerate(state: AgentState) -> dict:
+    try:
+        xml_output = await agenerate_drawio_xml(state["image_path"], state["object_names"], PROMPT_IMAGE_FOLDER)
+    except Exception as e:
+        return pipeline_error(f"Errore durante la generazione dell'XML Draw.io: {str(e)}")
+    return {"drawio_xml": xml_output}
+
+
+def generate_layout(state: AgentState) -> dict:
+    """
+    Genera il layout speculativo (senza elenco degli oggetti) in parallelo alla detection.
+    """
+    image_path = find_image_path(state)
+    if not image_path:
+        return {}  # L'errore viene riportato da detect
+    try:
+        xml_output = generate_drawio_xml(image_path, None, PROMPT_IMAGE_FOLDER)
+    except Exception as e:
+        return pipeline_error(f"Errore durante la generazione dell'XML Draw.io: {str(e)}")
+    return {"drawio_xml": xml_output}
+
+
+async def agenerate_layout(state: AgentState) -> dict:
+    image_path = find_image_path(state)
+    if not image_path:
+        return {}
+    try:
+        xml_output = await agenerate_drawio_xml(image_path, None, PROMPT_IMAGE_FOLDER)
+    except Exception as e:
+        return pipeline_error(f"Errore durante la generazione dell'XML Draw.io: {str(e)}")
+    return {"drawio_xml": xml_output}
+
+
+def merge(state: AgentState) -> dict:
+    """
+    Associa i ritagli alle celle del layout speculativo per etichetta o geometria.
+    """
+    if state.get("error"):
+        return {}
+    try:
+        # Stessa risoluzione usata da crop: box in pixel, filtro di validità e nomi dei ritagli coincidono
+        width, height = load_detection_image(state["image_path"]).size
+        bounding_boxes = BoundingBoxes.from_json(state["detection_json"], width, height)
+        xml_output, report = bind_crops_to_layout(state["drawio_xml"], bounding_boxes)
+    except Exception as e:
+        return pipeline_error(f"Errore durante l'associazione dei ritagli al layout Draw.io: {str(e)}")
+    print(f"Layout merge: {report}")
+    return {"drawio_xml": xml_output}
+
+
+async def amerge(state: AgentState) -> dict:
+    return await asyncio.to_thread(merge, state)
+
+
+def embed(state: AgentState) -> dict:
+    # Prepara i ritagli referenziati (ridimensionamento/ricodifica); i dati base64
+    # vengono incorporati in streaming durante il salvataggio
+    optimize_drawio_assets(state["drawio_xml"], workspace_of(state))
+    return {}
+
+
+async def aembed(state: AgentState) -> dict:
+    return await asyncio.to_thread(embed, state)
+
+
+def save(state: AgentState) -> dict:
+    workspace = workspace_of(state)
+    result = save_drawio_xml_streaming(state["drawio_xml"], "drawio_output", output_directory=workspace,
+                                       base_folder=workspace, compressed=DRAWIO_COMPRESSED)
+    if result.startswith("Errore"):
+        return pipeline_error(result)
+    return {
+        "drawio_path": os.path.abspath(os.path.join(workspace, "drawio_output.drawio")),
+        "messages": [AIMessage(content=result)],
+    }
+
+
+async def asave(state: AgentState) -> dict:
+    return await asyncio.to_thread(save, state)
+
+
+def route_after_stage(state: AgentState) -> str:
+    """
+    Interrompe la pipeline al primo errore.
+    """
+    return "error" if state.get("error") else "continue"
@@ -1,7 +1,23 @@
-from typing import TypedDict, Annotated
+from typing import TypedDict, Annotated, NotRequired, Optional
 from langchain_core.messages import AnyMessage
 from langgraph.graph.message import add_messages
 
 
+def keep_first_error(current: Optional[str], update: Optional[str]) -> Optional[str]:
+    """
+    Mantiene il primo errore: i rami paralleli della pipeline possono fallire nello stesso passo.
+    """
+    return current or update
+
+
 class AgentState(TypedDict):
-    messages: Annotated[list[AnyMessage], add_messages]
\ No newline at end of file
+    messages: Annotated[list[AnyMessage], add_messages]
+    # Cartella della richiesta (utils.workspace.create_workspace); senza, i file vanno in output_llm/
+    workspace: NotRequired[str]
+    # Campi usati solo dalle pipeline deterministiche (fast_graph, speculative_graph); il grafo con assistant li ignora
+    image_path: NotRequired[str]
+    detection_json: NotRequired[str]
+    object_names: NotRequired[list[str]]
+    drawio_xml: NotRequired[str]
+    drawio_path: NotRequired[str]
+    error: Annotated[NotRequired[Optional[str]], keep_first_error]
@@ -0,0 +1,31 @@
+from utils.answer_store import AnswerStore, task_input_hash
+
+
+def test_saved_answer_is_returned_for_the_same_input(tmp_path):
+    store = AnswerStore(str(tmp_path / "answers.sqlite3"))
+    input_hash = task_input_hash("How many services?", None, str(tmp_path))
+    store.save_answer("task-1", input_hash, "How many services?", None, "3")
+    assert store.get_answer("task-1", task_input_hash("How many services?", None, str(tmp_path))) == "3"
+    assert store.get_answer("task-2", input_hash) is None
+
+
+def test_changed_question_or_file_is_a_miss(tmp_path):
+    attachment = tmp_path / "diagram.png"
+    attachment.write_bytes(b"first version")
+    store = AnswerStore(str(tmp_path / "answers.sqlite3"))
+    input_hash = task_input_hash("Which database?", "diagram.png", str(tmp_path))
+    store.save_answer("task-1", input_hash, "Which database?", "diagram.png", "postgres")
+
+    assert store.get_answer("task-1", task_input_hash("Which cache?", "diagram.png", str(tmp_path))) is None
+    attachment.write_bytes(b"second version")
+    assert store.get_answer("task-1", task_input_hash("Which database?", "diagram.png", str(tmp_path))) is None
+
+
+def test_errors_are_not_served_as_answers(tmp_path):
+    store = AnswerStore(str(tmp_path / "answers.sqlite3"))
+    input_hash = task_input_hash("Which database?", None, str(tmp_path))
+    store.save_error("task-1", input_hash, "Which database?", None, "timeout")
+    assert store.get_answer("task-1", input_hash) is None
+    store.save_answer("task-1", input_hash, "Which database?", None, "postgres")
+    assert store.get_answer("task-1", input_hash) == "postgres"
+    assert [row["answer"] for row in store.all_answers()] == ["postgres"]
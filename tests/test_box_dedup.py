@@ -0,0 +1,42 @@
+from utils.boxes import BoundingBoxes
+from utils.utils import suppress_duplicate_boxes
+
+VPC = {"box_2d": [100, 100, 900, 900], "label": "vpc"}
+
+
+def _kept(items: list[dict]) -> list[str]:
+    boxes = BoundingBoxes.from_json(items, 1000, 1000)
+    return [items[i]["label"] for i in suppress_duplicate_boxes(boxes)]
+
+
+def test_icon_inside_container_is_kept():
+    assert _kept([VPC, {"box_2d": [200, 200, 300, 300], "label": "lambda"}]) == ["vpc", "lambda"]
+
+
+def test_text_labels_inside_container_are_pruned():
+    items = [
+        VPC,
+        {"box_2d": [120, 120, 150, 400], "label": "text_label"},
+        {"box_2d": [160, 120, 190, 400], "label": "title-bar"},
+        {"box_2d": [200, 200, 300, 300], "label": "Caption"},
+    ]
+    assert _kept(items) == ["vpc"]
+
+
+def test_label_keywords_match_whole_tokens_only():
+    items = [
+        VPC,
+        {"box_2d": [200, 200, 300, 300], "label": "amazon_textract"},
+        {"box_2d": [400, 400, 500, 500], "label": "subtitles-service"},
+    ]
+    assert _kept(items) == ["vpc", "amazon_textract", "subtitles-service"]
+
+
+def test_contained_box_with_same_label_is_pruned():
+    items = [VPC, {"box_2d": [150, 150, 850, 850], "label": "vpc"}, {"box_2d": [200, 200, 300, 300], "label": "s3"}]
+    assert _kept(items) == ["vpc", "s3"]
+
+
+def test_overlapping_duplicate_keeps_first_box():
+    items = [{"box_2d": [100, 100, 300, 300], "label": "db"}, {"box_2d": [105, 105, 305, 305], "label": "db"}]
+    assert _kept(items) == ["db"]
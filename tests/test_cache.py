@@ -0,0 +1,62 @@
+import os
+import time
+
+from utils.cache import DiskCache
+
+
+def _age(cache: DiskCache, key: str, seconds: float) -> None:
+    past = time.time() - seconds
+    os.utime(cache._path(key), (past, past))
+
+
+def test_set_and_get_round_trip(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    cache.set("aa01", "value")
+    assert cache.get("aa01") == "value"
+    assert cache.get("bb02") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_overwrite_does_not_inflate_total_size(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    cache.set("aa01", "x")
+    for _ in range(5):
+        cache.set("aa01", "y" * 100)
+    assert cache.stats()["bytes"] == cache._scan_size()
+
+
+def test_eviction_removes_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=10 ** 6)
+    for key in ("aa01", "bb02", "cc03"):
+        cache.set(key, "v" * 100)
+    _age(cache, "aa01", 30)
+    _age(cache, "bb02", 20)
+    _age(cache, "cc03", 10)
+    assert cache.get("aa01") == "v" * 100  # Il hit rende aa01 la voce usata più di recente
+
+    cache.max_bytes = cache._scan_size() - 1
+    assert cache.evict() == 1
+    assert cache.get("bb02") is None
+    assert cache.get("aa01") is not None and cache.get("cc03") is not None
+
+
+def test_entries_unused_for_max_age_expire_in_get_and_evict(tmp_path):
+    cache = DiskCache(str(tmp_path), max_age_seconds=60)
+    cache.set("aa01", "old")
+    cache.set("bb02", "also old")
+    cache.set("cc03", "fresh")
+    _age(cache, "aa01", 120)
+    _age(cache, "bb02", 120)
+
+    assert cache.get("aa01") is None
+    assert not os.path.exists(cache._path("aa01"))
+    assert cache.evict() == 1
+    assert not os.path.exists(cache._path("bb02"))
+    assert cache.get("cc03") == "fresh"
+
+
+def test_bypass_skips_reads_and_writes(tmp_path):
+    cache = DiskCache(str(tmp_path), bypass=True)
+    cache.set("aa01", "value")
+    assert cache.get("aa01") is None
+    assert not os.path.exists(cache._path("aa01"))
@@ -0,0 +1,36 @@
+from xml.etree import ElementTree as ET
+
+from tools.drawio_tools import compress_drawio_xml, decompress_drawio_xml, is_compressed_drawio_xml
+
+DIAGRAM = (
+    '<mxfile><diagram id="d1" name="Page-1"><mxGraphModel><root>'
+    '<mxCell id="0"/><mxCell id="1" parent="0"/>'
+    '<mxCell id="2" value="Città &amp; servizi" style="shape=image;image=data:image/png,AAAA;" vertex="1" parent="1">'
+    '<mxGeometry x="10" y="20" width="80" height="40" as="geometry"/></mxCell>'
+    '</root></mxGraphModel></diagram></mxfile>'
+)
+
+
+def _cells(xml_content: str) -> list[dict]:
+    return [cell.attrib for cell in ET.fromstring(xml_content).iter("mxCell")]
+
+
+def test_compress_then_decompress_round_trip():
+    compressed = compress_drawio_xml(DIAGRAM)
+    assert is_compressed_drawio_xml(compressed)
+    assert not _cells(compressed)
+
+    restored = decompress_drawio_xml(compressed)
+    assert not is_compressed_drawio_xml(restored)
+    assert _cells(restored) == _cells(DIAGRAM)
+
+
+def test_bare_graph_model_is_wrapped_and_round_trips():
+    model = DIAGRAM[DIAGRAM.index("<mxGraphModel>"):DIAGRAM.index("</diagram>")]
+    restored = decompress_drawio_xml(compress_drawio_xml(model))
+    assert _cells(restored) == _cells(DIAGRAM)
+
+
+def test_uncompressed_input_is_left_as_is():
+    assert not is_compressed_drawio_xml(DIAGRAM)
+    assert _cells(decompress_drawio_xml(DIAGRAM)) == _cells(DIAGRAM)
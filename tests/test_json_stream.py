@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from utils.json_stream import JsonArrayStream
+
+ITEMS = [
+    {"box_2d": [10, 20, 30, 40], "label": "load balancer"},
+    {"box_2d": [50, 60, 70, 80], "label": "db [primary] \"main\" {x}"},
+    {"box_2d": [1, 2, 3, 4], "label": "cache\\edge"},
+]
+
+
+def _feed_all(stream: JsonArrayStream, chunks) -> list:
+    items = []
+    for chunk in chunks:
+        items += stream.feed(chunk)
+    return items
+
+
+def test_fenced_response_in_one_piece():
+    stream = JsonArrayStream()
+    text = "```json\n" + json.dumps(ITEMS, indent=2) + "\n```"
+    assert stream.feed(text) == ITEMS
+    assert stream.done
+    assert stream.items_count == len(ITEMS)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64])
+def test_split_input_yields_items_as_they_close(chunk_size):
+    text = "Here you go:\n```json\n" + json.dumps(ITEMS) + "\n```\ntrailing text [ignored]"
+    stream = JsonArrayStream()
+    assert _feed_all(stream, [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]) == ITEMS
+    assert stream.done
+
+
+def test_item_is_returned_before_the_array_closes():
+    stream = JsonArrayStream()
+    assert stream.feed('[{"label": "a"}, {"lab') == [{"label": "a"}]
+    assert stream.feed('el": "b"}') == [{"label": "b"}]
+    assert not stream.done
+    assert stream.feed("]") == []
+    assert stream.done
+
+
+def test_scalars_are_ignored_and_text_after_end_is_dropped():
+    stream = JsonArrayStream()
+    assert stream.feed('[1, "x", {"a": 1}] [{"b": 2}]') == [{"a": 1}]
+    assert stream.feed('{"c": 3}') == []
+
+
+def test_invalid_item_raises():
+    with pytest.raises(json.JSONDecodeError):
+        JsonArrayStream().feed('[{"a": tru}]')
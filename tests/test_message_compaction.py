@@ -0,0 +1,38 @@
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+
+from utils.message_compaction import TRUNCATED_CHARS, compact_messages
+
+QUESTION = "Describe the architecture in this diagram. " * 40 + " Path: files/diagram.png"
+
+
+def _history() -> list:
+    return [
+        SystemMessage(content="You are a diagram assistant. " * 40),
+        HumanMessage(content=QUESTION),
+        AIMessage(content="Let me look at the image first. " * 40),
+        ToolMessage(content="x" * 5000, tool_call_id="call-1"),
+        AIMessage(content="Done."),
+    ]
+
+
+def test_human_and_system_messages_survive_a_tiny_budget():
+    messages = _history()
+    compacted = compact_messages(messages, budget=10)
+    assert compacted[0].content == messages[0].content
+    assert compacted[1].content == QUESTION
+    assert compacted[1].content.endswith(" Path: files/diagram.png")
+
+
+def test_ai_and_tool_messages_are_truncated_without_touching_the_state():
+    messages = _history()
+    compacted = compact_messages(messages, budget=10)
+    assert len(compacted) == len(messages)
+    assert len(compacted[2].content) < len(messages[2].content)
+    assert compacted[3].content.startswith("x" * TRUNCATED_CHARS)
+    assert compacted[3].tool_call_id == "call-1"
+    assert messages[3].content == "x" * 5000
+
+
+def test_history_within_budget_is_unchanged():
+    messages = _history()[:2]
+    assert compact_messages(messages, budget=100000) == messages
@@ -0,0 +1,37 @@
+import numpy as np
+
+from utils.tiling import merge_tile_detections, tile_grid
+
+
+def test_nested_boxes_from_different_tiles_are_kept():
+    tiles = tile_grid(2000, 1000)
+    boxes, labels = merge_tile_detections(
+        np.array([[100, 100, 1500, 900], [1300, 300, 1400, 400]]), ["vpc", "lambda"], np.array([0, 1]), tiles, 2000, 1000
+    )
+    assert labels == ["vpc", "lambda"]
+    assert boxes.tolist() == [[100, 100, 1500, 900], [1300, 300, 1400, 400]]
+
+
+def test_container_does_not_chain_icons_of_the_same_tile():
+    tiles = tile_grid(2000, 1000)
+    boxes, labels = merge_tile_detections(
+        np.array([[100, 100, 1500, 900], [1100, 300, 1160, 360], [1300, 300, 1360, 360]]),
+        ["group", "icon", "icon"], np.array([0, 1, 1]), tiles, 2000, 1000,
+    )
+    assert sorted(labels) == ["group", "icon", "icon"]
+
+
+def test_fragment_cut_at_seam_is_merged_into_whole_object():
+    tiles = tile_grid(2000, 1000)
+    boxes, labels = merge_tile_detections(
+        np.array([[900, 100, 1024, 200], [900, 100, 1100, 200]]), ["db", "db"], np.array([0, 1]), tiles, 2000, 1000
+    )
+    assert labels == ["db"]
+    assert boxes.tolist() == [[900, 100, 1100, 200]]
+
+
+def test_object_split_across_four_tiles_is_merged():
+    tiles = tile_grid(2000, 2000)
+    pieces = np.array([[900, 900, 1024, 1024], [976, 900, 1100, 1024], [900, 976, 1024, 1100], [976, 976, 1100, 1100]])
+    boxes, labels = merge_tile_detections(pieces, ["queue"] * 4, np.array([0, 2, 6, 8]), tiles, 2000, 2000)
+    assert boxes.tolist() == [[900, 900, 1100, 1100]]
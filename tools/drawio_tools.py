@@ -1,9 +1,15 @@
 import os
-from google import genai
-from google.genai import types
-from PIL import Image
-from io import BytesIO
-from langchain_core.tools import tool
+import asyncio
+from typing import Annotated, Optional
+from langchain_core.tools import StructuredTool
+from langgraph.prebuilt import InjectedState
+from utils.cache import DiskCache, hash_key
+from utils.image_cache import load_thumbnail, file_digest
+from utils.asset_store import AssetStore, get_asset_store
+from utils.asset_optimizer import optimize_assets, optimize_asset, image_reference
+from utils.metrics import timed, observe_size, instrumented
+from utils.clients import get_genai_client
+from utils.workspace import workspace_of
 
 GOOGLE_API_KEY = os.getenv("GEMINI_API_KEY")
 
@@ -19,16 +25,72 @@ MODEL_NAME = "gemini-2.5-pro-preview-06-05"
 # Altrimenti, un'opzione robusta:
 # MODEL_NAME = "gemini-1.5-pro-latest"
 
-try:
-    client = genai.Client(api_key=GOOGLE_API_KEY)
-except Exception as e:
-    print(f"Errore durante l'inizializzazione del client GenAI: {e}")
-    client = None # o gestire l'errore come appropriato
+# Versione del prompt di generazione: va incrementata ad ogni modifica di prompt o system instructions,
+# così le voci in cache prodotte con il prompt precedente non vengono più riutilizzate.
+PROMPT_VERSION = "1"
+
+# Nome della cartella dei ritagli citato nel prompt: i file reali sono nel workspace della richiesta
+# (utils.workspace), che non compare nel prompt così da non variare tra una richiesta e l'altra
+PROMPT_IMAGE_FOLDER = "output_llm"
+
+# Se True il tool riceve l'XML con generate_content_stream e lo scrive sul file .drawio cella per cella,
+# ottimizzando e incorporando ogni immagine appena la sua mxCell è completa (vedi StreamingDrawioWriter).
+# Con DRAWIO_COMPRESSED la compressione richiede il documento intero: si torna alla generazione non in streaming.
+DRAWIO_STREAMING = os.getenv("DRAWIO_STREAMING", "0") == "1"
+
+# Se True il file .drawio viene salvato nella forma compressa nativa (deflate + base64)
+DRAWIO_COMPRESSED = os.getenv("DRAWIO_COMPRESSED", "0") == "1"
+
+# Ottimizzazione dei ritagli prima dell'embedding: riduzione alla geometria Draw.io (x ASSET_DPI_SCALE),
+# quantizzazione opzionale e ricodifica in PNG ottimizzato o WebP
+ASSET_OPTIMIZE = os.getenv("ASSET_OPTIMIZE", "1") == "1"
+ASSET_DPI_SCALE = float(os.getenv("ASSET_DPI_SCALE", "2.0"))
+ASSET_QUANTIZE = os.getenv("ASSET_QUANTIZE", "0") == "1"
+ASSET_FORMAT = os.getenv("ASSET_FORMAT", "PNG")
+
+def optimize_drawio_assets(xml_content: str, base_folder: str) -> list[dict]:
+    """
+    Applica l'ottimizzazione configurata ai ritagli referenziati nell'XML (vedi utils.asset_optimizer).
+    """
+    if not ASSET_OPTIMIZE:
+        return []
+    return optimize_assets(xml_content, get_asset_store(base_folder), dpi_scale=ASSET_DPI_SCALE,
+                           quantize=ASSET_QUANTIZE, output_format=ASSET_FORMAT)
+
+# Marcatore del layout speculativo nella chiave di cache (prompt senza elenco degli oggetti)
+SPECULATIVE_LAYOUT = "speculative-layout"
+
+# Cache dell'XML grezzo restituito dal modello (prima del post-processing base64).
+drawio_cache = DiskCache(
+    os.getenv("DRAWIO_CACHE_DIR", os.path.join(".cache", "drawio")),
+    max_bytes=int(os.getenv("DRAWIO_CACHE_MAX_BYTES", str(128 * 1024 * 1024))),
+    max_age_seconds=float(os.getenv("DRAWIO_CACHE_MAX_AGE_SECONDS", str(30 * 24 * 3600))),
+    bypass=os.getenv("DRAWIO_CACHE_BYPASS", "0") == "1",
+)
+
+def drawio_cache_key(image_hash: str, object_names: Optional[list[str]]) -> str:
+    """
+    Calcola la chiave di cache per la generazione Draw.io.
+
+    Args:
+        image_hash: L'hash del file immagine originale (vedi utils.image_cache.file_digest).
+        object_names: I nomi degli oggetti da incorporare (l'ordine non conta),
+                      o None per il layout speculativo generato prima della detection.
+
+    Returns:
+        str: La chiave di cache.
+    """
+    if object_names is None:
+        return hash_key(image_hash, SPECULATIVE_LAYOUT, MODEL_NAME, PROMPT_VERSION)
+    return hash_key(image_hash, "\n".join(sorted(object_names)), MODEL_NAME, PROMPT_VERSION)
 
 import base64
+import io
 import mimetypes
 import os
 import re
+import zlib
+from urllib.parse import quote, unquote
 from xml.etree import ElementTree as ET
 from typing import Optional
 
@@ -64,83 +126,312 @@ def convert_image_to_base64(image_path: str) -> Optional[str]:
         print(f"Error converting {image_path} to base64: {e}")
         return None
 
-def replace_image_references_in_drawio_xml(xml_content: str, base_folder: str = "output_llm") -> str:
+def resolve_image_data_uri(filename: str, base_folder: str = "output_llm", asset_store: Optional[AssetStore] = None) -> Optional[str]:
+    """
+    Restituisce il data URI Draw.io di un'immagine, cercandola prima nell'archivio in memoria
+    e, se assente, leggendola da disco in base_folder.
+
+    Args:
+        filename: Nome del file immagine referenziato nell'XML
+        base_folder: Cartella base dove cercare le immagini
+        asset_store: Archivio in memoria dei ritagli (default: quello associato a base_folder)
+
+    Returns:
+        Stringa base64 nel formato Draw.io o None se l'immagine non è disponibile
+    """
+    if asset_store is None:
+        asset_store = get_asset_store(base_folder)
+    asset = asset_store.get(filename)
+    if asset is not None:
+        return asset.data_uri
+    return convert_image_to_base64(os.path.join(base_folder, filename))
+
+# Attributi XML nell'ordine in cui compaiono: scorrendoli in sequenza un "style=" o un "image="
+# dentro il valore di un altro attributo (es. l'etichetta value) non viene mai interpretato
+XML_ATTRIBUTE_PATTERN = re.compile(r'([\w:.-]+)\s*=\s*("[^"]*"|\'[^\']*\')')
+# Parti di uno style separate da ';', senza spezzare le entità XML (&quot; ecc.)
+STYLE_PART_PATTERN = re.compile(r'(?:&#?\w+;|[^;])+')
+# Quote (letterali o come entità XML) attorno al valore image= di uno style
+STYLE_IMAGE_QUOTES = ("&quot;", "&apos;", '"', "'")
+
+# Dimensione dei blocchi (multipla di 3) con cui i dati vengono codificati in base64 e scritti
+BASE64_CHUNK_SIZE = 3 * 16 * 1024
+
+class StreamingImageEmbedder:
+    """
+    Incorpora in un solo passaggio le immagini referenziate negli attributi style di un XML Draw.io,
+    scrivendo direttamente su un file handle testuale.
+
+    Il testo può arrivare a pezzi (feed): viene elaborato fino all'ultimo '>' ricevuto, dato che
+    i valori degli attributi generati da Draw.io codificano '>' come &gt;. Vengono sostituite solo
+    le parti image= degli attributi style il cui riferimento si risolve nell'asset_store o su disco.
+    I dati base64 di ogni asset vengono scritti a blocchi, senza costruire in memoria il documento finale.
+    """
+
+    def __init__(self, out, base_folder: str = "output_llm", asset_store: Optional[AssetStore] = None):
+        self.out = out
+        self.base_folder = base_folder
+        self.asset_store = asset_store if asset_store is not None else get_asset_store(base_folder)
+        self.embedded = 0
+        self.missing: set[str] = set()
+        self.base64_chars = 0
+        self._pending = ""
+
+    def feed(self, text: str) -> None:
+        self._pending += text
+        boundary = self._pending.rfind(">")
+        if boundary < 0:
+            return
+        ready, self._pending = self._pending[:boundary + 1], self._pending[boundary + 1:]
+        self._process(ready)
+
+    def close(self) -> None:
+        if self._pending:
+            self._process(self._pending)
+            self._pending = ""
+
+    def _process(self, text: str) -> None:
+        position = 0
+        for attribute in XML_ATTRIBUTE_PATTERN.finditer(text):
+            if attribute.group(1) != "style" or "image=" not in attribute.group(2):
+                continue
+            value_start = attribute.start(2) + 1
+            for part in STYLE_PART_PATTERN.finditer(attribute.group(2)[1:-1]):
+                if part.group().startswith("image="):
+                    position = self._embed_style_image(text, position, part.group(),
+                                                       value_start + part.start(), value_start + part.end())
+        self.out.write(text[position:])
+
+    def _embed_style_image(self, text: str, position: int, part: str, part_start: int, part_end: int) -> int:
+        """
+        Sostituisce il valore di una parte "image=..." dello style con i dati base64, se il
+        riferimento si risolve nell'asset_store o su disco, e restituisce la nuova posizione di scrittura.
+        """
+        image_ref = part[6:]
+        quote_char = next((q for q in STYLE_IMAGE_QUOTES
+                           if len(image_ref) >= 2 * len(q) and image_ref.startswith(q) and image_ref.endswith(q)), "")
+        filename = image_reference("image=" + image_ref[len(quote_char):len(image_ref) - len(quote_char)])
+        if not filename:
+            return position  # Già incorporata o vuota
+        if not self._has_image(filename):
+            if filename not in self.missing:
+                print(f"Failed to convert image: {filename}")
+                self.missing.add(filename)
+            return position  # Mantieni il riferimento originale
+        self.out.write(text[position:part_start])
+        self.out.write(f"image={quote_char}")
+        self._write_data_uri(filename)
+        self.out.write(quote_char)
+        self.embedded += 1
+        return part_end
+
+    def _has_image(self, filename: str) -> bool:
+        return self.asset_store.get(filename) is not None or os.path.exists(os.path.join(self.base_folder, filename))
+
+    def _write_data_uri(self, filename: str) -> None:
+        asset = self.asset_store.get(filename)
+        if asset is not None:
+            self.out.write(f"data:{asset.mime_type},")
+            data = asset.data
+            for offset in range(0, len(data), BASE64_CHUNK_SIZE):
+                encoded = base64.b64encode(data[offset:offset + BASE64_CHUNK_SIZE]).decode("ascii")
+                self.out.write(encoded)
+                self.base64_chars += len(encoded)
+            return
+
+        image_path = os.path.join(self.base_folder, filename)
+        mime_type, _ = mimetypes.guess_type(image_path)
+        if not mime_type or not mime_type.startswith('image/'):
+            mime_type = 'image/png'  # default fallback
+        # Formato Draw.io: data:image/type,base64_data (SENZA ;base64)
+        self.out.write(f"data:{mime_type},")
+        with open(image_path, 'rb') as img_file:
+            while True:
+                chunk = img_file.read(BASE64_CHUNK_SIZE)
+                if not chunk:
+                    break
+                encoded = base64.b64encode(chunk).decode("ascii")
+                self.out.write(encoded)
+                self.base64_chars += len(encoded)
+
+def embed_images_streaming(xml_content: str, out, base_folder: str = "output_llm", asset_store: Optional[AssetStore] = None) -> StreamingImageEmbedder:
+    """
+    Scrive su out l'XML Draw.io con le immagini referenziate incorporate in base64, in un solo passaggio.
+
+    Args:
+        xml_content: Contenuto XML Draw.io come stringa
+        out: File handle testuale di destinazione
+        base_folder: Cartella base dove cercare le immagini
+        asset_store: Archivio in memoria dei ritagli (default: quello associato a base_folder)
+
+    Returns:
+        L'embedder usato, con le statistiche (immagini incorporate, mancanti, caratteri base64 scritti)
+    """
+    with timed("embed_images"):
+        embedder = StreamingImageEmbedder(out, base_folder, asset_store)
+        embedder.feed(xml_content)
+        embedder.close()
+    observe_size("embedded_base64_chars", embedder.base64_chars)
+    return embedder
+
+class MarkdownFenceStripper:
+    """
+    Versione incrementale di clean_drawio_response: rimuove il fence ```xml ... ``` e gli spazi
+    esterni da un testo che arriva a pezzi. Trattiene solo l'inizio finché non è chiaro se sia un
+    fence e, in coda, gli spazi e i backtick che potrebbero appartenere al fence di chiusura.
+    """
+
+    def __init__(self):
+        self._head = ""
+        self._leading = True
+        self._tail = ""
+
+    def feed(self, text: str) -> str:
+        if self._head is not None:
+            self._head += text
+            stripped = self._head.lstrip()
+            if len(stripped) < len("```xml") and "```xml".startswith(stripped):
+                return ""
+            if stripped.startswith("```xml"):
+                stripped = stripped[len("```xml"):]
+            self._head = None
+            text = stripped
+        if self._leading:
+            text = text.lstrip()
+            if not text:
+                return ""
+            self._leading = False
+        text = self._tail + text
+        cut = len(text.rstrip(" \t\r\n`"))
+        self._tail = text[cut:]
+        return text[:cut]
+
+    def close(self) -> str:
+        if self._head is not None:
+            return clean_drawio_response(self._head)
+        tail = self._tail.rstrip()
+        if tail.endswith("```"):
+            tail = tail[:-len("```")]
+        return tail.rstrip()
+
+class StreamingDrawioWriter:
+    """
+    Scrive su un file handle testuale un XML Draw.io che arriva a pezzi, incorporando le immagini.
+
+    Il testo viene analizzato con XMLPullParser man mano che arriva: quando una mxCell è completa
+    l'asset che referenzia viene ottimizzato per la sua geometria (ASSET_OPTIMIZE) e la cella viene
+    passata subito a StreamingImageEmbedder. Il testo viene trattenuto solo mentre una mxCell è
+    aperta. Se l'XML non è ben formato le celle successive vengono scritte senza ottimizzazione.
+
+    Un asset usato da più celle viene ottimizzato per la prima (optimize_assets usa la geometria
+    massima, che in streaming non è ancora nota).
+    """
+
+    def __init__(self, out, base_folder: str = "output_llm", asset_store: Optional[AssetStore] = None):
+        self.embedder = StreamingImageEmbedder(out, base_folder, asset_store)
+        self.asset_store = self.embedder.asset_store
+        self.cells = 0
+        self.parse_error: Optional[ET.ParseError] = None
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._chunks: list[str] = []
+        self._pending = ""
+        self._held: list[str] = []
+        self._cell_open = False
+        self._optimized: dict[tuple, tuple] = {}
+        self._optimized_names: set[str] = set()
+
+    @property
+    def xml(self) -> str:
+        """
+        L'XML grezzo ricevuto finora (con i riferimenti alle immagini per nome file).
+        """
+        return "".join(self._chunks)
+
+    def feed(self, text: str) -> None:
+        if not text:
+            return
+        self._chunks.append(text)
+        self._pending += text
+        boundary = self._pending.rfind(">")
+        if boundary < 0:
+            return
+        ready, self._pending = self._pending[:boundary + 1], self._pending[boundary + 1:]
+        self._held.append(ready)
+        if self.parse_error is None:
+            try:
+                self._parser.feed(ready)
+                for event, element in self._parser.read_events():
+                    if element.tag != "mxCell":
+                        continue
+                    self._cell_open = event == "start"
+                    if event == "end":
+                        self._cell_done(element)
+            except ET.ParseError as e:
+                print(f"XML in streaming non valido, ottimizzazione per cella interrotta: {e}")
+                self.parse_error = e
+                self._cell_open = False
+        if not self._cell_open:
+            self.embedder.feed("".join(self._held))
+            self._held = []
+
+    def close(self) -> None:
+        self._held.append(self._pending)
+        self._pending = ""
+        self.embedder.feed("".join(self._held))
+        self._held = []
+        self.embedder.close()
+        if self.parse_error is None:
+            try:
+                self._parser.close()
+            except ET.ParseError as e:
+                self.parse_error = e
+
+    def _cell_done(self, cell: ET.Element) -> None:
+        self.cells += 1
+        filename = image_reference(cell.get("style", ""))
+        geom = cell.find("mxGeometry")
+        cell.clear()  # Il documento non viene tenuto in memoria
+        if not ASSET_OPTIMIZE or not filename or filename in self._optimized_names or geom is None:
+            return
+        try:
+            width, height = float(geom.get("width", 0)), float(geom.get("height", 0))
+        except ValueError:
+            return
+        if width <= 0 or height <= 0:
+            return
+        self._optimized_names.add(filename)
+        optimize_asset(filename, width, height, self.asset_store, dpi_scale=ASSET_DPI_SCALE, quantize=ASSET_QUANTIZE,
+                       output_format=ASSET_FORMAT, optimized_by_digest=self._optimized)
+
+def replace_image_references_in_drawio_xml(xml_content: str, base_folder: str = "output_llm", asset_store: Optional[AssetStore] = None) -> str:
     """
     Sostituisce tutti i riferimenti alle immagini nell'XML Draw.io con versioni base64
+    (un solo passaggio sul documento, solo negli attributi style)
     
     Args:
         xml_content: Contenuto XML Draw.io come stringa
         base_folder: Cartella base dove cercare le immagini
+        asset_store: Archivio in memoria dei ritagli (default: quello associato a base_folder)
         
     Returns:
         XML modificato con immagini base64 embedded
     """
     try:
-        # Pattern per trovare riferimenti alle immagini negli attributi style
-        # Cerca pattern come: image=filename.png o image='filename.png' o image="filename.png"
-        image_patterns = [
-            r'image=([\'"]?)([^\'";,\s]+\.(png|jpg|jpeg|gif|bmp|svg))\1',  # image=file.png, image='file.png', image="file.png"
-            r'image=([\'"]?)(file://\.?/?([^\'";,\s]+\.(png|jpg|jpeg|gif|bmp|svg)))\1',  # image=file://./file.png
-        ]
-        
-        modified_xml = xml_content
-        processed_files = set()  # Per evitare conversioni duplicate
-        
-        for pattern in image_patterns:
-            matches = re.finditer(pattern, modified_xml, re.IGNORECASE)
-            
-            for match in matches:
-                full_match = match.group(0)
-                quote_char = match.group(1) if match.group(1) else ''
-                
-                # Estrai il nome del file
-                if 'file://' in full_match:
-                    # Per pattern file://./filename.png
-                    filename = match.group(3) if len(match.groups()) >= 3 else match.group(2)
-                else:
-                    # Per pattern semplici
-                    filename = match.group(2)
-                
-                # Rimuovi eventuali prefissi di path
-                filename = os.path.basename(filename)
-                
-                if filename in processed_files:
-                    continue
-                    
-                processed_files.add(filename)
-                image_path = os.path.join(base_folder, filename)
-                
-                # Converti in base64
-                base64_data = convert_image_to_base64(image_path)
-                
-                if base64_data:
-                    # Sostituisci tutti i riferimenti a questo file
-                    old_patterns = [
-                        f'image={quote_char}{filename}{quote_char}',
-                        f'image={quote_char}file://\./{filename}{quote_char}',
-                        f'image={quote_char}file://{filename}{quote_char}',
-                        f'image={filename}',  # senza quote
-                    ]
-                    
-                    new_value = f'image={quote_char}{base64_data}{quote_char}' if quote_char else f'image={base64_data}'
-                    
-                    for old_pattern in old_patterns:
-                        modified_xml = modified_xml.replace(old_pattern, new_value)
-                    
-                    print(f"Replaced image reference: {filename} -> base64 ({len(base64_data)} chars)")
-                else:
-                    print(f"Failed to convert image: {filename}")
-        
-        return modified_xml
+        out = io.StringIO()
+        embedder = embed_images_streaming(xml_content, out, base_folder, asset_store)
+        print(f"Replaced {embedder.embedded} image references -> base64 ({embedder.base64_chars} chars)")
+        return out.getvalue()
         
     except Exception as e:
         print(f"Error processing XML: {e}")
         return xml_content  # Ritorna l'originale in caso di errore
 
-def replace_image_references_xml_parser(xml_content: str, base_folder: str = "output_llm") -> str:
+@instrumented("replace_image_references_xml_parser")
+def replace_image_references_xml_parser(xml_content: str, base_folder: str = "output_llm", asset_store: Optional[AssetStore] = None) -> str:
     """
     Versione alternativa che usa XML parser per maggiore precisione
     Sostituisce i riferimenti alle immagini negli attributi style dei mxCell
+    Le immagini vengono cercate prima nell'asset_store in memoria, poi su disco in base_folder
     """
     try:
         # Parse dell'XML
@@ -170,10 +461,9 @@ def replace_image_references_xml_parser(xml_content: str, base_folder: str = "ou
                             image_ref = image_ref.replace('file://', '').lstrip('./')
                         
                         filename = os.path.basename(image_ref)
-                        image_path = os.path.join(base_folder, filename)
                         
                         # Converti in base64
-                        base64_data = convert_image_to_base64(image_path)
+                        base64_data = resolve_image_data_uri(filename, base_folder, asset_store)
                         
                         if base64_data:
                             new_style_parts.append(f'image={base64_data}')
@@ -192,65 +482,13 @@ def replace_image_references_xml_parser(xml_content: str, base_folder: str = "ou
     except ET.ParseError as e:
         print(f"XML parsing error: {e}")
         # Fallback al metodo regex
-        return replace_image_references_in_drawio_xml(xml_content, base_folder)
+        return replace_image_references_in_drawio_xml(xml_content, base_folder, asset_store)
     except Exception as e:
         print(f"Error in XML parser method: {e}")
         return xml_content
 
-@tool("generate_drawio_from_image_and_objects_tool", parse_docstring=True) # Uncomment if you plan to use it directly as a langchain tool
-def generate_drawio_from_image_and_objects(original_image_path: str, object_names: list[str]) -> str:
-    """
-    Generates a Draw.io XML diagram from an original image and a list of detected object names.
-
-    The function first instructs a generative model to create a Draw.io XML representation
-    of the scene in the original image. It then incorporates references to cropped images
-    of specified objects (expected to be in the 'output_llm' folder).
-    Finally, it post-processes this XML to replace all local image file references
-    with their base64 encoded data, making the Draw.io diagram self-contained.
-
-    Args:
-        original_image_path (str): The file path to the original image to be diagrammed.
-        object_names (list[str]): A list of object names (e.g., ['cat.png', 'dog.png']) that have been previously detected and saved as image files in the 'output_llm' folder. These will be embedded into the diagram.
-
-    Returns:
-        bool: True if the Draw.io XML was successfully generated and saved, or an error message if something went wrong.
-    """
-    if not GOOGLE_API_KEY or not client:
-        return "Errore: GEMINI_API_KEY non configurato o client non inizializzato."
-
-    try:
-        with open(original_image_path, "rb") as f:
-            img_bytes = f.read()
-        original_image = Image.open(BytesIO(img_bytes))
-        original_image.thumbnail([1024, 1024], Image.Resampling.LANCZOS)
-
-        object_image_folder = "output_llm"
-
-        prompt_parts = [
-            "Generate a Draw.io XML diagram for the provided original image.",
-            "The diagram should represent the overall scene, focusing on spatial relationships and composition."
-        ]
-
-        if object_names:
-            object_filenames_str = ", ".join([f"'{name}'" for name in object_names])
-            prompt_parts.extend([
-                f"Incorporate the following object images as assets: {object_filenames_str}.",
-                f"These images are in the '{object_image_folder}' directory.",
-                "Use simple filename references in the image attribute, like: image=cat.png",
-                "Do NOT use base64 encoding - just use the filename directly.",
-                "The image paths will be processed later to embed the actual image data."
-            ])
-
-        prompt_parts.extend([
-            "Position and size elements based on their approximate location in the original image.",
-            "Create complete Draw.io XML structure with proper mxGraphModel, root, and mxCell elements.",
-            "Ensure all mxCell elements have unique id attributes."
-        ])
-        
-        user_prompt = " ".join(prompt_parts)
-
-        # System instructions semplificato per riferimenti diretti
-        simple_ref_instructions = """
+# System instructions semplificato per riferimenti diretti
+DRAWIO_SYSTEM_INSTRUCTIONS = """
 You are an expert Draw.io diagram generator.
 Create Draw.io XML using simple filename references for images.
 
@@ -274,36 +512,304 @@ Use simple filename references like 'image=cat.png' - do NOT embed base64 data.
 Position elements to match the original image layout.
 """
 
-        response = client.models.generate_content(
-            contents=[user_prompt, original_image],
-            model=MODEL_NAME,
-            config=types.GenerateContentConfig(
-                system_instruction=simple_ref_instructions,
-                temperature=0,
-                safety_settings=[
-                    types.SafetySetting(category="HARM_CATEGORY_DANGEROUS_CONTENT", threshold="BLOCK_ONLY_HIGH"),
-                    types.SafetySetting(category="HARM_CATEGORY_HATE_SPEECH", threshold="BLOCK_ONLY_HIGH"),
-                    types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="BLOCK_ONLY_HIGH"),
-                    types.SafetySetting(category="HARM_CATEGORY_SEXUALLY_EXPLICIT", threshold="BLOCK_ONLY_HIGH"),
-                ]
+def build_drawio_prompt(object_names: Optional[list[str]], object_image_folder: str = "output_llm") -> str:
+    """
+    Costruisce il prompt utente per la generazione Draw.io.
+
+    Con object_names None il prompt chiede un layout speculativo, generato in parallelo alla detection:
+    il modello sceglie da sé le etichette degli oggetti, che vengono poi associate ai ritagli
+    (vedi utils.layout_merge.bind_crops_to_layout).
+    """
+    prompt_parts = [
+        "Generate a Draw.io XML diagram for the provided original image.",
+        "The diagram should represent the overall scene, focusing on spatial relationships and composition."
+    ]
+
+    if object_names:
+        object_filenames_str = ", ".join([f"'{name}'" for name in object_names])
+        prompt_parts.extend([
+            f"Incorporate the following object images as assets: {object_filenames_str}.",
+            f"These images are in the '{object_image_folder}' directory.",
+            "Use simple filename references in the image attribute, like: image=cat.png",
+            "Do NOT use base64 encoding - just use the filename directly.",
+            "The image paths will be processed later to embed the actual image data."
+        ])
+    elif object_names is None:
+        prompt_parts.extend([
+            "Represent every singular icon or pictogram of the image as its own image cell (not compositions of multiple pics).",
+            "Label each one as specifically as possible, with underscores instead of spaces (e.g. 'aws_lambda_function'),",
+            "and use that label both as the cell value and as the image filename, like: value=aws_lambda_function image=aws_lambda_function.png",
+            "Do NOT use base64 encoding - the filenames will be bound to the extracted object images later."
+        ])
+
+    prompt_parts.extend([
+        "Position and size elements based on their approximate location in the original image.",
+        "Create complete Draw.io XML structure with proper mxGraphModel, root, and mxCell elements.",
+        "Ensure all mxCell elements have unique id attributes."
+    ])
+    
+    return " ".join(prompt_parts)
+
+def drawio_generation_config():
+    """
+    Configurazione della richiesta di generazione Draw.io (condivisa da versione sincrona e asincrona).
+    """
+    from google.genai import types  # Import al primo uso: google.genai è lento da importare
+
+    return types.GenerateContentConfig(
+        system_instruction=DRAWIO_SYSTEM_INSTRUCTIONS,
+        temperature=0,
+        safety_settings=[
+            types.SafetySetting(category="HARM_CATEGORY_DANGEROUS_CONTENT", threshold="BLOCK_ONLY_HIGH"),
+            types.SafetySetting(category="HARM_CATEGORY_HATE_SPEECH", threshold="BLOCK_ONLY_HIGH"),
+            types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="BLOCK_ONLY_HIGH"),
+            types.SafetySetting(category="HARM_CATEGORY_SEXUALLY_EXPLICIT", threshold="BLOCK_ONLY_HIGH"),
+        ]
+    )
+
+def clean_drawio_response(text: str) -> str:
+    """
+    Rimuove la formattazione markdown (```xml ... ```) dalla risposta del modello.
+    """
+    xml_output = text.strip()
+    
+    # Clean up markdown formatting
+    if xml_output.startswith("```xml"): 
+        xml_output = xml_output[len("```xml"):]
+    if xml_output.endswith("```"): 
+        xml_output = xml_output[:-len("```")]
+    
+    return xml_output.strip()
+
+def lookup_drawio_cache(original_image_path: str, object_names: Optional[list[str]]) -> tuple[str, Optional[str]]:
+    """
+    Cerca in cache l'XML grezzo per questa immagine e questo insieme di oggetti.
+
+    Returns:
+        tuple: (chiave di cache, XML in cache o None)
+    """
+    cache_key = drawio_cache_key(file_digest(original_image_path), object_names)
+    xml_output = drawio_cache.get(cache_key)
+    if xml_output is not None:
+        print(f"Draw.io cache hit: {cache_key[:12]} ({drawio_cache.stats()})")
+    return cache_key, xml_output
+
+def store_drawio_result(cache_key: str, xml_output: str) -> None:
+    """
+    Salva in cache l'XML grezzo appena generato, solo se ben formato.
+    """
+    observe_size("drawio_xml_chars", len(xml_output))
+    try:
+        ET.fromstring(xml_output)
+        drawio_cache.set(cache_key, xml_output)
+    except ET.ParseError:
+        print("XML generato non valido: non salvato in cache.")
+
+def generate_drawio_xml(original_image_path: str, object_names: Optional[list[str]], object_image_folder: str = "output_llm") -> str:
+    """
+    Restituisce l'XML Draw.io grezzo (con riferimenti alle immagini per nome file) dalla cache
+    o dal modello, senza post-processing. Con object_names None genera il layout speculativo.
+
+    Raises:
+        FileNotFoundError: Se l'immagine originale non esiste.
+        ValueError: Se GEMINI_API_KEY non è configurato e il risultato non è in cache.
+    """
+    cache_key, xml_output = lookup_drawio_cache(original_image_path, object_names)
+    if xml_output is None:
+        client = get_genai_client() if GOOGLE_API_KEY else None
+        if not client:
+            raise ValueError("GEMINI_API_KEY non configurato o client non inizializzato.")
+
+        original_image = load_thumbnail(original_image_path, (1024, 1024))
+
+        with timed("gemini_drawio"):
+            response = client.models.generate_content(
+                contents=[build_drawio_prompt(object_names, object_image_folder), original_image],
+                model=MODEL_NAME,
+                config=drawio_generation_config(),
             )
-        )
+        xml_output = clean_drawio_response(response.text)
+        store_drawio_result(cache_key, xml_output)
+    return xml_output
 
-        xml_output = response.text.strip()
-        
-        # Clean up markdown formatting
-        if xml_output.startswith("```xml"): 
-            xml_output = xml_output[len("```xml"):]
-        if xml_output.endswith("```"): 
-            xml_output = xml_output[:-len("```")]
-        
-        xml_output = xml_output.strip()
-        
-        # POST-PROCESSING: Sostituisci i riferimenti con base64
-        print("Post-processing: Converting image references to base64...")
-        final_xml = replace_image_references_xml_parser(xml_output, object_image_folder)
-        save_drawio_xml(final_xml, "drawio_output", output_directory="output_llm")
+async def agenerate_drawio_xml(original_image_path: str, object_names: Optional[list[str]], object_image_folder: str = "output_llm") -> str:
+    """
+    Versione asincrona di generate_drawio_xml: usa client.aio per la chiamata al modello
+    e sposta I/O su file e lavoro PIL in un thread, senza bloccare l'event loop.
+    """
+    cache_key, xml_output = await asyncio.to_thread(lookup_drawio_cache, original_image_path, object_names)
+    if xml_output is None:
+        client = get_genai_client() if GOOGLE_API_KEY else None
+        if not client:
+            raise ValueError("GEMINI_API_KEY non configurato o client non inizializzato.")
+
+        original_image = await asyncio.to_thread(load_thumbnail, original_image_path, (1024, 1024))
+
+        with timed("gemini_drawio"):
+            response = await client.aio.models.generate_content(
+                contents=[build_drawio_prompt(object_names, object_image_folder), original_image],
+                model=MODEL_NAME,
+                config=drawio_generation_config(),
+            )
+        xml_output = clean_drawio_response(response.text)
+        await asyncio.to_thread(store_drawio_result, cache_key, xml_output)
+    return xml_output
+
+def embed_and_save_drawio(xml_output: str, object_image_folder: str = "output_llm", output_directory: str = "output_llm") -> str:
+    """
+    Ottimizza i ritagli referenziati ed esegue l'embedding base64 scrivendo il file .drawio.
+
+    Returns:
+        str: Il messaggio di save_drawio_xml_streaming (percorso del file o errore).
+    """
+    # POST-PROCESSING: Sostituisci i riferimenti con base64
+    print("Post-processing: Converting image references to base64...")
+    optimize_drawio_assets(xml_output, object_image_folder)
+    return save_drawio_xml_streaming(xml_output, "drawio_output", output_directory=output_directory, base_folder=object_image_folder, compressed=DRAWIO_COMPRESSED)
+
+def _drawio_output_path(output_directory: str) -> str:
+    os.makedirs(output_directory, exist_ok=True)
+    return os.path.join(output_directory, "drawio_output.drawio")
+
+def _close_drawio_stream(writer: StreamingDrawioWriter, stripper: MarkdownFenceStripper) -> None:
+    writer.feed(stripper.close())
+    writer.close()
+
+def _finish_drawio_stream(writer: StreamingDrawioWriter, partial_path: str, file_path: str, cache_key: str) -> str:
+    # Chiamata dopo la chiusura del file .partial: il rename non avviene mai con dati ancora nel buffer
+    os.replace(partial_path, file_path)
+    observe_size("embedded_base64_chars", writer.embedder.base64_chars)
+    if writer.parse_error is None:
+        store_drawio_result(cache_key, writer.xml)
+    else:
+        print(f"XML generato non valido: non salvato in cache ({writer.parse_error}).")
+    print(f"Streaming generation: {writer.cells} cells, {writer.embedder.embedded} images -> {file_path}")
+    return f"File Draw.io salvato con successo in: {os.path.abspath(file_path)}"
+
+def generate_and_save_drawio_streaming(original_image_path: str, object_names: Optional[list[str]],
+                                       object_image_folder: str = "output_llm", output_directory: str = "output_llm") -> str:
+    """
+    Genera l'XML Draw.io con generate_content_stream e lo scrive sul file .drawio mentre arriva:
+    ottimizzazione ed embedding delle immagini si sovrappongono alla generazione del modello.
+    Il file viene scritto in drawio_output.drawio.partial e rinominato solo a generazione completata.
+    Con un risultato in cache, o con DRAWIO_COMPRESSED, usa il percorso non in streaming.
+
+    Returns:
+        str: Il messaggio di salvataggio (percorso del file o errore).
+
+    Raises:
+        FileNotFoundError: Se l'immagine originale non esiste.
+        ValueError: Se GEMINI_API_KEY non è configurato e il risultato non è in cache.
+    """
+    cache_key, xml_output = lookup_drawio_cache(original_image_path, object_names)
+    if xml_output is not None or DRAWIO_COMPRESSED:
+        xml_output = xml_output if xml_output is not None else generate_drawio_xml(original_image_path, object_names, PROMPT_IMAGE_FOLDER)
+        return embed_and_save_drawio(xml_output, object_image_folder, output_directory)
+    client = get_genai_client() if GOOGLE_API_KEY else None
+    if not client:
+        raise ValueError("GEMINI_API_KEY non configurato o client non inizializzato.")
+
+    original_image = load_thumbnail(original_image_path, (1024, 1024))
+    file_path = _drawio_output_path(output_directory)
+    partial_path = file_path + ".partial"
+    stripper = MarkdownFenceStripper()
+    try:
+        with open(partial_path, "w", encoding="utf-8") as f:
+            writer = StreamingDrawioWriter(f, object_image_folder)
+            with timed("gemini_drawio"):
+                for chunk in client.models.generate_content_stream(
+                    contents=[build_drawio_prompt(object_names, PROMPT_IMAGE_FOLDER), original_image],
+                    model=MODEL_NAME,
+                    config=drawio_generation_config(),
+                ):
+                    writer.feed(stripper.feed(chunk.text or ""))
+            _close_drawio_stream(writer, stripper)
+        return _finish_drawio_stream(writer, partial_path, file_path, cache_key)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+async def agenerate_and_save_drawio_streaming(original_image_path: str, object_names: Optional[list[str]],
+                                              object_image_folder: str = "output_llm", output_directory: str = "output_llm") -> str:
+    """
+    Versione asincrona di generate_and_save_drawio_streaming: i pezzi arrivano da client.aio e
+    ottimizzazione, embedding e scrittura avvengono in un thread.
+    """
+    cache_key, xml_output = await asyncio.to_thread(lookup_drawio_cache, original_image_path, object_names)
+    if xml_output is not None or DRAWIO_COMPRESSED:
+        if xml_output is None:
+            xml_output = await agenerate_drawio_xml(original_image_path, object_names, PROMPT_IMAGE_FOLDER)
+        return await asyncio.to_thread(embed_and_save_drawio, xml_output, object_image_folder, output_directory)
+    client = get_genai_client() if GOOGLE_API_KEY else None
+    if not client:
+        raise ValueError("GEMINI_API_KEY non configurato o client non inizializzato.")
+
+    original_image = await asyncio.to_thread(load_thumbnail, original_image_path, (1024, 1024))
+    file_path = await asyncio.to_thread(_drawio_output_path, output_directory)
+    partial_path = file_path + ".partial"
+    stripper = MarkdownFenceStripper()
+    try:
+        with open(partial_path, "w", encoding="utf-8") as f:
+            writer = StreamingDrawioWriter(f, object_image_folder)
+            with timed("gemini_drawio"):
+                async for chunk in await client.aio.models.generate_content_stream(
+                    contents=[build_drawio_prompt(object_names, PROMPT_IMAGE_FOLDER), original_image],
+                    model=MODEL_NAME,
+                    config=drawio_generation_config(),
+                ):
+                    await asyncio.to_thread(writer.feed, stripper.feed(chunk.text or ""))
+            await asyncio.to_thread(_close_drawio_stream, writer, stripper)
+        return await asyncio.to_thread(_finish_drawio_stream, writer, partial_path, file_path, cache_key)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+def _generate_drawio_from_image_and_objects(original_image_path: str, object_names: list[str],
+                                            state: Annotated[Optional[dict], InjectedState] = None) -> str:
+    """
+    Generates a Draw.io XML diagram from an original image and a list of detected object names.
+
+    The function first instructs a generative model to create a Draw.io XML representation
+    of the scene in the original image. It then incorporates references to cropped images
+    of specified objects (expected to be in the 'output_llm' folder).
+    Finally, it post-processes this XML to replace all local image file references
+    with their base64 encoded data, making the Draw.io diagram self-contained.
+
+    Args:
+        original_image_path (str): The file path to the original image to be diagrammed.
+        object_names (list[str]): A list of object names (e.g., ['cat.png', 'dog.png']) that have been previously detected and saved as image files in the 'output_llm' folder. These will be embedded into the diagram.
+
+    Returns:
+        bool: True if the Draw.io XML was successfully generated and saved, or an error message if something went wrong.
+    """
+    # Ritagli letti e file .drawio scritti nel workspace della richiesta (iniettato dal ToolNode)
+    workspace = workspace_of(state)
+    try:
+        if DRAWIO_STREAMING:
+            generate_and_save_drawio_streaming(original_image_path, object_names, workspace, workspace)
+            return True
+        xml_output = generate_drawio_xml(original_image_path, object_names, PROMPT_IMAGE_FOLDER)
+        embed_and_save_drawio(xml_output, workspace, workspace)
+        return True
+
+    except FileNotFoundError:
+        return f"Errore: File immagine originale non trovato a {original_image_path}."
+    except Exception as e:
+        print(f"Errore dettagliato in generate_drawio_from_image_and_objects_v4: {e}")
+        return f"Errore durante la generazione dell'XML Draw.io: {str(e)}"
 
+async def _agenerate_drawio_from_image_and_objects(original_image_path: str, object_names: list[str],
+                                                   state: Annotated[Optional[dict], InjectedState] = None) -> str:
+    """
+    Versione asincrona di _generate_drawio_from_image_and_objects.
+    """
+    workspace = workspace_of(state)
+    try:
+        if DRAWIO_STREAMING:
+            await agenerate_and_save_drawio_streaming(original_image_path, object_names, workspace, workspace)
+            return True
+        xml_output = await agenerate_drawio_xml(original_image_path, object_names, PROMPT_IMAGE_FOLDER)
+        await asyncio.to_thread(embed_and_save_drawio, xml_output, workspace, workspace)
         return True
 
     except FileNotFoundError:
@@ -312,15 +818,121 @@ Position elements to match the original image layout.
         print(f"Errore dettagliato in generate_drawio_from_image_and_objects_v4: {e}")
         return f"Errore durante la generazione dell'XML Draw.io: {str(e)}"
 
+# Un solo tool con implementazione sincrona (invoke) e asincrona (ainvoke)
+generate_drawio_from_image_and_objects = StructuredTool.from_function(
+    func=_generate_drawio_from_image_and_objects,
+    coroutine=_agenerate_drawio_from_image_and_objects,
+    name="generate_drawio_from_image_and_objects_tool",
+    parse_docstring=True,
+)
+
+def compress_diagram_payload(xml_text: str) -> str:
+    """
+    Comprime il contenuto di un <diagram> nel formato nativo di Draw.io:
+    encodeURIComponent, deflate raw e base64.
+    """
+    encoded = quote(xml_text, safe="~()*!.'").encode("utf-8")
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    deflated = compressor.compress(encoded) + compressor.flush()
+    return base64.b64encode(deflated).decode("ascii")
+
+def decompress_diagram_payload(payload: str) -> str:
+    """
+    Decomprime il contenuto di un <diagram> compresso (base64, inflate raw, decodeURIComponent).
+    """
+    inflated = zlib.decompress(base64.b64decode(payload.strip()), -15)
+    return unquote(inflated.decode("utf-8"))
+
+def is_compressed_drawio_xml(xml_content: str) -> bool:
+    """
+    Indica se l'XML Draw.io contiene almeno un <diagram> in forma compressa.
+    """
+    try:
+        root = ET.fromstring(xml_content)
+    except ET.ParseError:
+        return False
+    return any(len(diagram) == 0 and (diagram.text or "").strip() for diagram in root.iter('diagram'))
+
+def compress_drawio_xml(xml_content: str) -> str:
+    """
+    Converte un XML Draw.io nella forma compressa nativa: ogni <diagram> contiene il suo
+    mxGraphModel compresso al posto degli elementi XML.
+
+    Args:
+        xml_content: Contenuto XML Draw.io non compresso (mxfile o solo mxGraphModel)
+
+    Returns:
+        XML con i diagrammi compressi e compressed="true" su mxfile
+    """
+    root = ET.fromstring(xml_content)
+    if root.tag == 'mxGraphModel':
+        # Solo il modello: avvolgilo in un mxfile con un singolo diagramma
+        mxfile = ET.Element('mxfile', {'host': 'GeminiAgent'})
+        diagram = ET.SubElement(mxfile, 'diagram', {'id': 'diagram-1', 'name': 'Page-1'})
+        diagram.append(root)
+        root = mxfile
+
+    for diagram in root.iter('diagram'):
+        children = list(diagram)
+        if not children:
+            continue  # Già compresso o vuoto
+        payload = "".join(ET.tostring(child, encoding='unicode') for child in children)
+        for child in children:
+            diagram.remove(child)
+        diagram.text = compress_diagram_payload(payload)
+    root.set('compressed', 'true')
+    return ET.tostring(root, encoding='unicode')
+
+def decompress_drawio_xml(xml_content: str) -> str:
+    """
+    Converte un XML Draw.io compresso nella forma non compressa, espandendo ogni <diagram>.
+
+    Args:
+        xml_content: Contenuto XML Draw.io (compresso o meno)
+
+    Returns:
+        XML con gli mxGraphModel espansi e compressed="false" su mxfile
+    """
+    root = ET.fromstring(xml_content)
+    for diagram in root.iter('diagram'):
+        if len(diagram) or not (diagram.text or "").strip():
+            continue
+        model = ET.fromstring(decompress_diagram_payload(diagram.text))
+        diagram.text = None
+        diagram.append(model)
+    if root.tag == 'mxfile':
+        root.set('compressed', 'false')
+    return ET.tostring(root, encoding='unicode')
+
 # Funzione standalone per post-processare XML esistenti
-def post_process_drawio_xml_file(xml_file_path: str, base_folder: str = "output_llm", output_path: str = None) -> str:
+def write_text_atomically(path: str, write):
+    """
+    Scrive un file di testo tramite write(file_handle) in '<path>.partial' e lo rinomina in path
+    solo a scrittura completata: in caso di errore il file esistente resta intatto.
+
+    Returns:
+        Il valore restituito da write.
+    """
+    partial_path = path + ".partial"
+    try:
+        with open(partial_path, "w", encoding="utf-8") as f:
+            result = write(f)
+        os.replace(partial_path, path)
+        return result
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+def post_process_drawio_xml_file(xml_file_path: str, base_folder: str = "output_llm", output_path: str = None, compressed: Optional[bool] = None) -> str:
     """
     Post-processa un file XML Draw.io esistente per sostituire i riferimenti alle immagini
+    Accetta sia file non compressi sia file nella forma compressa nativa di Draw.io
     
     Args:
         xml_file_path: Percorso del file XML Draw.io
         base_folder: Cartella base per le immagini
         output_path: Percorso di output (se None, sovrascrive l'originale)
+        compressed: Se scrivere l'output compresso (se None, mantiene la forma del file di input)
         
     Returns:
         Percorso del file processato
@@ -328,14 +940,23 @@ def post_process_drawio_xml_file(xml_file_path: str, base_folder: str = "output_
     try:
         with open(xml_file_path, 'r', encoding='utf-8') as f:
             xml_content = f.read()
-        
-        processed_xml = replace_image_references_xml_parser(xml_content, base_folder)
+
+        input_compressed = is_compressed_drawio_xml(xml_content)
+        if input_compressed:
+            xml_content = decompress_drawio_xml(xml_content)
+        if compressed is None:
+            compressed = input_compressed
         
         if output_path is None:
             output_path = xml_file_path
         
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(processed_xml)
+        if compressed:
+            embedded = io.StringIO()
+            embed_images_streaming(xml_content, embedded, base_folder)
+            write_text_atomically(output_path, lambda f: f.write(compress_drawio_xml(embedded.getvalue())))
+        else:
+            # output_path è di default il file di input: viene sostituito solo a embedding completato
+            write_text_atomically(output_path, lambda f: embed_images_streaming(xml_content, f, base_folder))
         
         print(f"Processed XML saved to: {output_path}")
         return output_path
@@ -345,7 +966,7 @@ def post_process_drawio_xml_file(xml_file_path: str, base_folder: str = "output_
         return xml_file_path
     
 
-def save_drawio_xml(xml_content: str, filename_prefix: str, output_directory: str = "output_llm") -> str:
+def save_drawio_xml(xml_content: str, filename_prefix: str, output_directory: str = "output_llm", compressed: bool = False) -> str:
     """
     Salva una stringa XML di Draw.io in un file .drawio.
 
@@ -353,6 +974,7 @@ def save_drawio_xml(xml_content: str, filename_prefix: str, output_directory: st
         xml_content (str): La stringa XML del diagramma Draw.io.
         filename_prefix (str): Il prefisso per il nome del file. Il file verrà salvato come '{filename_prefix}.drawio'.
         output_directory (str): La directory dove salvare il file. Default 'output_llm'.
+        compressed (bool): Se True salva i diagrammi nella forma compressa nativa di Draw.io.
 
     Returns:
         str: Il percorso del file salvato o un messaggio di errore.
@@ -367,9 +989,52 @@ def save_drawio_xml(xml_content: str, filename_prefix: str, output_directory: st
         else:
             filename = filename_prefix
 
+        if compressed:
+            xml_content = compress_drawio_xml(xml_content)
+
         file_path = os.path.join(output_directory, filename)
         with open(file_path, "w", encoding="utf-8") as f:
             f.write(xml_content)
         return f"File Draw.io salvato con successo in: {os.path.abspath(file_path)}"
+    except Exception as e:
+        return f"Errore durante il salvataggio del file Draw.io: {str(e)}"
+
+def save_drawio_xml_streaming(xml_content: str, filename_prefix: str, output_directory: str = "output_llm",
+                              base_folder: str = "output_llm", asset_store: Optional[AssetStore] = None,
+                              compressed: bool = False) -> str:
+    """
+    Salva una stringa XML di Draw.io in un file .drawio incorporando le immagini referenziate
+    durante la scrittura, senza costruire in memoria l'XML finale con i dati base64.
+
+    Args:
+        xml_content (str): La stringa XML del diagramma Draw.io (con riferimenti alle immagini per nome file).
+        filename_prefix (str): Il prefisso per il nome del file. Il file verrà salvato come '{filename_prefix}.drawio'.
+        output_directory (str): La directory dove salvare il file. Default 'output_llm'.
+        base_folder (str): La cartella dove cercare le immagini non presenti nell'asset_store.
+        asset_store (AssetStore): Archivio in memoria dei ritagli (default: quello associato a base_folder).
+        compressed (bool): Se True salva nella forma compressa nativa di Draw.io; la compressione richiede
+                           l'intero diagramma, quindi in questo caso l'XML viene costruito in memoria.
+
+    Returns:
+        str: Il percorso del file salvato o un messaggio di errore.
+    """
+    try:
+        os.makedirs(output_directory, exist_ok=True)
+
+        # Assicurati che il nome del file finisca con .drawio
+        if not filename_prefix.endswith(".drawio"):
+            filename = f"{filename_prefix}.drawio"
+        else:
+            filename = filename_prefix
+
+        file_path = os.path.join(output_directory, filename)
+        if compressed:
+            embedded = io.StringIO()
+            embedder = embed_images_streaming(xml_content, embedded, base_folder, asset_store)
+            write_text_atomically(file_path, lambda f: f.write(compress_drawio_xml(embedded.getvalue())))
+        else:
+            embedder = write_text_atomically(file_path, lambda f: embed_images_streaming(xml_content, f, base_folder, asset_store))
+        print(f"Streaming embed: {embedder.embedded} images ({embedder.base64_chars} base64 chars) -> {file_path}")
+        return f"File Draw.io salvato con successo in: {os.path.abspath(file_path)}"
     except Exception as e:
         return f"Errore durante il salvataggio del file Draw.io: {str(e)}"
\ No newline at end of file
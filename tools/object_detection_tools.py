@@ -1,17 +1,29 @@
 import os
-from google import genai
-from google.genai import types
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Annotated, Optional
+import numpy as np
 from PIL import Image
-from io import BytesIO
-from langchain_core.tools import tool
+from langchain_core.tools import StructuredTool
+from langgraph.prebuilt import InjectedState
 
-# utils.utils.plot_bounding_boxes non è necessario per il tool in sé, ma per la visualizzazione
-from utils.utils import plot_bounding_boxes, save_cropped_images
+from utils.utils import save_cropped_images, parse_json, deduplicate_detection_json, CropWorker
+# L'overlay delle box è un artefatto opzionale (DETECTION_OVERLAY), disegnato in background
+from utils.overlay import schedule_overlay
+from utils.cache import DiskCache, hash_key
+from utils.image_cache import load_thumbnail
+from utils.boxes import BoundingBoxes
+from utils.asset_store import get_asset_store
+from utils.metrics import timed, observe_size
+from utils.clients import get_genai_client
+from utils.workspace import workspace_of
+from utils.json_stream import JsonArrayStream
+from utils.cv_detection import detect_regions, regions_to_json
+from utils.tiling import tile_grid, tile_boxes_to_global, merge_tile_detections, boxes_to_json_list, TILE_SIZE, TILE_OVERLAP
 
 GOOGLE_API_KEY=os.getenv("GEMINI_API_KEY")
 
-client = genai.Client(api_key=GOOGLE_API_KEY)
-
 model_name = "gemini-2.5-pro-preview-06-05" # @param ["gemini-1.5-flash-latest","gemini-2.0-flash-lite","gemini-2.0-flash","gemini-2.5-flash-preview-05-20","gemini-2.5-pro-preview-06-05"] {"allow-input":true}
 # System instructions per guidare il modello a restituire i bounding box in formato JSON.
 bounding_box_system_instructions = """
@@ -23,52 +35,542 @@ bounding_box_system_instructions = """
     If some pics in the images contain labels, try to exclude them from the bounding boxes (unless they overlap with the object you are bounding).
       """
 
-safety_settings = [
-    types.SafetySetting(
-        category="HARM_CATEGORY_DANGEROUS_CONTENT",
-        threshold="BLOCK_ONLY_HIGH",
-    ),
-]
+user_prompt: str = "Detect the 2d bounding boxes of the objects in the image (with “label” as object description)."
+
+# Cache persistente dei risultati di detection, indirizzata per contenuto (immagine ridimensionata,
+# modello, system instructions e prompt). DETECTION_CACHE_BYPASS=1 disabilita lettura e scrittura.
+detection_cache = DiskCache(
+    os.getenv("DETECTION_CACHE_DIR", os.path.join(".cache", "object_detection")),
+    max_bytes=int(os.getenv("DETECTION_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+    max_age_seconds=float(os.getenv("DETECTION_CACHE_MAX_AGE_SECONDS", str(30 * 24 * 3600))),
+    bypass=os.getenv("DETECTION_CACHE_BYPASS", "0") == "1",
+)
+
+# Backend di detection: "gemini" (modello multimodale), "cv" (rilevamento classico offline, nessuna
+# chiamata di rete) oppure "hybrid" (le regioni trovate dal rilevamento classico vengono etichettate
+# da Gemini con una sola chiamata sui ritagli). HYBRID_LABEL_SCOPE=ambiguous invia a Gemini solo le
+# regioni incerte (le altre restano con un'etichetta generica icon_N), "all" le invia tutte.
+DETECTION_BACKEND = os.getenv("DETECTION_BACKEND", "gemini")
+HYBRID_LABEL_SCOPE = os.getenv("HYBRID_LABEL_SCOPE", "ambiguous")
+
+region_labelling_instructions = """
+    You label icons cropped from a 2D architecture diagram. Each crop is preceded by its index.
+    Return a JSON array of objects {"index": <index>, "label": <label>}, one per crop. Never return code fencing.
+    The label should be as specific as possible (e.g. the service or technology the icon represents), with underscores instead of spaces.
+    If a crop is not an icon (text only, an arrow, an empty container or a fragment of something else), use the label "none".
+      """
 
-@tool("object_detection_tool", parse_docstring=True)
-def detect_objects_in_image(img_path: str) -> str:
+# Detection a tasselli per i diagrammi grandi (solo backend gemini): l'immagine viene ridimensionata
+# entro TILED_MAX_SIDE invece che 1024x1024, divisa in tasselli sovrapposti di TILE_SIZE pixel
+# inviati al modello in parallelo (al più TILE_MAX_CONCURRENCY richieste alla volta), e le box
+# vengono fuse sulle giunture. "off" la disabilita, "on" la usa sempre, "auto" solo per le immagini
+# con il lato maggiore oltre TILED_MIN_SIDE.
+TILED_DETECTION = os.getenv("TILED_DETECTION", "off")
+TILED_MIN_SIDE = int(os.getenv("TILED_MIN_SIDE", "2048"))
+TILED_MAX_SIDE = int(os.getenv("TILED_MAX_SIDE", "3072"))
+TILE_MAX_CONCURRENCY = int(os.getenv("TILE_MAX_CONCURRENCY", "4"))
+
+# DETECTION_STREAMING=1: la risposta è JSON vincolato da uno schema (box_2d/label, niente fence da
+# rimuovere) ricevuto con generate_content_stream; ogni box viene ritagliata e codificata da un
+# CropWorker appena arriva, mentre il modello genera le successive. Solo backend gemini a immagine intera.
+DETECTION_STREAMING = os.getenv("DETECTION_STREAMING", "0") == "1"
+
+# I ritagli vengono sempre registrati in memoria per l'embedding Draw.io;
+# la scrittura su disco in output_llm/ è un effetto collaterale opzionale
+SAVE_CROPS_TO_DISK = os.getenv("SAVE_CROPS_TO_DISK", "1") == "1"
+
+def detection_cache_key(im: Image.Image, tiled: bool = False, structured: bool = False) -> str:
     """
-    Detects objects in an image and returns their 2D bounding boxes along with labels.
+    Calcola la chiave di cache per un'immagine già ridimensionata.
 
     Args:
-        img_path (str): The path to the image file.
+        im: L'immagine (intera o tassello) inviata al modello.
+        tiled: Se il risultato è la fusione della detection a tasselli.
+        structured: Se la risposta è prodotta con output strutturato (structured_detection_config).
+    """
+    parts = [im.mode, f"{im.size[0]}x{im.size[1]}", im.tobytes(), model_name, bounding_box_system_instructions, user_prompt]
+    if DETECTION_BACKEND != "gemini":
+        # Le chiavi del backend gemini restano quelle di prima: la cache esistente rimane valida
+        parts += [DETECTION_BACKEND, HYBRID_LABEL_SCOPE, region_labelling_instructions]
+    if tiled:
+        parts += ["tiled", str(TILE_SIZE), str(TILE_OVERLAP)]
+    elif structured:
+        parts += ["structured"]
+    return hash_key(*parts)
+
+def use_tiled_detection(img_path: str) -> bool:
+    """
+    Indica se l'immagine va rilevata a tasselli secondo TILED_DETECTION
+    (in modalità "auto" legge solo l'intestazione del file per la dimensione).
+    """
+    if TILED_DETECTION == "off" or DETECTION_BACKEND != "gemini":
+        return False
+    if TILED_DETECTION == "on":
+        return True
+    with Image.open(img_path) as im:
+        return max(im.size) > TILED_MIN_SIDE
+
+def load_detection_image(img_path: str, tiled: Optional[bool] = None) -> Image.Image:
+    """
+    Carica l'immagine alla risoluzione usata dalla detection (e quindi per i ritagli).
+    tiled è il risultato di use_tiled_detection, se il chiamante lo ha già calcolato.
+    """
+    if tiled is None:
+        tiled = use_tiled_detection(img_path)
+    max_side = TILED_MAX_SIDE if tiled else 1024
+    return load_thumbnail(img_path, (max_side, max_side))
+
+def detection_config():
+    """
+    Configurazione della richiesta di detection (condivisa da versione sincrona e asincrona).
+    """
+    from google.genai import types  # Import al primo uso: google.genai è lento da importare
+
+    safety_settings = [
+        types.SafetySetting(
+            category="HARM_CATEGORY_DANGEROUS_CONTENT",
+            threshold="BLOCK_ONLY_HIGH",
+        ),
+    ]
+    return types.GenerateContentConfig( # Corretto da 'config' a 'generation_config'
+        system_instruction=bounding_box_system_instructions, # system_instruction non è un parametro di GenerationConfig
+        temperature=0,
+        safety_settings=safety_settings,
+    )
+
+def detection_schema():
+    """
+    Schema della risposta strutturata: un array di oggetti {"box_2d": [y1, x1, y2, x2], "label": str}.
+    """
+    from google.genai import types
+
+    return types.Schema(
+        type=types.Type.ARRAY,
+        items=types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "box_2d": types.Schema(type=types.Type.ARRAY, items=types.Schema(type=types.Type.INTEGER),
+                                       min_items=4, max_items=4),
+                "label": types.Schema(type=types.Type.STRING),
+            },
+            required=["box_2d", "label"],
+            property_ordering=["box_2d", "label"],
+        ),
+    )
+
+def structured_detection_config():
+    """
+    Configurazione della detection con output JSON vincolato da detection_schema.
+    """
+    return detection_config().model_copy(update={
+        "response_mime_type": "application/json",
+        "response_schema": detection_schema(),
+    })
+
+def prepare_detection(img_path: str, tiled: bool) -> tuple[Image.Image, str, Optional[str]]:
+    """
+    Carica l'immagine ridimensionata e cerca il risultato in cache.
+
+    Args:
+        img_path: Il percorso dell'immagine.
+        tiled: Il risultato di use_tiled_detection, calcolato una sola volta per richiesta.
 
     Returns:
-        str: A JSON string containing the detected objects' bounding boxes and labels,
-             or an error message if detection fails.
+        tuple: (immagine, chiave di cache, risposta in cache o None)
     """
+    # Load and resize image (decodifica condivisa con gli altri tool tramite la cache del processo)
+    im = load_detection_image(img_path, tiled)
+    # Solo la detection gemini a immagine intera usa l'output strutturato (vedi run_detection)
+    structured = DETECTION_STREAMING and DETECTION_BACKEND == "gemini" and not tiled
+    cache_key = detection_cache_key(im, tiled=tiled, structured=structured)
+    result_text = detection_cache.get(cache_key)
+    if result_text is not None:
+        print(f"Detection cache hit: {cache_key[:12]} ({detection_cache.stats()})")
+    return im, cache_key, result_text
 
-    user_prompt: str = "Detect the 2d bounding boxes of the objects in the image (with “label” as object description)."
-    if not GOOGLE_API_KEY:
-        return "Error: GEMINI_API_KEY not configured."
+def store_detection_result(cache_key: str, result_text: str) -> None:
+    """
+    Salva in cache una nuova risposta del modello, solo se contiene JSON valido.
+    """
+    observe_size("detection_json_chars", len(result_text or ""))
     try:
-        # Load and resize image
-        with open(img_path, "rb") as f:
-            img_bytes = f.read()
-        im = Image.open(BytesIO(img_bytes))
-        im.thumbnail([1024,1024], Image.Resampling.LANCZOS)
+        json.loads(parse_json(result_text))
+        detection_cache.set(cache_key, result_text)
+    except (TypeError, ValueError):
+        print("Risposta di detection non valida: non salvata in cache.")
+
+def labelling_config():
+    """
+    Configurazione della richiesta di etichettatura delle regioni (backend hybrid).
+    """
+    from google.genai import types
+
+    return types.GenerateContentConfig(
+        system_instruction=region_labelling_instructions,
+        temperature=0,
+        response_mime_type="application/json",
+    )
+
+def regions_to_label(regions: list[dict]) -> list[int]:
+    """
+    Indici delle regioni da far etichettare a Gemini secondo HYBRID_LABEL_SCOPE.
+    """
+    if HYBRID_LABEL_SCOPE == "all":
+        return list(range(len(regions)))
+    return [i for i, region in enumerate(regions) if region["ambiguous"]]
+
+def labelling_contents(im: Image.Image, regions: list[dict], indices: list[int]) -> list:
+    """
+    Prompt multimodale con i ritagli numerati delle regioni da etichettare.
+    """
+    contents = [f"Label the {len(indices)} cropped icons."]
+    for i in indices:
+        contents += [f"Crop {i}:", im.crop(regions[i]["box"])]
+    return contents
+
+def apply_region_labels(regions: list[dict], response_text: str) -> list[dict]:
+    """
+    Applica alle regioni le etichette restituite dal modello; le regioni etichettate "none"
+    vengono scartate, quelle senza risposta mantengono l'etichetta generica.
+
+    Raises:
+        ValueError: Se la risposta non contiene JSON valido.
+    """
+    labels = {}
+    for item in json.loads(parse_json(response_text)):
+        if isinstance(item, dict) and "index" in item and item.get("label"):
+            labels[int(item["index"])] = str(item["label"]).strip().replace(" ", "_")
+    labelled = []
+    for i, region in enumerate(regions):
+        label = labels.get(i, region.get("label") or f"icon_{i + 1}")
+        if label.lower() != "none":
+            labelled.append({**region, "label": label})
+    return labelled
+
+def _require_client():
+    if not GOOGLE_API_KEY:
+        raise ValueError("GEMINI_API_KEY not configured.")
+    client = get_genai_client()
+    if client is None:
+        raise ValueError("GenAI client not initialized.")
+    return client
 
-        # Run model to find bounding boxes
+def run_cv_detection(im: Image.Image) -> list[dict]:
+    """
+    Rilevamento classico delle regioni, con etichette generiche icon_N.
+    """
+    with timed("cv_detection"):
+        regions = detect_regions(im)
+    return [{**region, "label": f"icon_{i + 1}"} for i, region in enumerate(regions)]
+
+def run_hybrid_detection(im: Image.Image) -> str:
+    """
+    Backend hybrid: rilevamento classico delle regioni ed etichettatura con Gemini dei soli ritagli
+    selezionati da HYBRID_LABEL_SCOPE (nessuna chiamata se non ce ne sono).
+    """
+    regions = run_cv_detection(im)
+    indices = regions_to_label(regions)
+    if indices:
+        client = _require_client()
+        with timed("gemini_region_labelling"):
+            response = client.models.generate_content(
+                model=model_name,
+                contents=labelling_contents(im, regions, indices),
+                config=labelling_config(),
+            )
+        regions = apply_region_labels(regions, response.text)
+    return regions_to_json(regions, *im.size)
+
+async def arun_hybrid_detection(im: Image.Image) -> str:
+    """
+    Versione asincrona di run_hybrid_detection.
+    """
+    regions = await asyncio.to_thread(run_cv_detection, im)
+    indices = regions_to_label(regions)
+    if indices:
+        client = _require_client()
+        contents = await asyncio.to_thread(labelling_contents, im, regions, indices)
+        with timed("gemini_region_labelling"):
+            response = await client.aio.models.generate_content(
+                model=model_name,
+                contents=contents,
+                config=labelling_config(),
+            )
+        regions = apply_region_labels(regions, response.text)
+    return regions_to_json(regions, *im.size)
+
+def gemini_detect(client, im: Image.Image) -> str:
+    """
+    Chiamata di detection al modello su un'immagine (o un tassello).
+    """
+    # Run model to find bounding boxes
+    with timed("gemini_detection"):
         response = client.models.generate_content(
             model=model_name,
             contents=[user_prompt, im],
-            config = types.GenerateContentConfig( # Corretto da 'config' a 'generation_config'
-                system_instruction=bounding_box_system_instructions, # system_instruction non è un parametro di GenerationConfig
-                temperature=0,
-                safety_settings=safety_settings,
-            )
+            config=detection_config(),
         )
-        
-        save_cropped_images(im, response.text, output_folder="output_llm")
-        plot_bounding_boxes(im, response.text)
+    return response.text
 
-        return response.text
+async def agemini_detect(client, im: Image.Image) -> str:
+    """
+    Versione asincrona di gemini_detect.
+    """
+    with timed("gemini_detection"):
+        response = await client.aio.models.generate_content(
+            model=model_name,
+            contents=[user_prompt, im],
+            config=detection_config(),
+        )
+    return response.text
+
+def _feed_stream(stream: JsonArrayStream, worker: CropWorker, text: str) -> None:
+    if stream.done:
+        return
+    try:
+        for item in stream.feed(text):
+            if isinstance(item, dict):
+                worker.submit(item)
+    except ValueError as e:
+        # Il ritaglio anticipato si ferma; la risposta completa viene comunque validata alla fine
+        print(f"Streaming della detection interrotto: {e}")
+        stream.done = True
+
+def gemini_detect_stream(client, im: Image.Image) -> tuple[str, dict[tuple, bytes]]:
+    """
+    Detection in streaming con output strutturato: le box vengono ritagliate e codificate da un
+    CropWorker man mano che arrivano. Il worker viene sempre chiuso prima di uscire.
+
+    Returns:
+        tuple: (risposta JSON completa, PNG dei ritagli anticipati indicizzati per box in pixel)
+    """
+    stream, worker, chunks = JsonArrayStream(), CropWorker(im), []
+    try:
+        with timed("gemini_detection"):
+            for chunk in client.models.generate_content_stream(
+                model=model_name,
+                contents=[user_prompt, im],
+                config=structured_detection_config(),
+            ):
+                text = chunk.text or ""
+                chunks.append(text)
+                _feed_stream(stream, worker, text)
+    except BaseException:
+        worker.close(cancel=True)
+        raise
+    worker.close()  # Attende gli ultimi ritagli anticipati
+    observe_size("detection_streamed_boxes", stream.items_count)
+    return "".join(chunks), worker.encoded
+
+async def agemini_detect_stream(client, im: Image.Image) -> tuple[str, dict[tuple, bytes]]:
+    """
+    Versione asincrona di gemini_detect_stream (i ritagli vengono codificati nel thread del CropWorker).
+    """
+    stream, worker, chunks = JsonArrayStream(), CropWorker(im), []
+    try:
+        with timed("gemini_detection"):
+            async for chunk in await client.aio.models.generate_content_stream(
+                model=model_name,
+                contents=[user_prompt, im],
+                config=structured_detection_config(),
+            ):
+                text = chunk.text or ""
+                chunks.append(text)
+                _feed_stream(stream, worker, text)
+    except BaseException:
+        worker.close(cancel=True)
+        raise
+    await asyncio.to_thread(worker.close)
+    observe_size("detection_streamed_boxes", stream.items_count)
+    return "".join(chunks), worker.encoded
+
+def prepare_tiles(im: Image.Image) -> tuple[list, list[Image.Image], list[str], list[Optional[str]]]:
+    """
+    Divide l'immagine in tasselli e cerca in cache il risultato di ciascuno.
+
+    Returns:
+        tuple: (box dei tasselli, immagini dei tasselli, chiavi di cache, risposte in cache o None)
+    """
+    tiles = tile_grid(*im.size)
+    tile_images = [im.crop(tile) for tile in tiles]
+    # Le richieste per tassello non usano mai l'output strutturato
+    cache_keys = [detection_cache_key(tile_im, structured=False) for tile_im in tile_images]
+    results = [detection_cache.get(key) for key in cache_keys]
+    observe_size("detection_tiles", len(tiles))
+    print(f"Detection a tasselli: {len(tiles)} tasselli, {sum(r is not None for r in results)} in cache")
+    return tiles, tile_images, cache_keys, results
+
+def merge_tiles(im: Image.Image, tiles: list, results: list[str]) -> str:
+    """
+    Riporta in coordinate globali e fonde sulle giunture le box di tutti i tasselli.
+    I tasselli con una risposta non valida vengono ignorati.
+    """
+    all_boxes, all_labels, tile_indices = [], [], []
+    for i, (tile, result_text) in enumerate(zip(tiles, results)):
+        try:
+            boxes, labels = tile_boxes_to_global(result_text, tile)
+        except (TypeError, ValueError) as e:
+            print(f"Risposta non valida per il tassello {tile}: {e}")
+            continue
+        all_boxes.append(boxes)
+        all_labels += labels
+        tile_indices += [i] * len(labels)
+    if not all_labels:
+        return "[]"
+    boxes, labels = merge_tile_detections(np.concatenate(all_boxes), all_labels, np.array(tile_indices), tiles, *im.size)
+    return json.dumps(boxes_to_json_list(boxes, labels, *im.size))
+
+def run_tiled_detection(im: Image.Image) -> str:
+    """
+    Detection a tasselli: i tasselli non in cache vengono inviati al modello con un pool di
+    al più TILE_MAX_CONCURRENCY thread, quindi la latenza resta vicina a quella di una chiamata.
+    """
+    tiles, tile_images, cache_keys, results = prepare_tiles(im)
+    missing = [i for i, result_text in enumerate(results) if result_text is None]
+    if missing:
+        client = _require_client()
+        with ThreadPoolExecutor(max_workers=max(min(TILE_MAX_CONCURRENCY, len(missing)), 1)) as pool:
+            for i, result_text in zip(missing, pool.map(lambda i: gemini_detect(client, tile_images[i]), missing)):
+                results[i] = result_text
+                store_detection_result(cache_keys[i], result_text)
+    return merge_tiles(im, tiles, results)
+
+async def arun_tiled_detection(im: Image.Image) -> str:
+    """
+    Versione asincrona di run_tiled_detection: la concorrenza è limitata da un semaforo.
+    """
+    tiles, tile_images, cache_keys, results = await asyncio.to_thread(prepare_tiles, im)
+    missing = [i for i, result_text in enumerate(results) if result_text is None]
+    if missing:
+        client = _require_client()
+        semaphore = asyncio.Semaphore(max(TILE_MAX_CONCURRENCY, 1))
+
+        async def detect_tile(i: int) -> str:
+            async with semaphore:
+                return await agemini_detect(client, tile_images[i])
+
+        for i, result_text in zip(missing, await asyncio.gather(*(detect_tile(i) for i in missing))):
+            results[i] = result_text
+            await asyncio.to_thread(store_detection_result, cache_keys[i], result_text)
+    return await asyncio.to_thread(merge_tiles, im, tiles, results)
+
+def run_detection(img_path: str) -> tuple[Image.Image, str, Optional[dict[tuple, bytes]]]:
+    """
+    Esegue la detection (cache o backend configurato da DETECTION_BACKEND) senza ritagliare gli oggetti.
+
+    Returns:
+        tuple: (immagine ridimensionata, risposta JSON del modello senza box duplicate, ritagli già
+               codificati durante lo streaming da passare a crop_detected_objects, o None)
+
+    Raises:
+        FileNotFoundError: Se l'immagine non esiste.
+        ValueError: Se il backend richiede Gemini, GEMINI_API_KEY non è configurato e il risultato non è in cache.
+    """
+    tiled = use_tiled_detection(img_path)
+    im, cache_key, result_text = prepare_detection(img_path, tiled)
+    encoded_crops = None
+    if result_text is None:
+        if DETECTION_BACKEND == "cv":
+            result_text = regions_to_json(run_cv_detection(im), *im.size)
+        elif DETECTION_BACKEND == "hybrid":
+            result_text = run_hybrid_detection(im)
+        elif tiled:
+            result_text = run_tiled_detection(im)
+        elif DETECTION_STREAMING:
+            result_text, encoded_crops = gemini_detect_stream(_require_client(), im)
+        else:
+            result_text = gemini_detect(_require_client(), im)
+        store_detection_result(cache_key, result_text)
+    # La cache conserva la risposta originale; i duplicati vengono scartati prima di qualsiasi ritaglio
+    return im, deduplicate_detection_json(result_text, *im.size), encoded_crops
+
+async def arun_detection(img_path: str) -> tuple[Image.Image, str, Optional[dict[tuple, bytes]]]:
+    """
+    Versione asincrona di run_detection: usa client.aio per la chiamata al modello
+    e sposta I/O su file e lavoro PIL in un thread, senza bloccare l'event loop.
+    """
+    tiled = await asyncio.to_thread(use_tiled_detection, img_path)
+    im, cache_key, result_text = await asyncio.to_thread(prepare_detection, img_path, tiled)
+    encoded_crops = None
+    if result_text is None:
+        if DETECTION_BACKEND == "cv":
+            regions = await asyncio.to_thread(run_cv_detection, im)
+            result_text = regions_to_json(regions, *im.size)
+        elif DETECTION_BACKEND == "hybrid":
+            result_text = await arun_hybrid_detection(im)
+        elif tiled:
+            result_text = await arun_tiled_detection(im)
+        elif DETECTION_STREAMING:
+            result_text, encoded_crops = await agemini_detect_stream(_require_client(), im)
+        else:
+            result_text = await agemini_detect(_require_client(), im)
+        await asyncio.to_thread(store_detection_result, cache_key, result_text)
+    # La cache conserva la risposta originale; i duplicati vengono scartati prima di qualsiasi ritaglio
+    return im, deduplicate_detection_json(result_text, *im.size), encoded_crops
+
+def crop_detected_objects(im: Image.Image, result_text: str, output_folder: str = "output_llm",
+                          encoded_crops: Optional[dict[tuple, bytes]] = None) -> list[str]:
+    """
+    Ritaglia gli oggetti rilevati (in memoria e, se configurato, su disco) e accoda l'overlay delle box.
+    encoded_crops sono i ritagli già codificati restituiti da run_detection in streaming.
+
+    Returns:
+        list[str]: I percorsi dei ritagli salvati.
+
+    Raises:
+        ValueError: Se la risposta del modello non contiene JSON valido.
+    """
+    # Parsing unico delle box, condiviso da ritaglio e visualizzazione
+    bounding_boxes = BoundingBoxes.from_json(result_text, *im.size)
+    saved_paths = save_cropped_images(im, bounding_boxes, output_folder=output_folder,
+                                      asset_store=get_asset_store(output_folder), write_to_disk=SAVE_CROPS_TO_DISK,
+                                      encoded_crops=encoded_crops)
+    schedule_overlay(im, bounding_boxes, output_folder)
+    return saved_paths
+
+def _detect_objects_in_image(img_path: str, state: Annotated[Optional[dict], InjectedState] = None) -> str:
+    """
+    Detects objects in an image and returns their 2D bounding boxes along with labels.
+
+    Args:
+        img_path (str): The path to the image file.
+
+    Returns:
+        str: A JSON string containing the detected objects' bounding boxes and labels,
+             or an error message if detection fails.
+    """
+
+    try:
+        im, result_text, encoded_crops = run_detection(img_path)
+        # Ritagli e overlay vanno nel workspace della richiesta (iniettato dal ToolNode)
+        crop_detected_objects(im, result_text, workspace_of(state), encoded_crops)
+        return result_text
     except FileNotFoundError:
         return f"Error: Image file not found at {img_path}."
+    except json.JSONDecodeError as e:
+        return f"Error detecting objects: invalid model response ({e})"
     except Exception as e:
         return f"Error detecting objects: {str(e)}"
+
+async def _adetect_objects_in_image(img_path: str, state: Annotated[Optional[dict], InjectedState] = None) -> str:
+    """
+    Versione asincrona di _detect_objects_in_image.
+    """
+    try:
+        im, result_text, encoded_crops = await arun_detection(img_path)
+        await asyncio.to_thread(crop_detected_objects, im, result_text, workspace_of(state), encoded_crops)
+        return result_text
+    except FileNotFoundError:
+        return f"Error: Image file not found at {img_path}."
+    except json.JSONDecodeError as e:
+        return f"Error detecting objects: invalid model response ({e})"
+    except Exception as e:
+        return f"Error detecting objects: {str(e)}"
+
+# Un solo tool con implementazione sincrona (invoke) e asincrona (ainvoke)
+detect_objects_in_image = StructuredTool.from_function(
+    func=_detect_objects_in_image,
+    coroutine=_adetect_objects_in_image,
+    name="object_detection_tool",
+    parse_docstring=True,
+)
@@ -0,0 +1,115 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from utils.cache import hash_key
+
+
+def task_input_hash(question: str, file_name: Optional[str], files_folder: str = "files") -> str:
+    """
+    Calcola l'hash dell'input di un task: testo della domanda, nome del file allegato
+    e, se presente su disco, il suo contenuto.
+
+    Args:
+        question: Il testo della domanda.
+        file_name: Il nome del file allegato (può essere None o vuoto).
+        files_folder: La cartella in cui si trovano i file allegati.
+
+    Returns:
+        str: L'hash dell'input.
+    """
+    file_name = (file_name or "").strip()
+    file_bytes = b""
+    if file_name:
+        file_path = os.path.join(files_folder, file_name)
+        if os.path.isfile(file_path):
+            with open(file_path, "rb") as f:
+                file_bytes = f.read()
+    return hash_key(question or "", file_name, file_bytes)
+
+
+class AnswerStore:
+    """
+    Archivio SQLite delle risposte per task, usato per riprendere una valutazione interrotta.
+
+    Ogni task_id ha al più una riga: se la domanda o il file allegato cambiano,
+    l'hash dell'input non corrisponde più e il task viene rieseguito.
+    """
+
+    def __init__(self, db_path: str = os.path.join(".cache", "answers.sqlite3")):
+        self.db_path = db_path
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS answers (
+                    task_id TEXT PRIMARY KEY,
+                    input_hash TEXT NOT NULL,
+                    question TEXT,
+                    file_name TEXT,
+                    answer TEXT,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+
+    def get_answer(self, task_id: str, input_hash: str) -> Optional[str]:
+        """
+        Restituisce la risposta salvata per il task se è andata a buon fine e l'input non è cambiato.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT answer FROM answers WHERE task_id = ? AND input_hash = ? AND status = 'ok'",
+                (task_id, input_hash),
+            ).fetchone()
+        return row[0] if row else None
+
+    def save_answer(self, task_id: str, input_hash: str, question: str, file_name: Optional[str], answer: str) -> None:
+        """
+        Salva (o sovrascrive) la risposta di un task completato con successo.
+        """
+        self._upsert(task_id, input_hash, question, file_name, answer, "ok", None)
+
+    def save_error(self, task_id: str, input_hash: str, question: str, file_name: Optional[str], error: str) -> None:
+        """
+        Registra un task fallito, che verrà rieseguito alla prossima valutazione.
+        """
+        self._upsert(task_id, input_hash, question, file_name, None, "error", error)
+
+    def _upsert(self, task_id, input_hash, question, file_name, answer, status, error) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO answers (task_id, input_hash, question, file_name, answer, status, error, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(task_id) DO UPDATE SET
+                    input_hash = excluded.input_hash,
+                    question = excluded.question,
+                    file_name = excluded.file_name,
+                    answer = excluded.answer,
+                    status = excluded.status,
+                    error = excluded.error,
+                    updated_at = excluded.updated_at
+                """,
+                (task_id, input_hash, question, file_name, answer, status, error, time.time()),
+            )
+
+    def all_answers(self) -> list[dict]:
+        """
+        Restituisce tutte le risposte andate a buon fine, ordinate per task_id.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT task_id, question, file_name, answer FROM answers WHERE status = 'ok' ORDER BY task_id"
+            ).fetchall()
+        return [
+            {"task_id": task_id, "question": question, "file_name": file_name, "answer": answer}
+            for task_id, question, file_name, answer in rows
+        ]
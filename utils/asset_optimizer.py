@@ -0,0 +1,180 @@
+import hashlib
+import io
+import math
+import os
+from typing import Optional
+from xml.etree import ElementTree as ET
+
+from PIL import Image
+
+from utils.asset_store import Asset, AssetStore
+
+
+def image_reference(style: str) -> Optional[str]:
+    """
+    Estrae il nome file dal valore image= di uno style Draw.io (senza quote né prefisso file://).
+    """
+    for part in style.split(';'):
+        if not part.startswith('image='):
+            continue
+        image_ref = part[6:].strip('"\'')
+        if image_ref.startswith('data:'):
+            return None  # Già incorporata
+        if image_ref.startswith('file://'):
+            image_ref = image_ref.replace('file://', '').lstrip('./')
+        return os.path.basename(image_ref)
+    return None
+
+
+def collect_image_geometry(xml_content: str) -> dict[str, tuple[float, float]]:
+    """
+    Legge dall'XML Draw.io la dimensione con cui ogni immagine referenziata viene mostrata.
+
+    Se la stessa immagine compare in più celle viene presa la dimensione massima.
+
+    Args:
+        xml_content: Contenuto XML Draw.io con riferimenti alle immagini per nome file.
+
+    Returns:
+        dict: Nome file -> (larghezza, altezza) in unità Draw.io.
+    """
+    geometry: dict[str, tuple[float, float]] = {}
+    root = ET.fromstring(xml_content)
+    for cell in root.iter('mxCell'):
+        filename = image_reference(cell.get('style', ''))
+        if not filename:
+            continue
+        geom = cell.find('mxGeometry')
+        if geom is None:
+            continue
+        try:
+            width = float(geom.get('width', 0))
+            height = float(geom.get('height', 0))
+        except ValueError:
+            continue
+        if width <= 0 or height <= 0:
+            continue
+        old_width, old_height = geometry.get(filename, (0.0, 0.0))
+        geometry[filename] = (max(old_width, width), max(old_height, height))
+    return geometry
+
+
+def _encode(im: Image.Image, output_format: str, quantize: bool, webp_quality: int) -> tuple[bytes, str]:
+    if quantize and im.mode in ("RGB", "RGBA"):
+        # FASTOCTREE è l'unico metodo che supporta il canale alpha
+        im = im.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+    buffer = io.BytesIO()
+    if output_format == "WEBP":
+        if im.mode == "P":
+            im = im.convert("RGBA")
+        im.save(buffer, format="WEBP", quality=webp_quality, method=4)
+        return buffer.getvalue(), "image/webp"
+    im.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue(), "image/png"
+
+
+def optimize_asset(
+    filename: str,
+    width: float,
+    height: float,
+    asset_store: AssetStore,
+    dpi_scale: float = 2.0,
+    quantize: bool = False,
+    output_format: str = "PNG",
+    webp_quality: int = 80,
+    optimized_by_digest: Optional[dict[tuple, tuple[Asset, str]]] = None,
+) -> Optional[dict]:
+    """
+    Ottimizza un solo asset per la geometria width x height con cui viene mostrato (vedi optimize_assets).
+
+    Args:
+        optimized_by_digest: Gli asset già ottimizzati, per condividere quelli con byte identici
+                             (aggiornato sul posto).
+
+    Returns:
+        dict: Il report dell'asset, o None se l'asset non è nell'archivio o non è stato possibile ottimizzarlo.
+    """
+    asset = asset_store.get(filename)
+    if asset is None:
+        return None
+    # Ogni passaggio riparte dal ritaglio originale: un retry o una geometria più grande
+    # non lavorano sui byte già ridotti da un'ottimizzazione precedente
+    asset = asset.original or asset
+    output_format = output_format.upper()
+    optimized_by_digest = optimized_by_digest if optimized_by_digest is not None else {}
+    target = (max(1, math.ceil(width * dpi_scale)), max(1, math.ceil(height * dpi_scale)))
+    original_bytes = len(asset.data)
+    digest_key = (hashlib.sha256(asset.data).hexdigest(), target)
+
+    duplicate = optimized_by_digest.get(digest_key)
+    if duplicate is not None:
+        shared_asset, duplicate_of = duplicate
+        asset_store.set(filename, shared_asset)
+        return {"asset": filename, "original_bytes": original_bytes, "optimized_bytes": len(shared_asset.data),
+                "saved_bytes": original_bytes - len(shared_asset.data), "size": None, "duplicate_of": duplicate_of}
+
+    try:
+        im = Image.open(io.BytesIO(asset.data))
+        im.load()
+        if im.width > target[0] or im.height > target[1]:
+            im.thumbnail(target, Image.Resampling.LANCZOS)
+        data, mime_type = _encode(im, output_format, quantize, webp_quality)
+    except Exception as e:
+        print(f"Errore nell'ottimizzare l'asset {filename}: {e}")
+        return None
+
+    if len(data) < original_bytes:
+        asset = asset_store.put(filename, data, mime_type, original=asset)
+    else:
+        asset_store.set(filename, asset)
+    optimized_by_digest[digest_key] = (asset, filename)
+    return {"asset": filename, "original_bytes": original_bytes, "optimized_bytes": len(asset.data),
+            "saved_bytes": original_bytes - len(asset.data), "size": im.size, "duplicate_of": None}
+
+
+def optimize_assets(
+    xml_content: str,
+    asset_store: AssetStore,
+    dpi_scale: float = 2.0,
+    quantize: bool = False,
+    output_format: str = "PNG",
+    webp_quality: int = 80,
+) -> list[dict]:
+    """
+    Ottimizza i ritagli referenziati nell'XML prima dell'embedding base64.
+
+    Per ogni immagine referenziata: riduce il ritaglio alla geometria con cui viene mostrato
+    (moltiplicata per dpi_scale), opzionalmente quantizza la palette e ricodifica in PNG ottimizzato
+    o WebP. La nuova codifica viene tenuta solo se più piccola. Gli asset con byte identici
+    vengono ottimizzati una volta sola e condivisi nell'archivio.
+
+    Args:
+        xml_content: Contenuto XML Draw.io con riferimenti alle immagini per nome file.
+        asset_store: L'archivio in memoria con i ritagli da ottimizzare (modificato sul posto).
+        dpi_scale: Moltiplicatore della geometria Draw.io per ottenere la dimensione in pixel.
+        quantize: Se True riduce le immagini a una palette di 256 colori.
+        output_format: "PNG" o "WEBP".
+        webp_quality: Qualità della codifica WebP (0-100).
+
+    Returns:
+        list[dict]: Un report per asset con dimensione originale, ottimizzata e byte risparmiati.
+    """
+    output_format = output_format.upper()
+    try:
+        geometry = collect_image_geometry(xml_content)
+    except ET.ParseError as e:
+        print(f"Ottimizzazione asset saltata, XML non valido: {e}")
+        return []
+
+    report = []
+    optimized_by_digest: dict[tuple, tuple[Asset, str]] = {}
+    for filename, (width, height) in geometry.items():
+        entry = optimize_asset(filename, width, height, asset_store, dpi_scale, quantize, output_format,
+                               webp_quality, optimized_by_digest)
+        if entry is not None:
+            report.append(entry)
+
+    for entry in report:
+        print(f"Asset {entry['asset']}: {entry['original_bytes']} -> {entry['optimized_bytes']} bytes "
+              f"(-{entry['saved_bytes']})" + (f", duplicato di {entry['duplicate_of']}" if entry['duplicate_of'] else ""))
+    return report
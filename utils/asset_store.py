@@ -0,0 +1,112 @@
+import base64
+import os
+import threading
+from typing import Optional
+
+
+def sanitize_label(label: str, fallback: str) -> str:
+    """
+    Trasforma un'etichetta in un nome file sicuro (alfanumerici, '_' e '-', spazi sostituiti da '_').
+    """
+    safe_label = "".join(c for c in label if c.isalnum() or c in (' ', '_', '-')).strip().replace(' ', '_')
+    return safe_label or fallback
+
+
+class Asset:
+    """
+    Un'immagine codificata tenuta in memoria, con la sua forma base64 calcolata al primo uso.
+    """
+
+    def __init__(self, name: str, data: bytes, mime_type: str = "image/png", original: Optional["Asset"] = None):
+        self.name = name
+        self.data = data
+        self.mime_type = mime_type
+        # Per una versione ottimizzata, l'asset originale da cui ripartire in un'ottimizzazione successiva
+        self.original = original
+        self._base64: Optional[str] = None
+
+    @property
+    def base64(self) -> str:
+        if self._base64 is None:
+            self._base64 = base64.b64encode(self.data).decode("ascii")
+        return self._base64
+
+    @property
+    def data_uri(self) -> str:
+        # Formato Draw.io: data:image/type,base64_data (SENZA ;base64)
+        return f"data:{self.mime_type},{self.base64}"
+
+
+class AssetStore:
+    """
+    Archivio in memoria dei ritagli codificati, indicizzati per nome file (etichetta sanificata + estensione).
+
+    Permette di incorporare i ritagli nell'XML Draw.io senza rileggerli da disco.
+    """
+
+    def __init__(self):
+        self._assets: dict[str, Asset] = {}
+        self._lock = threading.Lock()
+
+    def put(self, name: str, data: bytes, mime_type: str = "image/png", original: Optional[Asset] = None) -> Asset:
+        asset = Asset(name, data, mime_type, original)
+        with self._lock:
+            self._assets[name] = asset
+        return asset
+
+    def set(self, name: str, asset: Asset) -> None:
+        """
+        Associa un asset esistente ad un nome (usato per condividere asset identici).
+        """
+        with self._lock:
+            self._assets[name] = asset
+
+    def get(self, name: str) -> Optional[Asset]:
+        """
+        Restituisce l'asset con il nome dato; accetta anche percorsi o nomi senza estensione.
+        """
+        name = os.path.basename(name)
+        with self._lock:
+            asset = self._assets.get(name)
+            if asset is None and not os.path.splitext(name)[1]:
+                asset = self._assets.get(f"{name}.png")
+        return asset
+
+    def names(self) -> list[str]:
+        with self._lock:
+            return list(self._assets)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._assets.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._assets)
+
+
+_stores: dict[str, AssetStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_asset_store(folder: str) -> AssetStore:
+    """
+    Restituisce l'archivio di asset associato ad una cartella di output, creandolo se necessario.
+
+    La cartella identifica l'archivio: i tool che scrivono e leggono i ritagli nella stessa
+    cartella condividono lo stesso archivio in memoria.
+    """
+    key = os.path.abspath(folder)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = AssetStore()
+        return store
+
+
+def drop_asset_store(folder: str) -> None:
+    """
+    Rimuove l'archivio di asset associato ad una cartella, liberandone la memoria.
+    """
+    with _stores_lock:
+        _stores.pop(os.path.abspath(folder), None)
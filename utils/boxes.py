@@ -0,0 +1,179 @@
+import json
+from typing import Optional, Union
+
+import numpy as np
+
+# Costante per il fattore di normalizzazione usato nelle coordinate
+NORMALIZATION_DIVISOR = 1000
+
+
+class BoundingBoxes:
+    """
+    Insieme di bounding box rilevate, memorizzate come array NumPy.
+
+    Attributes:
+        labels: Le etichette (None se mancanti), una per box.
+        normalized: Array (N, 4) float con le coordinate [y1, x1, y2, x2] in unità NORMALIZATION_DIVISOR,
+                    così come restituite dal modello.
+        has_coords: Maschera (N,) delle box con 'box_2d' ben formato (4 coordinate numeriche).
+        errors: Per ogni box il motivo per cui 'box_2d' non è valido, o None.
+        width, height: La dimensione in pixel dell'immagine a cui si riferiscono le coordinate assolute.
+        absolute: Array (N, 4) int con le coordinate [left, upper, right, lower] in pixel,
+                  ordinate e limitate ai bordi dell'immagine (formato di PIL.Image.crop).
+        nonzero: Maschera (N,) delle box con area in pixel non nulla.
+        valid: has_coords & nonzero.
+    """
+
+    def __init__(self, labels: list[Optional[str]], normalized: np.ndarray, has_coords: np.ndarray,
+                 errors: list[Optional[str]], width: int = NORMALIZATION_DIVISOR, height: int = NORMALIZATION_DIVISOR):
+        self.labels = labels
+        self.normalized = normalized
+        self.has_coords = has_coords
+        self.errors = errors
+        self.set_image_size(width, height)
+
+    @classmethod
+    def from_json(cls, bounding_boxes: Union[str, list], width: int = NORMALIZATION_DIVISOR,
+                  height: int = NORMALIZATION_DIVISOR) -> "BoundingBoxes":
+        """
+        Costruisce l'insieme di box dalla risposta del modello.
+
+        Args:
+            bounding_boxes: La stringa JSON (anche con fence markdown) o la lista già decodificata.
+            width: Larghezza in pixel dell'immagine.
+            height: Altezza in pixel dell'immagine.
+
+        Returns:
+            BoundingBoxes: Le box parsate.
+
+        Raises:
+            json.JSONDecodeError: Se la stringa non contiene JSON valido.
+        """
+        if isinstance(bounding_boxes, str):
+            from utils.utils import parse_json  # Import locale per evitare l'import circolare
+            bounding_boxes = json.loads(parse_json(bounding_boxes))
+        if isinstance(bounding_boxes, dict):
+            bounding_boxes = [bounding_boxes]
+
+        count = len(bounding_boxes)
+        normalized = np.zeros((count, 4), dtype=np.float64)
+        has_coords = np.zeros(count, dtype=bool)
+        labels: list[Optional[str]] = []
+        errors: list[Optional[str]] = []
+        for i, bounding_box in enumerate(bounding_boxes):
+            if not isinstance(bounding_box, dict):
+                labels.append(None)
+                errors.append("elemento non è un oggetto JSON")
+                continue
+            label = bounding_box.get("label")
+            labels.append(str(label) if label is not None else None)
+            if "box_2d" not in bounding_box:
+                errors.append("chiave 'box_2d' mancante")
+                continue
+            coords = bounding_box["box_2d"]
+            if not isinstance(coords, (list, tuple)) or len(coords) != 4:
+                errors.append("'box_2d' non ha 4 coordinate")
+                continue
+            try:
+                normalized[i] = [float(c) for c in coords]
+            except (TypeError, ValueError):
+                errors.append("'box_2d' contiene coordinate non numeriche")
+                continue
+            has_coords[i] = True
+            errors.append(None)
+        return cls(labels, normalized, has_coords, errors, width, height)
+
+    def set_image_size(self, width: int, height: int) -> "BoundingBoxes":
+        """
+        Ricalcola in un solo passaggio vettoriale le coordinate assolute per un'immagine width x height:
+        conversione, ordinamento min/max, clipping ai bordi e filtro delle box ad area nulla.
+        """
+        self.width = width
+        self.height = height
+        scale = np.array([height, width, height, width], dtype=np.float64) / NORMALIZATION_DIVISOR
+        # np.trunc replica la conversione int() usata storicamente
+        pixels = np.trunc(self.normalized * scale).astype(np.int64)
+        y1, x1, y2, x2 = pixels[:, 0], pixels[:, 1], pixels[:, 2], pixels[:, 3]
+        absolute = np.stack(
+            [np.minimum(x1, x2), np.minimum(y1, y2), np.maximum(x1, x2), np.maximum(y1, y2)], axis=1
+        )
+        absolute[:, [0, 2]] = np.clip(absolute[:, [0, 2]], 0, width)
+        absolute[:, [1, 3]] = np.clip(absolute[:, [1, 3]], 0, height)
+        self.absolute = absolute
+        self.nonzero = (absolute[:, 2] > absolute[:, 0]) & (absolute[:, 3] > absolute[:, 1])
+        self.valid = self.has_coords & self.nonzero
+        return self
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def subset(self, mask_or_indices) -> "BoundingBoxes":
+        """
+        Restituisce un nuovo insieme con le sole box selezionate (maschera booleana o indici).
+        """
+        indices = np.arange(len(self))[mask_or_indices]
+        return BoundingBoxes(
+            [self.labels[i] for i in indices],
+            self.normalized[indices].copy(),
+            self.has_coords[indices].copy(),
+            [self.errors[i] for i in indices],
+            self.width,
+            self.height,
+        )
+
+    def areas(self) -> np.ndarray:
+        """
+        Restituisce l'area in pixel di ciascuna box (0 per le box non valide).
+        """
+        return box_areas(self.absolute) * self.has_coords
+
+    def iou(self, other: Optional["BoundingBoxes"] = None) -> np.ndarray:
+        """
+        Restituisce la matrice (N, M) delle IoU in pixel tra queste box e quelle di other
+        (o tra le box stesse se other è None). Le box non valide hanno IoU 0.
+        """
+        other = self if other is None else other
+        ious = pairwise_iou(self.absolute, other.absolute)
+        return ious * self.valid[:, None] * other.valid[None, :]
+
+    def to_json_list(self) -> list[dict]:
+        """
+        Restituisce le box valide nel formato del modello ({"box_2d": [y1, x1, y2, x2], "label": ...}).
+        """
+        result = []
+        for i in np.flatnonzero(self.valid):
+            item = {"box_2d": [int(round(c)) for c in self.normalized[i]]}
+            if self.labels[i] is not None:
+                item["label"] = self.labels[i]
+            result.append(item)
+        return result
+
+
+def box_areas(boxes: np.ndarray) -> np.ndarray:
+    """
+    Calcola l'area di un array (N, 4) di box [left, upper, right, lower].
+    """
+    boxes = np.asarray(boxes, dtype=np.float64)
+    return np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None)
+
+
+def pairwise_intersection(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """
+    Calcola la matrice (N, M) delle aree di intersezione tra due array di box [left, upper, right, lower].
+    """
+    boxes_a = np.asarray(boxes_a, dtype=np.float64)
+    boxes_b = np.asarray(boxes_b, dtype=np.float64)
+    left = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    upper = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    right = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    lower = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    return np.clip(right - left, 0, None) * np.clip(lower - upper, 0, None)
+
+
+def pairwise_iou(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """
+    Calcola la matrice (N, M) delle Intersection over Union tra due array di box [left, upper, right, lower].
+    """
+    intersection = pairwise_intersection(boxes_a, boxes_b)
+    union = box_areas(boxes_a)[:, None] + box_areas(boxes_b)[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
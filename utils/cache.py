@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+
+def hash_key(*parts) -> str:
+    """
+    Calcola una chiave SHA-256 stabile a partire da una sequenza di parti (str o bytes).
+
+    Ogni parte viene prefissata dalla sua lunghezza, così ("ab", "c") e ("a", "bc")
+    producono chiavi diverse.
+
+    Args:
+        parts: Le parti da includere nella chiave.
+
+    Returns:
+        str: Il digest esadecimale della chiave.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """
+    Cache persistente su disco, indirizzata per contenuto.
+
+    Ogni voce è un file JSON '<directory>/<key[:2]>/<key>.json'. Il mtime del file
+    viene aggiornato ad ogni hit ed è l'unico orologio della cache: l'eviction per dimensione
+    rimuove prima le voci usate meno di recente (LRU) e le voci non usate da più di
+    max_age_seconds scadono, sia in get sia in evict.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 256 * 1024 * 1024,
+        max_age_seconds: Optional[float] = 30 * 24 * 3600,
+        bypass: bool = False,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None  # Calcolato pigramente alla prima scrittura
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Restituisce il valore associato alla chiave, o None se assente, scaduto o in bypass.
+        """
+        if self.bypass:
+            return None
+        path = self._path(key)
+        try:
+            last_used = os.stat(path).st_mtime
+            if self.max_age_seconds is not None and time.time() - last_used > self.max_age_seconds:
+                self._remove(path)
+                raise FileNotFoundError(path)
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        try:
+            os.utime(path, None)  # Aggiorna l'ultimo accesso per l'ordinamento LRU
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return entry.get("value")
+
+    def set(self, key: str, value: str) -> None:
+        """
+        Salva un valore nella cache in modo atomico ed applica l'eviction se necessario.
+        """
+        if self.bypass:
+            return
+        path = self._path(key)
+        payload = json.dumps({"created_at": time.time(), "value": value})
+        try:
+            # La voce sovrascritta non va contata due volte nella dimensione totale
+            replaced_size = os.stat(path).st_size
+        except OSError:
+            replaced_size = 0
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Errore nel salvare la voce di cache {path}: {e}")
+            return
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_size()
+            else:
+                self._total_bytes += len(payload.encode("utf-8")) - replaced_size
+            over_budget = self._total_bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def _scan_size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def _entries(self) -> list[tuple[str, int, float]]:
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for sub in os.listdir(self.directory):
+            sub_path = os.path.join(self.directory, sub)
+            if not os.path.isdir(sub_path):
+                continue
+            for name in os.listdir(sub_path):
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(sub_path, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def evict(self) -> int:
+        """
+        Rimuove le voci scadute e poi quelle usate meno di recente finché la cache
+        non rientra in max_bytes.
+
+        Returns:
+            int: Il numero di voci rimosse.
+        """
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda e: e[2])  # Meno recenti prima
+            total = sum(size for _, size, _ in entries)
+            now = time.time()
+            removed = 0
+            for path, size, mtime in entries:
+                expired = self.max_age_seconds is not None and now - mtime > self.max_age_seconds
+                if not expired and total <= self.max_bytes:
+                    continue
+                self._remove(path)
+                total -= size
+                removed += 1
+            self._total_bytes = total
+            self.evictions += removed
+        return removed
+
+    def stats(self) -> dict:
+        """
+        Restituisce i contatori della cache (hit, miss, eviction e dimensione su disco).
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "bytes": self._total_bytes if self._total_bytes is not None else self._scan_size(),
+                "bypass": self.bypass,
+            }
@@ -0,0 +1,70 @@
+import os
+import threading
+from typing import Any, Callable, Optional
+
+# Registro dei client e degli oggetti costosi del processo (client Gemini, modello chat, grafo compilato):
+# ognuno viene costruito al primo uso, una sola volta anche con più thread, e condiviso da tutti
+# i moduli. Le librerie pesanti (google.genai, langchain_google_genai) sono importate dalle factory,
+# quindi importare i tool o il grafo non le carica.
+
+_instances: dict[str, Any] = {}
+_locks: dict[str, threading.Lock] = {}
+_registry_lock = threading.Lock()
+
+
+def get_or_create(name: str, factory: Callable[[], Any]) -> Any:
+    """
+    Restituisce l'istanza registrata con questo nome, creandola con factory al primo uso.
+
+    La creazione avviene con un lock per nome: chiamate concorrenti attendono la stessa istanza
+    senza bloccare la costruzione di istanze diverse. Se factory solleva un'eccezione non viene
+    registrato nulla e la chiamata successiva riprova.
+    """
+    instance = _instances.get(name)
+    if instance is not None:
+        return instance
+    with _registry_lock:
+        lock = _locks.setdefault(name, threading.Lock())
+    with lock:
+        instance = _instances.get(name)
+        if instance is None:
+            instance = factory()
+            _instances[name] = instance
+        return instance
+
+
+def set_instance(name: str, instance: Any) -> None:
+    """
+    Registra (o sostituisce) un'istanza, ad esempio un backend finto nei benchmark.
+    """
+    _instances[name] = instance
+
+
+def reset(name: Optional[str] = None) -> None:
+    """
+    Rimuove un'istanza (o tutte), che verrà ricreata al prossimo uso.
+    """
+    if name is None:
+        _instances.clear()
+    else:
+        _instances.pop(name, None)
+
+
+def _create_genai_client():
+    from google import genai
+
+    return genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+
+
+def get_genai_client():
+    """
+    Restituisce il client google-genai condiviso da tutti i tool (un solo pool di connessioni).
+
+    Returns:
+        genai.Client: Il client, o None se non è stato possibile inizializzarlo.
+    """
+    try:
+        return get_or_create("genai_client", _create_genai_client)
+    except Exception as e:
+        print(f"Errore durante l'inizializzazione del client GenAI: {e}")
+        return None
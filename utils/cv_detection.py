@@ -0,0 +1,211 @@
+import json
+import os
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from utils.boxes import NORMALIZATION_DIVISOR, pairwise_intersection, box_areas
+
+# Rilevamento offline delle icone in diagrammi 2D puliti (sfondo uniforme, icone separate):
+# stima dello sfondo dai bordi, maschera di primo piano, dilatazione per unire le parti di
+# ogni icona, componenti connesse e filtri su dimensione e forma.
+
+# Differenza minima (0-255, sul canale più diverso) da considerare primo piano
+CV_FOREGROUND_THRESHOLD = int(os.getenv("CV_FOREGROUND_THRESHOLD", "40"))
+# Raggio (pixel) della dilatazione che unisce le parti staccate di una stessa icona
+CV_DILATE_RADIUS = int(os.getenv("CV_DILATE_RADIUS", "3"))
+# Lato minimo di un'icona, in frazione del lato maggiore dell'immagine
+CV_MIN_SIZE = float(os.getenv("CV_MIN_SIZE", "0.015"))
+# Area massima di un'icona, in frazione dell'area dell'immagine (oltre: contenitori, sfondi)
+CV_MAX_AREA = float(os.getenv("CV_MAX_AREA", "0.25"))
+# Oltre questo rapporto tra i lati la regione è una linea/freccia e viene scartata
+CV_MAX_ASPECT = float(os.getenv("CV_MAX_ASPECT", "8"))
+# Oltre questo rapporto (ma sotto CV_MAX_ASPECT) la regione può essere testo: ambigua
+CV_AMBIGUOUS_ASPECT = float(os.getenv("CV_AMBIGUOUS_ASPECT", "2.5"))
+# Sotto questa frazione di pixel pieni nella box la regione è probabilmente un riquadro vuoto: ambigua
+CV_MIN_FILL = float(os.getenv("CV_MIN_FILL", "0.12"))
+
+
+def estimate_background(pixels: np.ndarray) -> np.ndarray:
+    """
+    Stima il colore di sfondo come mediana dei pixel del bordo dell'immagine.
+
+    Args:
+        pixels: Array (H, W, 3) uint8.
+
+    Returns:
+        np.ndarray: Il colore (3,) dello sfondo.
+    """
+    border = np.concatenate([pixels[0], pixels[-1], pixels[:, 0], pixels[:, -1]])
+    return np.median(border, axis=0)
+
+
+def foreground_mask(im: Image.Image, threshold: int = CV_FOREGROUND_THRESHOLD) -> np.ndarray:
+    """
+    Restituisce la maschera (H, W) dei pixel che differiscono dallo sfondo stimato.
+    Nelle immagini con trasparenza i pixel (quasi) trasparenti sono sempre sfondo.
+    """
+    rgba = np.asarray(im.convert("RGBA"))
+    pixels = rgba[:, :, :3].astype(np.int16)
+    background = estimate_background(pixels)
+    mask = np.abs(pixels - background).max(axis=2) > threshold
+    return mask & (rgba[:, :, 3] > 32)
+
+
+def dilate(mask: np.ndarray, radius: int) -> np.ndarray:
+    """
+    Dilatazione binaria con un quadrato (2 * radius + 1), separabile in due passaggi per riga e colonna.
+    """
+    if radius <= 0:
+        return mask
+    result = mask.copy()
+    for k in range(1, radius + 1):
+        result[:, k:] |= mask[:, :-k]
+        result[:, :-k] |= mask[:, k:]
+    rows = result.copy()
+    for k in range(1, radius + 1):
+        result[k:, :] |= rows[:-k, :]
+        result[:-k, :] |= rows[k:, :]
+    return result
+
+
+def _find(parents: list[int], i: int) -> int:
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+
+def connected_components(mask: np.ndarray) -> np.ndarray:
+    """
+    Trova le componenti 8-connesse di una maschera binaria.
+
+    Lavora sulle run orizzontali di pixel accesi (estratte in modo vettoriale) invece che sui
+    singoli pixel: ogni run viene unita con union-find alle run della riga precedente che la
+    toccano, quindi il costo è proporzionale al numero di run e non all'area dell'immagine.
+
+    Returns:
+        np.ndarray: Array (N, 5) int con [left, upper, right, lower, pixel] per componente,
+                    dove right e lower sono esclusivi (formato PIL.Image.crop).
+    """
+    height, width = mask.shape
+    padded = np.zeros((height, width + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    start_rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)  # Esclusivi; stesso ordine (per riga, per colonna) degli inizi
+    count = len(starts)
+    if count == 0:
+        return np.zeros((0, 5), dtype=np.int64)
+
+    parents = list(range(count))
+    row_bounds = np.searchsorted(start_rows, np.arange(height + 1))
+    for row in range(1, height):
+        previous = range(row_bounds[row - 1], row_bounds[row])
+        if not len(previous):
+            continue
+        j = previous.start
+        for i in range(row_bounds[row], row_bounds[row + 1]):
+            # 8-connessione: le run si toccano se si sovrappongono anche solo in diagonale
+            while j < previous.stop and ends[j] < starts[i]:
+                j += 1
+            k = j
+            while k < previous.stop and starts[k] <= ends[i]:
+                root_i, root_k = _find(parents, i), _find(parents, k)
+                if root_i != root_k:
+                    parents[root_k] = root_i
+                k += 1
+
+    roots = np.fromiter((_find(parents, i) for i in range(count)), dtype=np.int64, count=count)
+    labels, inverse = np.unique(roots, return_inverse=True)
+    components = np.zeros((len(labels), 5), dtype=np.int64)
+    components[:, 0] = width
+    components[:, 1] = height
+    np.minimum.at(components[:, 0], inverse, starts)
+    np.minimum.at(components[:, 1], inverse, start_rows)
+    np.maximum.at(components[:, 2], inverse, ends)
+    np.maximum.at(components[:, 3], inverse, start_rows + 1)
+    np.add.at(components[:, 4], inverse, ends - starts)
+    return components
+
+
+def _tight_box(mask: np.ndarray, box: np.ndarray) -> list[int]:
+    left, upper, right, lower = (int(c) for c in box)
+    window = mask[upper:lower, left:right]
+    cols = np.flatnonzero(window.any(axis=0))
+    rows = np.flatnonzero(window.any(axis=1))
+    if not len(cols):
+        return [left, upper, right, lower]
+    return [left + int(cols[0]), upper + int(rows[0]), left + int(cols[-1]) + 1, upper + int(rows[-1]) + 1]
+
+
+def detect_regions(im: Image.Image, threshold: int = CV_FOREGROUND_THRESHOLD, dilate_radius: int = CV_DILATE_RADIUS,
+                   min_size: float = CV_MIN_SIZE, max_area: float = CV_MAX_AREA) -> list[dict]:
+    """
+    Rileva le regioni candidate ad essere icone.
+
+    Args:
+        im: L'immagine del diagramma.
+        threshold: Differenza minima dallo sfondo per i pixel di primo piano.
+        dilate_radius: Raggio della dilatazione che unisce le parti di una stessa icona.
+        min_size: Lato minimo, in frazione del lato maggiore dell'immagine.
+        max_area: Area massima, in frazione dell'area dell'immagine.
+
+    Returns:
+        list[dict]: Per ogni regione "box" ([left, upper, right, lower] in pixel), "fill"
+                    (frazione di pixel di primo piano nella box), "ambiguous" e "reason".
+    """
+    width, height = im.size
+    mask = foreground_mask(im, threshold)
+    components = connected_components(dilate(mask, dilate_radius))
+    if not len(components):
+        return []
+
+    # La dilatazione allarga le box: si riportano ai pixel effettivi della maschera
+    boxes = np.array([_tight_box(mask, box) for box in components[:, :4]], dtype=np.int64)
+    sides = boxes[:, 2:] - boxes[:, :2]
+    short_side, long_side = sides.min(axis=1), sides.max(axis=1)
+    aspect = long_side / np.maximum(short_side, 1)
+    areas = box_areas(boxes)
+
+    keep = (short_side >= min_size * max(width, height)) & (areas <= max_area * width * height) & (aspect <= CV_MAX_ASPECT)
+    regions = []
+    for i in np.flatnonzero(keep):
+        left, upper, right, lower = (int(c) for c in boxes[i])
+        fill = float(mask[upper:lower, left:right].mean())
+        reason = None
+        if aspect[i] > CV_AMBIGUOUS_ASPECT:
+            reason = "forma allungata (testo o connettore?)"
+        elif fill < CV_MIN_FILL:
+            reason = "riquadro quasi vuoto (contenitore?)"
+        regions.append({"box": [left, upper, right, lower], "fill": fill, "ambiguous": reason is not None, "reason": reason})
+
+    # Le regioni contenute in un'altra regione più grande sono parti di essa (es. riquadri interni)
+    if len(regions) > 1:
+        region_boxes = np.array([r["box"] for r in regions])
+        inside = pairwise_intersection(region_boxes, region_boxes) >= box_areas(region_boxes)[:, None] * 0.9
+        np.fill_diagonal(inside, False)
+        larger = box_areas(region_boxes)[None, :] > box_areas(region_boxes)[:, None]
+        contained = (inside & larger).any(axis=1)
+        regions = [r for r, c in zip(regions, contained) if not c]
+    return regions
+
+
+def regions_to_json(regions: list[dict], width: int, height: int, labels: Optional[list[str]] = None) -> str:
+    """
+    Converte le regioni nel formato JSON restituito dal modello:
+    [{"box_2d": [y1, x1, y2, x2], "label": ...}] in unità NORMALIZATION_DIVISOR.
+    """
+    result = []
+    for i, region in enumerate(regions):
+        left, upper, right, lower = region["box"]
+        label = labels[i] if labels is not None else region.get("label") or f"icon_{i + 1}"
+        result.append({
+            "box_2d": [
+                round(upper * NORMALIZATION_DIVISOR / height), round(left * NORMALIZATION_DIVISOR / width),
+                round(lower * NORMALIZATION_DIVISOR / height), round(right * NORMALIZATION_DIVISOR / width),
+            ],
+            "label": label,
+        })
+    return json.dumps(result)
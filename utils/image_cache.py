@@ -0,0 +1,135 @@
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image
+
+from utils.cache import hash_key
+from utils.metrics import timed, observe_size
+
+# Dimensione massima delle immagini inviate al modello (stessa usata dai tool)
+DEFAULT_MAX_SIZE = (1024, 1024)
+
+
+def _file_identity(path: str) -> tuple[str, int, int]:
+    """
+    Identifica un file tramite percorso assoluto, mtime e dimensione.
+    Solleva FileNotFoundError se il file non esiste.
+    """
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_mtime_ns, st.st_size
+
+
+class DecodedImageCache:
+    """
+    Cache in memoria, condivisa dal processo, delle immagini già decodificate e ridimensionate.
+
+    Le voci sono indicizzate per (percorso, mtime, dimensione, max_size), quindi un file
+    modificato su disco viene ridecodificato. L'occupazione è stimata come
+    larghezza x altezza x numero di bande e limitata da max_bytes con eviction LRU.
+    """
+
+    def __init__(self, max_bytes: int = 128 * 1024 * 1024, max_digests: int = 1024):
+        self.max_bytes = max_bytes
+        self.max_digests = max_digests
+        self.hits = 0
+        self.misses = 0
+        self._images: OrderedDict = OrderedDict()
+        self._digests: OrderedDict = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get_thumbnail(self, path: str, max_size: tuple[int, int] = DEFAULT_MAX_SIZE) -> Image.Image:
+        """
+        Restituisce una copia dell'immagine ridimensionata (LANCZOS) entro max_size.
+
+        La copia può essere modificata liberamente dal chiamante senza alterare la cache.
+
+        Args:
+            path: Il percorso del file immagine.
+            max_size: La dimensione massima (larghezza, altezza).
+
+        Returns:
+            Image.Image: L'immagine ridimensionata.
+        """
+        identity = _file_identity(path)
+        key = identity + (tuple(max_size),)
+        with self._lock:
+            cached = self._images.get(key)
+            if cached is not None:
+                self._images.move_to_end(key)
+                self.hits += 1
+                return cached.copy()
+            self.misses += 1
+
+        with timed("image_read"):
+            with open(path, "rb") as f:
+                img_bytes = f.read()
+        observe_size("image_bytes", len(img_bytes))
+        self._store_digest(identity, hash_key(img_bytes))
+
+        with timed("image_thumbnail"):
+            im = Image.open(BytesIO(img_bytes))
+            if im.format == "JPEG":
+                # Decodifica JPEG a risoluzione ridotta (scala DCT 1/2, 1/4, 1/8) invece di
+                # decodificare l'immagine intera e ridimensionarla dopo
+                im.draft(None, (max_size[0] * 2, max_size[1] * 2))
+            # reducing_gap usa Image.reduce() per la parte intera del ridimensionamento prima di LANCZOS
+            im.thumbnail(max_size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+            # Se l'immagine è già entro max_size thumbnail non la decodifica: la voce in cache
+            # deve essere caricata, altrimenti copy() concorrenti la decodificano in parallelo
+            im.load()
+
+        size_bytes = im.size[0] * im.size[1] * len(im.getbands())
+        with self._lock:
+            if key not in self._images and size_bytes <= self.max_bytes:
+                self._images[key] = im
+                self._total_bytes += size_bytes
+                while self._total_bytes > self.max_bytes:
+                    _, evicted = self._images.popitem(last=False)
+                    self._total_bytes -= evicted.size[0] * evicted.size[1] * len(evicted.getbands())
+        return im.copy()
+
+    def get_digest(self, path: str) -> str:
+        """
+        Restituisce l'hash del contenuto del file, calcolandolo solo se il file è cambiato.
+        """
+        identity = _file_identity(path)
+        with self._lock:
+            digest = self._digests.get(identity)
+            if digest is not None:
+                self._digests.move_to_end(identity)
+                return digest
+        with open(path, "rb") as f:
+            digest = hash_key(f.read())
+        self._store_digest(identity, digest)
+        return digest
+
+    def _store_digest(self, identity: tuple, digest: str) -> None:
+        with self._lock:
+            self._digests[identity] = digest
+            self._digests.move_to_end(identity)
+            while len(self._digests) > self.max_digests:
+                self._digests.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._images), "bytes": self._total_bytes}
+
+
+decoded_image_cache = DecodedImageCache(int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(128 * 1024 * 1024))))
+
+
+def load_thumbnail(path: str, max_size: tuple[int, int] = DEFAULT_MAX_SIZE) -> Image.Image:
+    """
+    Carica un'immagine ridimensionata entro max_size usando la cache condivisa del processo.
+    """
+    return decoded_image_cache.get_thumbnail(path, max_size)
+
+
+def file_digest(path: str) -> str:
+    """
+    Restituisce l'hash del contenuto di un file usando la cache condivisa del processo.
+    """
+    return decoded_image_cache.get_digest(path)
@@ -0,0 +1,75 @@
+import json
+
+# Parser incrementale di un array JSON ricevuto a pezzi (risposte in streaming del modello):
+# ogni elemento viene restituito appena la sua ultima parentesi arriva, senza attendere la fine
+# della risposta.
+
+
+class JsonArrayStream:
+    """
+    Estrae gli elementi di un array JSON man mano che il testo arriva.
+
+    Il testo prima della '[' iniziale (ad esempio un fence markdown) viene ignorato, così come il
+    testo dopo la ']' finale. Vengono restituiti solo gli elementi oggetto o array: gli scalari al
+    primo livello sono ignorati. Ogni carattere viene esaminato una sola volta.
+    """
+
+    def __init__(self):
+        self.done = False
+        self.items_count = 0
+        self._buffer = ""
+        self._pos = 0
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._item_start = None
+
+    def feed(self, text: str) -> list:
+        """
+        Aggiunge un pezzo di testo e restituisce gli elementi completati.
+
+        Raises:
+            json.JSONDecodeError: Se un elemento completo non è JSON valido.
+        """
+        items = []
+        if self.done or not text:
+            return items
+        self._buffer += text
+        buffer = self._buffer
+        pos = self._pos
+        while pos < len(buffer):
+            c = buffer[pos]
+            if not self._started:
+                self._started = c == "["
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = True
+            elif c in "{[":
+                if self._depth == 0:
+                    self._item_start = pos
+                self._depth += 1
+            elif c in "}]":
+                if self._depth == 0:
+                    self.done = True
+                    break
+                self._depth -= 1
+                if self._depth == 0:
+                    items.append(json.loads(buffer[self._item_start:pos + 1]))
+                    self._item_start = None
+            pos += 1
+
+        # Il testo già consumato che non appartiene a un elemento in corso non serve più
+        keep_from = self._item_start if self._item_start is not None else pos
+        self._buffer = buffer[keep_from:]
+        self._pos = pos - keep_from
+        if self._item_start is not None:
+            self._item_start = 0
+        self.items_count += len(items)
+        return items
@@ -0,0 +1,171 @@
+import os
+from typing import Optional
+from xml.etree import ElementTree as ET
+
+import numpy as np
+
+from utils.asset_optimizer import image_reference
+from utils.asset_store import sanitize_label
+from utils.boxes import BoundingBoxes, NORMALIZATION_DIVISOR, pairwise_iou
+from utils.utils import crop_filenames
+
+# IoU minima (nei riferimenti normalizzati) per associare un ritaglio ad una cella con etichetta diversa
+MIN_GEOMETRY_IOU = 0.1
+
+# Stile usato per le celle immagine del layout a cui non corrisponde nessun ritaglio
+UNBOUND_CELL_STYLE = "rounded=1;whiteSpace=wrap;html=1;"
+
+# Larghezza della pagina Draw.io usata se il layout non contiene celle immagine
+DEFAULT_PAGE_WIDTH = 850
+
+
+def _label_key(text: Optional[str]) -> str:
+    """
+    Forma canonica di un'etichetta per il confronto (sanificata, minuscola, senza estensione).
+    """
+    if not text:
+        return ""
+    return sanitize_label(os.path.splitext(os.path.basename(text))[0], "").lower()
+
+
+def _set_image(style: str, filename: str) -> str:
+    parts = [part for part in style.split(';') if part and not part.startswith('image=')]
+    parts.append(f"image={filename}")
+    return ";".join(parts) + ";"
+
+
+def _to_unit_frame(boxes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Porta un array (N, 4) [left, upper, right, lower] nel riquadro unitario della loro estensione complessiva.
+
+    Returns:
+        tuple: (box normalizzate, estensione [left, upper, right, lower])
+    """
+    extent = np.array([boxes[:, 0].min(), boxes[:, 1].min(), boxes[:, 2].max(), boxes[:, 3].max()])
+    size = np.maximum(extent[2:] - extent[:2], 1e-9)
+    origin = np.tile(extent[:2], 2)
+    return (boxes - origin) / np.tile(size, 2), extent
+
+
+def bind_crops_to_layout(xml_content: str, bounding_boxes: BoundingBoxes,
+                         min_iou: float = MIN_GEOMETRY_IOU) -> tuple[str, dict]:
+    """
+    Associa i ritagli rilevati alle celle immagine di un layout Draw.io generato senza conoscerli
+    (layout speculativo, prodotto in parallelo alla detection).
+
+    Ogni cella immagine viene confrontata con ogni box per etichetta (nome del file referenziato o
+    valore della cella) e per geometria: box e celle vengono portate nel riquadro unitario della
+    rispettiva estensione, così il confronto non dipende dalla scala del diagramma, e si calcola
+    la matrice delle IoU. Le coppie vengono assegnate in modo greedy, prima quelle con la stessa
+    etichetta e poi quelle con IoU almeno min_iou. Le celle rimaste senza ritaglio diventano
+    rettangoli con la sola etichetta; i ritagli rimasti senza cella vengono aggiunti al diagramma
+    nella posizione corrispondente dell'immagine.
+
+    Args:
+        xml_content: L'XML Draw.io del layout speculativo.
+        bounding_boxes: Le box rilevate (con la dimensione dell'immagine ritagliata).
+        min_iou: IoU minima per associare una box ad una cella con etichetta diversa.
+
+    Returns:
+        tuple: (XML con i riferimenti ai ritagli, report con i conteggi
+                bound_by_label, bound_by_geometry, added, unbound_cells)
+
+    Raises:
+        xml.etree.ElementTree.ParseError: Se il layout non è XML ben formato.
+    """
+    root = ET.fromstring(xml_content)
+    cell_parent = next(root.iter('root'), root)
+
+    cells, cell_boxes, cell_keys = [], [], []
+    for cell in root.iter('mxCell'):
+        style = cell.get('style', '')
+        filename = image_reference(style)
+        geom = cell.find('mxGeometry')
+        if not filename or geom is None:
+            continue
+        try:
+            x, y = float(geom.get('x', 0)), float(geom.get('y', 0))
+            width, height = float(geom.get('width', 0)), float(geom.get('height', 0))
+        except ValueError:
+            continue
+        cells.append(cell)
+        cell_boxes.append([x, y, x + width, y + height])
+        cell_keys.append(_label_key(filename) or _label_key(cell.get('value')))
+
+    filenames = crop_filenames(bounding_boxes)
+    box_indices = list(filenames)
+    # Coordinate [left, upper, right, lower] in frazioni dell'immagine
+    normalized = bounding_boxes.normalized[box_indices] / NORMALIZATION_DIVISOR if box_indices else np.zeros((0, 4))
+    detected = np.stack([
+        np.minimum(normalized[:, 1], normalized[:, 3]), np.minimum(normalized[:, 0], normalized[:, 2]),
+        np.maximum(normalized[:, 1], normalized[:, 3]), np.maximum(normalized[:, 0], normalized[:, 2]),
+    ], axis=1)
+    detected_keys = [_label_key(bounding_boxes.labels[i]) for i in box_indices]
+
+    report = {"bound_by_label": 0, "bound_by_geometry": 0, "added": 0, "unbound_cells": 0}
+    assigned_cells: dict[int, int] = {}
+    cell_extent = None
+    if cells and box_indices:
+        cell_array = np.array(cell_boxes, dtype=np.float64)
+        unit_cells, cell_extent = _to_unit_frame(cell_array)
+        unit_detected, detected_extent = _to_unit_frame(detected)
+        ious = pairwise_iou(unit_cells, unit_detected)
+        same_label = np.array([[bool(c) and c == d for d in detected_keys] for c in cell_keys])
+        # Le coppie con la stessa etichetta precedono sempre quelle associate solo per geometria
+        scores = np.where(same_label, 1.0 + ious, np.where(ious >= min_iou, ious, -1.0))
+        used_boxes = set()
+        for flat in np.argsort(-scores, axis=None):
+            cell_index, box_index = np.unravel_index(flat, scores.shape)
+            if scores[cell_index, box_index] < 0:
+                break
+            if cell_index in assigned_cells or box_index in used_boxes:
+                continue
+            assigned_cells[int(cell_index)] = int(box_index)
+            used_boxes.add(box_index)
+            report["bound_by_label" if same_label[cell_index, box_index] else "bound_by_geometry"] += 1
+
+    for cell_index, cell in enumerate(cells):
+        if cell_index in assigned_cells:
+            box_index = assigned_cells[cell_index]
+            cell.set('style', _set_image(cell.get('style', ''), filenames[box_indices[box_index]]))
+            if not cell.get('value'):
+                cell.set('value', bounding_boxes.labels[box_indices[box_index]] or "")
+        else:
+            cell.set('style', UNBOUND_CELL_STYLE)
+            report["unbound_cells"] += 1
+
+    # Ritagli senza cella: posizionati trasformando le coordinate dell'immagine in quelle del diagramma
+    if cell_extent is not None:
+        scale = (cell_extent[2:] - cell_extent[:2]) / np.maximum(detected_extent[2:] - detected_extent[:2], 1e-9)
+        offset = cell_extent[:2] - detected_extent[:2] * scale
+    else:
+        aspect = bounding_boxes.height / max(bounding_boxes.width, 1)
+        scale = np.array([DEFAULT_PAGE_WIDTH, DEFAULT_PAGE_WIDTH * aspect])
+        offset = np.zeros(2)
+    existing_ids = {cell.get('id') for cell in root.iter('mxCell')}
+    parent_id = "1" if "1" in existing_ids else "0"
+    assigned_boxes = set(assigned_cells.values())
+    for box_index, i in enumerate(box_indices):
+        if box_index in assigned_boxes:
+            continue
+        left, upper = detected[box_index, :2] * scale + offset
+        right, lower = detected[box_index, 2:] * scale + offset
+        cell_id = f"crop_{i}"
+        while cell_id in existing_ids:
+            cell_id += "_"
+        existing_ids.add(cell_id)
+        cell = ET.SubElement(cell_parent, 'mxCell', {
+            'id': cell_id,
+            'value': bounding_boxes.labels[i] or "",
+            'style': _set_image("shape=image;html=1;imageAspect=1;aspect=fixed", filenames[i]),
+            'vertex': "1",
+            'parent': parent_id,
+        })
+        ET.SubElement(cell, 'mxGeometry', {
+            'x': f"{left:.0f}", 'y': f"{upper:.0f}",
+            'width': f"{max(right - left, 1):.0f}", 'height': f"{max(lower - upper, 1):.0f}",
+            'as': "geometry",
+        })
+        report["added"] += 1
+
+    return ET.tostring(root, encoding="unicode"), report
@@ -0,0 +1,137 @@
+import json
+import os
+from typing import Optional
+
+from langchain_core.messages import AnyMessage, HumanMessage, SystemMessage, ToolMessage
+
+from utils.boxes import BoundingBoxes
+from utils.metrics import observe_size
+from utils.utils import crop_filenames
+
+# Budget di token del prompt inviato all'assistant (system prompt incluso)
+MESSAGE_TOKEN_BUDGET = int(os.getenv("MESSAGE_TOKEN_BUDGET", "4000"))
+# Numero di messaggi finali mai compattati se il budget lo consente
+COMPACTION_KEEP_LAST = int(os.getenv("COMPACTION_KEEP_LAST", "2"))
+# Lunghezza massima (in caratteri) dei messaggi troncati
+TRUNCATED_CHARS = 400
+
+# Stima approssimata usata da Gemini: ~4 caratteri per token
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def _content_text(content) -> str:
+    if isinstance(content, str):
+        return content
+    return json.dumps(content, ensure_ascii=False, default=str)
+
+
+def estimate_tokens(message) -> int:
+    """
+    Stima il numero di token di un messaggio (o di una stringa) senza chiamare il modello.
+    """
+    content = message if isinstance(message, str) else message.content
+    tokens = len(_content_text(content)) // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        tokens += len(json.dumps(tool_call.get("args", {}), default=str)) // CHARS_PER_TOKEN
+    return tokens
+
+
+def summarize_tool_output(content: str) -> Optional[str]:
+    """
+    Riduce l'output di un tool ai soli campi strutturati usati dai passi successivi.
+
+    L'output del tool di detection (array JSON di bounding box) diventa l'elenco dei nomi file
+    dei ritagli, cioè gli object_names da passare al tool Draw.io.
+
+    Returns:
+        str: Il riassunto, o None se il contenuto non è riconosciuto.
+    """
+    try:
+        bounding_boxes = BoundingBoxes.from_json(content)
+    except (TypeError, ValueError, AttributeError):
+        return None
+    if not len(bounding_boxes) or not bounding_boxes.valid.any():
+        return None
+    object_names = list(crop_filenames(bounding_boxes).values())
+    return json.dumps({
+        "detected_objects": len(object_names),
+        "object_names": object_names,
+        "note": "bounding box coordinates omitted to save tokens",
+    })
+
+
+def _truncate(text: str, max_chars: int = TRUNCATED_CHARS) -> str:
+    if len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}... [truncated {len(text) - max_chars} chars]"
+
+
+def _compact_tool_message(message: ToolMessage) -> ToolMessage:
+    text = _content_text(message.content)
+    summary = None
+    if text.lstrip().startswith(("[", "{", "```")):
+        summary = summarize_tool_output(text)
+    return message.model_copy(update={"content": summary or _truncate(text)})
+
+
+def compact_messages(messages: list[AnyMessage], budget: int = MESSAGE_TOKEN_BUDGET,
+                     keep_last: int = COMPACTION_KEEP_LAST, reserved_tokens: int = 0) -> list[AnyMessage]:
+    """
+    Compatta la cronologia da inviare al modello entro un budget di token.
+
+    I messaggi non vengono mai rimossi (ogni chiamata a tool deve restare seguita dalla sua
+    risposta), ma riscritti in copie, lasciando intatto lo stato del grafo:
+    1. gli output dei tool più vecchi degli ultimi keep_last messaggi vengono riassunti
+       (vedi summarize_tool_output) o troncati;
+    2. se il budget è ancora superato, lo stesso vale anche per gli output dei tool recenti;
+    3. infine vengono troncati i messaggi di testo dal più vecchio, escluso l'ultimo. I messaggi
+       utente e di sistema restano intatti: contengono la richiesta e il percorso dell'immagine
+       (" Path: files/<nome file>") usato dai tool.
+
+    Args:
+        messages: La cronologia dei messaggi.
+        budget: Il numero massimo di token stimati del prompt.
+        keep_last: Quanti messaggi finali proteggere nel primo passaggio.
+        reserved_tokens: Token già occupati da altre parti del prompt (es. il system prompt).
+
+    Returns:
+        list: La cronologia compattata.
+    """
+    compacted = list(messages)
+    sizes = [estimate_tokens(m) for m in compacted]
+    original_tokens = sum(sizes) + reserved_tokens
+
+    def total() -> int:
+        return sum(sizes) + reserved_tokens
+
+    def rewrite(index: int, message: AnyMessage) -> None:
+        compacted[index] = message
+        sizes[index] = estimate_tokens(message)
+
+    protected_from = max(len(compacted) - keep_last, 0)
+    for index in range(protected_from):
+        if isinstance(compacted[index], ToolMessage):
+            rewrite(index, _compact_tool_message(compacted[index]))
+
+    if total() > budget:
+        for index in range(protected_from, len(compacted)):
+            if isinstance(compacted[index], ToolMessage):
+                rewrite(index, _compact_tool_message(compacted[index]))
+
+    for index in range(len(compacted) - 1):
+        if total() <= budget:
+            break
+        message = compacted[index]
+        if isinstance(message, (HumanMessage, SystemMessage)):
+            continue
+        text = _content_text(message.content)
+        if len(text) > TRUNCATED_CHARS:
+            rewrite(index, message.model_copy(update={"content": _truncate(text)}))
+
+    saved_tokens = original_tokens - total()
+    if saved_tokens > 0:
+        observe_size("prompt_tokens_saved", saved_tokens)
+        print(f"Message compaction: {original_tokens} -> {total()} estimated tokens ({saved_tokens} saved, budget {budget})")
+    observe_size("prompt_tokens", total())
+    return compacted
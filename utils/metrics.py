@@ -0,0 +1,240 @@
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+# Bucket (in secondi) degli istogrammi di latenza e (in byte/caratteri) delle dimensioni dei payload
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIZE_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+
+class Histogram:
+    """
+    Istogramma cumulativo in stile Prometheus (bucket, somma e conteggio).
+    """
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "buckets": {str(bound): count for bound, count in zip(self.buckets, self.counts)},
+        }
+
+
+class MetricsRegistry:
+    """
+    Registro thread-safe delle metriche della pipeline: un istogramma di latenza per stadio
+    e un istogramma di dimensione per ogni tipo di payload. Indipendente da Langfuse.
+    """
+
+    def __init__(self):
+        self._latencies: dict[str, Histogram] = {}
+        self._sizes: dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def observe_latency(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self._latencies.get(stage)
+            if histogram is None:
+                histogram = self._latencies[stage] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+
+    def observe_size(self, payload: str, size: int) -> None:
+        with self._lock:
+            histogram = self._sizes.get(payload)
+            if histogram is None:
+                histogram = self._sizes[payload] = Histogram(SIZE_BUCKETS)
+            histogram.observe(size)
+
+    @contextmanager
+    def timed(self, stage: str):
+        """
+        Misura la durata del blocco e la registra nell'istogramma dello stadio (anche in caso di eccezione).
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_latency(stage, time.perf_counter() - start)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "stage_latency_seconds": {stage: h.to_dict() for stage, h in self._latencies.items()},
+                "payload_size": {payload: h.to_dict() for payload, h in self._sizes.items()},
+            }
+
+    def render_prometheus(self) -> str:
+        """
+        Restituisce le metriche nel formato testuale di esposizione di Prometheus.
+        """
+        lines = []
+        with self._lock:
+            for name, label, histograms in (
+                ("drawio_stage_latency_seconds", "stage", self._latencies),
+                ("drawio_payload_size", "payload", self._sizes),
+            ):
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(histograms.items()):
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f'{name}_bucket{{{label}="{key}",le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{{label}="{key}",le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{{{label}="{key}"}} {histogram.sum}')
+                    lines.append(f'{name}_count{{{label}="{key}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """
+        Scrive le metriche su file: formato JSON se il percorso termina con .json, altrimenti Prometheus.
+        """
+        content = json.dumps(self.to_dict(), indent=2) if path.endswith(".json") else self.render_prometheus()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+
+registry = MetricsRegistry()
+
+
+def timed(stage: str):
+    """
+    Context manager che registra la durata di uno stadio nel registro globale.
+    """
+    return registry.timed(stage)
+
+
+def instrumented(stage: str):
+    """
+    Decoratore che registra la durata di ogni chiamata della funzione come stadio 'stage'.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with registry.timed(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe_latency(stage: str, seconds: float) -> None:
+    """
+    Registra una durata misurata dal chiamante (es. il tempo al primo ritaglio in streaming).
+    """
+    registry.observe_latency(stage, seconds)
+
+
+def observe_size(payload: str, size: int) -> None:
+    """
+    Registra la dimensione di un payload (byte dell'immagine, lunghezza di JSON/XML, byte base64...).
+    """
+    registry.observe_size(payload, size)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/metrics.json"):
+            body = json.dumps(registry.to_dict()).encode("utf-8")
+            content_type = "application/json"
+        elif self.path.startswith("/metrics"):
+            body = registry.render_prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4"
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Niente log per ogni scrape
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_file_writer: Optional[threading.Thread] = None
+_exporters_lock = threading.Lock()
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Avvia in un thread daemon un endpoint HTTP locale con /metrics (Prometheus) e /metrics.json.
+    """
+    global _server
+    with _exporters_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+            print(f"Metrics endpoint: http://{host}:{port}/metrics")
+        return _server
+
+
+def start_metrics_file_writer(path: str, interval_seconds: float = 15.0) -> None:
+    """
+    Scrive periodicamente le metriche su file (e un'ultima volta all'uscita del processo).
+    """
+    global _file_writer
+    with _exporters_lock:
+        if _file_writer is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    registry.write(path)
+                except OSError as e:
+                    print(f"Errore nello scrivere le metriche in {path}: {e}")
+
+        _file_writer = threading.Thread(target=loop, name="metrics-file-writer", daemon=True)
+        _file_writer.start()
+        atexit.register(registry.write, path)
+
+
+def start_exporters_from_env() -> None:
+    """
+    Avvia gli exporter configurati: METRICS_PORT (endpoint HTTP) e METRICS_FILE (file JSON o Prometheus).
+    """
+    # Viene chiamata all'import: una configurazione errata disattiva l'exporter ma non il modulo
+    port = os.getenv("METRICS_PORT")
+    if port:
+        try:
+            start_metrics_server(int(port), os.getenv("METRICS_HOST", "127.0.0.1"))
+        except (OSError, ValueError, OverflowError) as e:
+            print(f"Impossibile avviare l'endpoint delle metriche sulla porta {port}: {e}")
+    path = os.getenv("METRICS_FILE")
+    if path:
+        try:
+            interval_seconds = float(os.getenv("METRICS_FLUSH_INTERVAL", "15"))
+        except ValueError as e:
+            print(f"METRICS_FLUSH_INTERVAL non valido, uso 15 secondi: {e}")
+            interval_seconds = 15.0
+        start_metrics_file_writer(path, interval_seconds)
+
+
+start_exporters_from_env()
@@ -0,0 +1,95 @@
+import atexit
+import io
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Union
+
+from PIL import Image
+
+from utils.asset_store import get_asset_store
+from utils.boxes import BoundingBoxes
+from utils.metrics import timed
+from utils.utils import render_bounding_boxes
+
+# Overlay delle bounding box come artefatto opzionale, disegnato su una copia dell'immagine in un
+# worker in background (fuori dal percorso critico della richiesta). DETECTION_OVERLAY:
+#   "off"    (default) nessun overlay;
+#   "file"   salva <output_folder>/OVERLAY_FILENAME;
+#   "memory" registra i byte codificati nell'asset store del workspace (get_asset_store(output_folder))
+#            con il nome OVERLAY_FILENAME, senza scrivere su disco;
+#   "show"   apre il visualizzatore di sistema, solo per l'uso locale (mai in produzione).
+DETECTION_OVERLAY = os.getenv("DETECTION_OVERLAY", "off")
+OVERLAY_FORMAT = os.getenv("OVERLAY_FORMAT", "PNG").upper()  # PNG o JPEG
+OVERLAY_FILENAME = "detection_overlay.png" if OVERLAY_FORMAT == "PNG" else "detection_overlay.jpg"
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Un solo thread: gli overlay sono a bassa priorità e non devono competere con le richieste
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="overlay")
+            atexit.register(_executor.shutdown, wait=True)
+        return _executor
+
+
+def encode_overlay(img: Image.Image, image_format: str = OVERLAY_FORMAT) -> bytes:
+    buffer = io.BytesIO()
+    if image_format == "JPEG":
+        img.convert("RGB").save(buffer, format="JPEG", quality=85)
+    else:
+        img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def render_overlay(im: Image.Image, bounding_boxes: Union[str, BoundingBoxes], mode: str = DETECTION_OVERLAY,
+                   output_folder: str = "output_llm") -> Optional[Union[str, bytes]]:
+    """
+    Disegna l'overlay e lo consegna secondo mode.
+
+    Returns:
+        Il percorso del file ("file"), i byte codificati, registrati anche nell'asset store ("memory"), o None.
+    """
+    with timed("overlay_render"):
+        img = render_bounding_boxes(im, bounding_boxes)
+    if mode == "show":
+        img.show()
+        return None
+    data = encode_overlay(img)
+    if mode == "memory":
+        get_asset_store(output_folder).put(OVERLAY_FILENAME, data, f"image/{OVERLAY_FORMAT.lower()}")
+        return data
+    os.makedirs(output_folder, exist_ok=True)
+    path = os.path.join(output_folder, OVERLAY_FILENAME)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def _render_logging_errors(*args) -> Optional[Union[str, bytes]]:
+    try:
+        return render_overlay(*args)
+    except Exception as e:
+        print(f"Errore durante il rendering dell'overlay: {e}")
+        return None
+
+
+def schedule_overlay(im: Image.Image, bounding_boxes: Union[str, BoundingBoxes], output_folder: str = "output_llm",
+                     mode: str = DETECTION_OVERLAY) -> Optional[Future]:
+    """
+    Accoda il rendering dell'overlay nel worker in background, se richiesto da mode.
+
+    L'immagine viene copiata subito, quindi il chiamante può continuare ad usarla e modificarla.
+
+    Returns:
+        Future: Il rendering in corso (risultato come render_overlay), o None se mode è "off".
+    """
+    if mode == "off":
+        return None
+    if isinstance(bounding_boxes, BoundingBoxes):
+        bounding_boxes = bounding_boxes.subset(slice(None))
+    return _get_executor().submit(_render_logging_errors, im.copy(), bounding_boxes, mode, output_folder)
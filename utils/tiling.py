@@ -0,0 +1,185 @@
+import os
+
+import numpy as np
+
+from utils.boxes import NORMALIZATION_DIVISOR, BoundingBoxes, box_areas, pairwise_intersection, pairwise_iou
+
+# Detection a tasselli per diagrammi grandi: l'immagine viene divisa in tasselli sovrapposti,
+# ognuno rilevato separatamente, e le box vengono riportate in coordinate globali. Gli oggetti
+# sulle giunture compaiono in più tasselli (interi o tagliati) e vengono fusi in una sola box.
+
+# Lato dei tasselli in pixel (alla risoluzione di lavoro): non viene ridimensionato dal modello
+TILE_SIZE = int(os.getenv("TILE_SIZE", "1024"))
+# Sovrapposizione tra tasselli adiacenti, in frazione del lato: gli oggetti più piccoli compaiono
+# interi in almeno un tassello
+TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", "0.2"))
+# Box di tasselli diversi con IoU (o frazione della box minore coperta dall'altra) oltre queste
+# soglie sono lo stesso oggetto
+TILE_MERGE_IOU = float(os.getenv("TILE_MERGE_IOU", "0.5"))
+TILE_MERGE_CONTAINMENT = float(os.getenv("TILE_MERGE_CONTAINMENT", "0.7"))
+# Il contenimento da solo non basta: una box contenuta in un'altra (un'icona dentro una VPC) è un
+# oggetto diverso, a meno che sia tagliata dalla giuntura o abbia etichetta compatibile e area simile
+TILE_MERGE_AREA_RATIO = float(os.getenv("TILE_MERGE_AREA_RATIO", "0.5"))
+# Tolleranza, in frazione del lato del tassello, per considerare una box tagliata dal bordo del tassello
+TILE_EDGE_TOLERANCE = 0.01
+
+
+def _axis_starts(length: int, tile_size: int, overlap: float) -> list[int]:
+    if length <= tile_size:
+        return [0]
+    stride = max(int(tile_size * (1 - overlap)), 1)
+    count = -(-(length - tile_size) // stride) + 1
+    # Tasselli distribuiti uniformemente: l'ultimo termina esattamente sul bordo dell'immagine
+    return [round(i * (length - tile_size) / (count - 1)) for i in range(count)]
+
+
+def tile_grid(width: int, height: int, tile_size: int = TILE_SIZE, overlap: float = TILE_OVERLAP) -> list[tuple[int, int, int, int]]:
+    """
+    Divide un'immagine width x height in tasselli sovrapposti di lato al più tile_size.
+
+    Returns:
+        list[tuple]: Le box [left, upper, right, lower] dei tasselli, per righe.
+    """
+    return [
+        (left, upper, min(left + tile_size, width), min(upper + tile_size, height))
+        for upper in _axis_starts(height, tile_size, overlap)
+        for left in _axis_starts(width, tile_size, overlap)
+    ]
+
+
+def tile_boxes_to_global(result_text: str, tile: tuple[int, int, int, int]) -> tuple[np.ndarray, list]:
+    """
+    Riporta le box rilevate in un tassello alle coordinate in pixel dell'immagine intera.
+
+    Returns:
+        tuple: (array (N, 4) [left, upper, right, lower] in pixel, etichette)
+
+    Raises:
+        json.JSONDecodeError: Se la risposta non contiene JSON valido.
+    """
+    left, upper, right, lower = tile
+    boxes = BoundingBoxes.from_json(result_text, right - left, lower - upper)
+    valid = np.flatnonzero(boxes.valid)
+    return boxes.absolute[valid] + np.array([left, upper, left, upper]), [boxes.labels[i] for i in valid]
+
+
+def _find(parents: list[int], i: int) -> int:
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+
+def _cut_at_seam(boxes: np.ndarray, tiles: np.ndarray, width: int, height: int) -> np.ndarray:
+    """
+    Maschera (N, 4) delle box che toccano un lato [left, upper, right, lower] del proprio tassello
+    interno all'immagine (quindi probabilmente tagliate dalla giuntura).
+    """
+    tolerance = np.maximum(tiles[:, 2:] - tiles[:, :2], 1).max(axis=1, keepdims=True) * TILE_EDGE_TOLERANCE
+    near = np.abs(boxes - tiles) <= tolerance
+    inner = np.stack([tiles[:, 0] > 0, tiles[:, 1] > 0, tiles[:, 2] < width, tiles[:, 3] < height], axis=1)
+    return near & inner
+
+
+def _axis_overlap(a_start, a_end, b_start, b_end) -> np.ndarray:
+    overlap = np.clip(np.minimum(a_end[:, None], b_end[None, :]) - np.maximum(a_start[:, None], b_start[None, :]), 0, None)
+    shorter = np.minimum((a_end - a_start)[:, None], (b_end - b_start)[None, :])
+    return np.divide(overlap, shorter, out=np.zeros_like(overlap, dtype=np.float64), where=shorter > 0)
+
+
+def _compatible_labels(labels: list) -> np.ndarray:
+    """
+    Matrice (N, N) delle coppie con la stessa etichetta (senza distinzione di maiuscole) o senza etichetta.
+    """
+    normalized = [str(label).strip().lower() if label is not None else None for label in labels]
+    return np.array([[a is None or b is None or a == b for b in normalized] for a in normalized], dtype=bool)
+
+
+def merge_tile_detections(boxes: np.ndarray, labels: list, tile_indices: np.ndarray, tiles: list,
+                          width: int, height: int, merge_iou: float = TILE_MERGE_IOU,
+                          merge_containment: float = TILE_MERGE_CONTAINMENT,
+                          merge_area_ratio: float = TILE_MERGE_AREA_RATIO) -> tuple[np.ndarray, list]:
+    """
+    Fonde le box dello stesso oggetto rilevato in tasselli diversi.
+
+    Due box di tasselli diversi vengono fuse se:
+    - hanno IoU oltre merge_iou;
+    - la minore è coperta dall'altra oltre merge_containment ed è tagliata dalla giuntura del suo
+      tassello, oppure ha etichetta compatibile e area almeno merge_area_ratio dell'altra (le box
+      annidate, come un'icona dentro un gruppo, restano separate);
+    - sono entrambe tagliate dalla stessa giuntura, una a destra e l'altra a sinistra (o sopra e
+      sotto), e si sovrappongono sull'asse della giuntura.
+    Le coppie vengono unite dalla più sovrapposta e un gruppo non può mai contenere due box dello
+    stesso tassello: una box contenitore non fa da ponte tra oggetti distinti. La box risultante è
+    l'unione del gruppo, con l'etichetta della box più grande.
+
+    Returns:
+        tuple: (array (M, 4) delle box fuse in pixel, etichette)
+    """
+    count = len(boxes)
+    if count < 2:
+        return boxes, list(labels)
+    boxes = np.asarray(boxes, dtype=np.int64)
+    tile_boxes = np.asarray(tiles, dtype=np.int64)[tile_indices]
+    areas = box_areas(boxes)
+
+    intersection = pairwise_intersection(boxes, boxes)
+    smaller = np.minimum(areas[:, None], areas[None, :])
+    larger = np.maximum(areas[:, None], areas[None, :])
+    containment = np.divide(intersection, smaller, out=np.zeros_like(intersection), where=smaller > 0)
+    area_ratio = np.divide(smaller, larger, out=np.zeros_like(smaller, dtype=np.float64), where=larger > 0)
+    iou = pairwise_iou(boxes, boxes)
+
+    cut = _cut_at_seam(boxes, tile_boxes, width, height)
+    # La box minore della coppia è un frammento tagliato dalla giuntura
+    smaller_is_i = areas[:, None] <= areas[None, :]
+    any_cut = cut.any(axis=1)
+    smaller_cut = np.where(smaller_is_i, any_cut[:, None], any_cut[None, :])
+    similar = _compatible_labels(labels) & (area_ratio >= merge_area_ratio)
+    same_object = (iou >= merge_iou) | ((containment >= merge_containment) & (smaller_cut | similar))
+
+    touching = intersection > 0
+    # Oggetti più grandi della sovrapposizione: a tagliato a destra e b a sinistra (o a in basso e b in alto)
+    horizontal = cut[:, None, 2] & cut[None, :, 0] & (_axis_overlap(boxes[:, 1], boxes[:, 3], boxes[:, 1], boxes[:, 3]) >= 0.5)
+    vertical = cut[:, None, 3] & cut[None, :, 1] & (_axis_overlap(boxes[:, 0], boxes[:, 2], boxes[:, 0], boxes[:, 2]) >= 0.5)
+    seam = touching & (horizontal | horizontal.T | vertical | vertical.T)
+
+    merge = (same_object | seam) & (tile_indices[:, None] != tile_indices[None, :])
+    parents = list(range(count))
+    group_tiles = [{int(tile_indices[i])} for i in range(count)]
+    pairs = np.transpose(np.nonzero(np.triu(merge, k=1)))
+    strength = np.maximum(iou, containment)[pairs[:, 0], pairs[:, 1]]
+    for i, j in pairs[np.argsort(-strength, kind="stable")]:
+        root_i, root_j = _find(parents, i), _find(parents, j)
+        if root_i == root_j or group_tiles[root_i] & group_tiles[root_j]:
+            continue
+        parents[root_j] = root_i
+        group_tiles[root_i] |= group_tiles[root_j]
+
+    groups: dict[int, list[int]] = {}
+    for i in range(count):
+        groups.setdefault(_find(parents, i), []).append(i)
+    merged_boxes, merged_labels = [], []
+    for members in groups.values():
+        members = np.array(members)
+        group = boxes[members]
+        merged_boxes.append([group[:, 0].min(), group[:, 1].min(), group[:, 2].max(), group[:, 3].max()])
+        merged_labels.append(labels[members[np.argmax(areas[members])]])
+    return np.array(merged_boxes, dtype=np.int64), merged_labels
+
+
+def boxes_to_json_list(boxes: np.ndarray, labels: list, width: int, height: int) -> list[dict]:
+    """
+    Converte box in pixel [left, upper, right, lower] nel formato del modello
+    ({"box_2d": [y1, x1, y2, x2], "label": ...}) in unità NORMALIZATION_DIVISOR.
+    """
+    result = []
+    for (left, upper, right, lower), label in zip(boxes.tolist(), labels):
+        item = {"box_2d": [
+            round(upper * NORMALIZATION_DIVISOR / height), round(left * NORMALIZATION_DIVISOR / width),
+            round(lower * NORMALIZATION_DIVISOR / height), round(right * NORMALIZATION_DIVISOR / width),
+        ]}
+        if label is not None:
+            item["label"] = label
+        result.append(item)
+    return result
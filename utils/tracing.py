@@ -0,0 +1,415 @@
+import atexit
+import base64
+import json
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Optional
+from urllib import error as urlerror
+from urllib import request as urlrequest
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Tracing verso Langfuse fuori dal percorso della richiesta: i callback accodano solo eventi grezzi
+# in una coda limitata, un thread di background li serializza e li invia a blocchi all'API di
+# ingestion. Se la coda è piena gli eventi vengono scartati; se il collector non risponde i blocchi
+# vengono salvati in uno spool locale e reinviati al primo invio riuscito.
+
+LANGFUSE_HOST = os.getenv("LANGFUSE_HOST", "http://localhost:3000")
+# Frazione delle richieste tracciate (0 = nessuna, 1 = tutte)
+TRACING_SAMPLE_RATE = float(os.getenv("TRACING_SAMPLE_RATE", "1.0"))
+TRACING_QUEUE_SIZE = int(os.getenv("TRACING_QUEUE_SIZE", "1000"))
+TRACING_BATCH_SIZE = int(os.getenv("TRACING_BATCH_SIZE", "50"))
+TRACING_FLUSH_INTERVAL = float(os.getenv("TRACING_FLUSH_INTERVAL", "2.0"))
+TRACING_TIMEOUT = float(os.getenv("TRACING_TIMEOUT", "2.0"))
+TRACING_SPOOL_PATH = os.getenv("TRACING_SPOOL_PATH", os.path.join(".cache", "traces.spool.jsonl"))
+TRACING_SPOOL_MAX_BYTES = int(os.getenv("TRACING_SPOOL_MAX_BYTES", str(64 * 1024 * 1024)))
+# Lunghezza massima di input e output serializzati di ogni osservazione
+TRACING_MAX_FIELD_CHARS = int(os.getenv("TRACING_MAX_FIELD_CHARS", "4000"))
+
+
+def _iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat()
+
+
+def _json_default(obj: Any) -> Any:
+    if hasattr(obj, "type") and hasattr(obj, "content"):  # Messaggi LangChain
+        return {"role": obj.type, "content": obj.content}
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    return str(obj)
+
+
+def _serialize(value: Any) -> Any:
+    """
+    Rende un input/output serializzabile in JSON. Oltre TRACING_MAX_FIELD_CHARS il valore diventa
+    sempre un oggetto {"truncated": caratteri omessi, "preview": inizio del JSON}, così il tipo di
+    un campo non dipende dalla sua dimensione e il contenuto non arriva come stringa doppiamente codificata.
+    """
+    try:
+        text = json.dumps(value, default=_json_default, ensure_ascii=False)
+    except (TypeError, ValueError):
+        text = json.dumps(str(value), ensure_ascii=False)
+    if len(text) > TRACING_MAX_FIELD_CHARS:
+        return {"truncated": len(text) - TRACING_MAX_FIELD_CHARS, "preview": text[:TRACING_MAX_FIELD_CHARS]}
+    return json.loads(text)
+
+
+class TraceExporter:
+    """
+    Esporta le osservazioni verso l'API di ingestion di Langfuse da un thread di background.
+
+    Args:
+        host: L'indirizzo di Langfuse.
+        public_key, secret_key: Le credenziali del progetto.
+        queue_size: Capacità della coda; gli eventi oltre la capacità vengono scartati.
+        batch_size: Numero massimo di eventi per richiesta.
+        flush_interval: Attesa massima (secondi) prima di inviare un blocco incompleto.
+        timeout: Timeout (secondi) della richiesta HTTP.
+        spool_path: File JSON Lines dove salvare gli eventi non inviati.
+        spool_max_bytes: Dimensione massima dello spool; oltre, gli eventi vengono scartati.
+    """
+
+    def __init__(self, host: str = LANGFUSE_HOST, public_key: Optional[str] = None, secret_key: Optional[str] = None,
+                 queue_size: int = TRACING_QUEUE_SIZE, batch_size: int = TRACING_BATCH_SIZE,
+                 flush_interval: float = TRACING_FLUSH_INTERVAL, timeout: float = TRACING_TIMEOUT,
+                 spool_path: Optional[str] = TRACING_SPOOL_PATH, spool_max_bytes: int = TRACING_SPOOL_MAX_BYTES):
+        self.endpoint = host.rstrip("/") + "/api/public/ingestion"
+        credentials = f"{public_key or ''}:{secret_key or ''}".encode("utf-8")
+        self._auth = "Basic " + base64.b64encode(credentials).decode("ascii")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.spool_path = spool_path
+        self.spool_max_bytes = spool_max_bytes
+        self.enqueued = 0
+        self.dropped = 0
+        self.sent = 0
+        self.spooled = 0
+        self.rejected = 0
+        # I contatori sono aggiornati sia dai thread dei chiamanti sia dal thread di export
+        self._counters_lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._spool_lock = threading.Lock()
+        self._pending = 0
+        self._idle = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, record: dict) -> bool:
+        """
+        Accoda un evento grezzo senza bloccare; restituisce False se la coda è piena e l'evento è scartato.
+        """
+        with self._idle:
+            self._pending += 1
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._idle:
+                self._pending -= 1
+                self._idle.notify_all()
+            self._count("dropped")
+            return False
+        self._count("enqueued")
+        return True
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """
+        Attende (al massimo timeout secondi) che gli eventi accodati siano inviati o salvati nello spool.
+        """
+        deadline = time.monotonic() + timeout
+        with self._idle:
+            while self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def stats(self) -> dict:
+        with self._counters_lock:
+            return {"enqueued": self.enqueued, "dropped": self.dropped, "sent": self.sent,
+                    "spooled": self.spooled, "rejected": self.rejected, "queued": self._queue.qsize()}
+
+    def _count(self, counter: str, amount: int = 1) -> None:
+        with self._counters_lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                events = [event for record in batch for event in _to_ingestion_events(record)]
+                self._export(events)
+            except Exception as e:  # Il thread di export non deve mai terminare
+                print(f"Tracing: errore nell'esportare {len(batch)} eventi: {e}")
+            finally:
+                with self._idle:
+                    self._pending -= len(batch)
+                    self._idle.notify_all()
+
+    def _export(self, events: list[dict]) -> None:
+        if not events:
+            return
+        if self._send(events):
+            self._replay_spool()
+        else:
+            self._spool(events)
+
+    def _send(self, events: list[dict]) -> bool:
+        """
+        Invia un blocco di eventi. Restituisce False se il collector non è raggiungibile
+        (errore di rete, 429 o 5xx); i blocchi rifiutati con altri errori 4xx vengono scartati.
+        """
+        body = json.dumps({"batch": events}, default=str).encode("utf-8")
+        req = urlrequest.Request(self.endpoint, data=body, method="POST", headers={
+            "Content-Type": "application/json",
+            "Authorization": self._auth,
+        })
+        try:
+            with urlrequest.urlopen(req, timeout=self.timeout) as response:
+                response.read()
+        except urlerror.HTTPError as e:
+            if e.code == 429 or e.code >= 500:
+                return False
+            self._count("rejected", len(events))
+            print(f"Tracing: blocco di {len(events)} eventi rifiutato dal collector ({e.code}).")
+            return True
+        except (urlerror.URLError, OSError):
+            return False
+        self._count("sent", len(events))
+        return True
+
+    def _spool(self, events: list[dict]) -> None:
+        if not self.spool_path:
+            self._count("dropped", len(events))
+            return
+        lines = "".join(json.dumps(event, default=str) + "\n" for event in events)
+        with self._spool_lock:
+            try:
+                size = os.path.getsize(self.spool_path) if os.path.exists(self.spool_path) else 0
+                if size + len(lines) > self.spool_max_bytes:
+                    self._count("dropped", len(events))
+                    return
+                os.makedirs(os.path.dirname(self.spool_path) or ".", exist_ok=True)
+                with open(self.spool_path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+                self._count("spooled", len(events))
+            except OSError as e:
+                self._count("dropped", len(events))
+                print(f"Tracing: impossibile scrivere lo spool {self.spool_path}: {e}")
+
+    def _replay_spool(self) -> None:
+        """
+        Reinvia gli eventi salvati nello spool, a blocchi, finché il collector risponde.
+        """
+        if not self.spool_path or not os.path.exists(self.spool_path):
+            return
+        with self._spool_lock:
+            replay_path = self.spool_path + ".replay"
+            try:
+                os.replace(self.spool_path, replay_path)
+            except OSError:
+                return
+        with open(replay_path, encoding="utf-8") as f:
+            events = [json.loads(line) for line in f if line.strip()]
+        os.remove(replay_path)
+        for start in range(0, len(events), self.batch_size):
+            chunk = events[start:start + self.batch_size]
+            if not self._send(chunk):
+                self._spool(events[start:])
+                return
+
+
+def _to_ingestion_events(record: dict) -> list[dict]:
+    """
+    Converte un evento grezzo del callback negli eventi dell'API di ingestion di Langfuse.
+    """
+    now = _iso(time.time())
+    events = []
+    if record["parent_run_id"] is None:
+        events.append({"id": str(uuid.uuid4()), "timestamp": now, "type": "trace-create", "body": {
+            "id": record["trace_id"],
+            "name": record["name"],
+            "timestamp": _iso(record["start_time"]),
+            "input": _serialize(record["inputs"]),
+            "output": _serialize(record["outputs"]),
+            "tags": record["tags"] or None,
+            "metadata": record["metadata"] or None,
+        }})
+    body = {
+        "id": record["run_id"],
+        "traceId": record["trace_id"],
+        "parentObservationId": record["parent_run_id"],
+        "name": record["name"],
+        "startTime": _iso(record["start_time"]),
+        "endTime": _iso(record["end_time"]),
+        "input": _serialize(record["inputs"]),
+        "output": _serialize(record["outputs"]),
+    }
+    if record["error"]:
+        body["level"] = "ERROR"
+        body["statusMessage"] = record["error"]
+    event_type = "span-create"
+    if record["kind"] == "llm":
+        event_type = "generation-create"
+        body["model"] = record.get("model")
+        body["usage"] = record.get("usage")
+    events.append({"id": str(uuid.uuid4()), "timestamp": now, "type": event_type, "body": body})
+    return events
+
+
+def _llm_usage(response) -> tuple[Any, Optional[dict]]:
+    """
+    Estrae output e utilizzo di token da un LLMResult.
+    """
+    outputs, usage = [], None
+    for generations in response.generations:
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            outputs.append(message if message is not None else generation.text)
+            usage_metadata = getattr(message, "usage_metadata", None)
+            if usage_metadata:
+                usage = {"input": usage_metadata.get("input_tokens"), "output": usage_metadata.get("output_tokens"),
+                         "total": usage_metadata.get("total_tokens"), "unit": "TOKENS"}
+    return outputs, usage
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    Callback LangChain che registra le run (chain, LLM e tool) e le accoda al TraceExporter.
+
+    Sul percorso della richiesta fa solo operazioni su dizionari e un put_nowait: la serializzazione
+    e l'invio avvengono nel thread dell'exporter.
+    """
+
+    # Eseguito direttamente nell'event loop anche con ainvoke: non serve un thread per ogni callback
+    run_inline = True
+
+    def __init__(self, exporter: TraceExporter):
+        self.exporter = exporter
+        self._runs: dict[UUID, dict] = {}
+
+    def _start(self, kind: str, run_id: UUID, parent_run_id: Optional[UUID], name: str, inputs: Any,
+               tags: Optional[list[str]] = None, metadata: Optional[dict] = None, model: Optional[str] = None) -> None:
+        parent = self._runs.get(parent_run_id) if parent_run_id else None
+        self._runs[run_id] = {
+            "kind": kind,
+            "run_id": str(run_id),
+            "parent_run_id": str(parent_run_id) if parent_run_id else None,
+            "trace_id": parent["trace_id"] if parent else str(run_id),
+            "name": name,
+            "inputs": inputs,
+            "tags": tags,
+            "metadata": metadata,
+            "model": model,
+            "start_time": time.time(),
+        }
+
+    def _end(self, run_id: UUID, outputs: Any = None, error: Optional[BaseException] = None, **extra) -> None:
+        record = self._runs.pop(run_id, None)
+        if record is None:
+            return
+        record.update(extra, outputs=outputs, end_time=time.time(), error=repr(error) if error else None)
+        self.exporter.enqueue(record)
+
+    @staticmethod
+    def _name(serialized: Optional[dict], kwargs: dict, default: str) -> str:
+        if kwargs.get("name"):
+            return kwargs["name"]
+        if serialized:
+            return serialized.get("name") or (serialized.get("id") or [default])[-1]
+        return default
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        self._start("chain", run_id, parent_run_id, self._name(serialized, kwargs, "chain"), inputs, tags, metadata)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id, outputs)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        model = (kwargs.get("invocation_params") or {}).get("model")
+        self._start("llm", run_id, parent_run_id, self._name(serialized, kwargs, "chat_model"), messages,
+                    tags, metadata, model)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        model = (kwargs.get("invocation_params") or {}).get("model")
+        self._start("llm", run_id, parent_run_id, self._name(serialized, kwargs, "llm"), prompts, tags, metadata, model)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        outputs, usage = _llm_usage(response)
+        self._end(run_id, outputs, usage=usage)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        self._start("tool", run_id, parent_run_id, self._name(serialized, kwargs, "tool"), input_str, tags, metadata)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id, output)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+
+_exporter: Optional[TraceExporter] = None
+_exporter_lock = threading.Lock()
+
+
+def tracing_enabled() -> bool:
+    """
+    Il tracing è attivo se sono configurate le chiavi Langfuse.
+    """
+    return bool(os.getenv("LANGFUSE_PUBLIC_KEY") and os.getenv("LANGFUSE_SECRET_KEY"))
+
+
+def get_exporter() -> TraceExporter:
+    """
+    Restituisce l'exporter condiviso del processo, avviandolo al primo uso.
+    """
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = TraceExporter(
+                public_key=os.getenv("LANGFUSE_PUBLIC_KEY"),
+                secret_key=os.getenv("LANGFUSE_SECRET_KEY"),
+            )
+            atexit.register(_exporter.flush, TRACING_TIMEOUT)
+        return _exporter
+
+
+def tracing_callbacks(sample_rate: Optional[float] = None) -> list[BaseCallbackHandler]:
+    """
+    Restituisce i callback da passare a graph.invoke/ainvoke per una richiesta.
+
+    Il campionamento è deciso per richiesta: le richieste non campionate (o con tracing
+    disattivato) non ricevono alcun callback e non pagano nessun costo di tracing.
+
+    Args:
+        sample_rate: Frazione delle richieste tracciate (default TRACING_SAMPLE_RATE).
+
+    Returns:
+        list: [TracingCallbackHandler] se la richiesta è campionata, altrimenti [].
+    """
+    rate = TRACING_SAMPLE_RATE if sample_rate is None else sample_rate
+    if not tracing_enabled() or rate <= 0 or random.random() >= rate:
+        return []
+    return [TracingCallbackHandler(get_exporter())]
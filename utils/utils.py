@@ -1,12 +1,31 @@
+import functools
 import json
 import random
+import re
 import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 import os
+from typing import Optional, Union
 from PIL import ImageColor
+from utils.boxes import BoundingBoxes, NORMALIZATION_DIVISOR, box_areas, pairwise_intersection
+from utils.asset_store import AssetStore, sanitize_label
+from utils.metrics import instrumented, observe_size, observe_latency
 
-# Costante per il fattore di normalizzazione usato nelle coordinate
-NORMALIZATION_DIVISOR = 1000
+# Soppressione dei duplicati dopo la detection: box con la stessa etichetta e IoU oltre BOX_DEDUP_IOU
+# (o con etichette diverse e IoU oltre BOX_DEDUP_CROSS_LABEL_IOU) sono lo stesso oggetto
+BOX_DEDUP_IOU = float(os.getenv("BOX_DEDUP_IOU", "0.5"))
+BOX_DEDUP_CROSS_LABEL_IOU = float(os.getenv("BOX_DEDUP_CROSS_LABEL_IOU", "0.8"))
+# Box contenute per almeno questa frazione in una box più grande vengono scartate se sono testo
+# (etichette come "label", "text", "title") o hanno la stessa etichetta della box che le contiene.
+# BOX_CONTAINMENT_PRUNING=0 disabilita questo passaggio.
+BOX_CONTAINMENT_PRUNING = os.getenv("BOX_CONTAINMENT_PRUNING", "1") == "1"
+BOX_CONTAINMENT = float(os.getenv("BOX_CONTAINMENT", "0.9"))
+# Confrontate con le parole intere dell'etichetta (separate da '_', '-' o spazi): "amazon_textract" non è testo
+TEXT_LABEL_KEYWORDS = ("label", "text", "title", "caption")
+LABEL_TOKEN_SEPARATORS = re.compile(r"[_\-\s]+")
 
 # @title Parsing JSON output
 def parse_json(json_output: str):
@@ -21,22 +40,29 @@ def parse_json(json_output: str):
 
 # @title Plotting Util
 
-additional_colors = [colorname for (colorname, colorcode) in ImageColor.colormap.items()]
+@functools.cache
+def additional_colors() -> tuple[str, ...]:
+    # Calcolato al primo disegno invece che all'import del modulo
+    return tuple(colorname for (colorname, colorcode) in ImageColor.colormap.items())
 
-def plot_bounding_boxes(im, bounding_boxes):
+@instrumented("render_bounding_boxes")
+def render_bounding_boxes(im, bounding_boxes) -> Image.Image:
     """
-    Plots bounding boxes on an image with markers for each a name, using PIL, normalized coordinates, and different colors.
+    Draws bounding boxes on a copy of the image with markers for each a name, using PIL, normalized coordinates, and different colors.
+    The original image is never modified.
 
     Args:
-        img_path: The path to the image file.
-        bounding_boxes: A list of bounding boxes containing the name of the object
+        im: The PIL image.
+        bounding_boxes: A JSON string (or a parsed BoundingBoxes) of bounding boxes containing the name of the object
          and their positions in normalized [y1 x1 y2 x2] format.
+
+    Returns:
+        Image.Image: The image copy with the overlay.
     """
 
-    # Load the image
-    img = im
+    # Copy the image
+    img = im.convert("RGB")
     width, height = img.size
-    print(img.size)
     # Create a drawing object
     draw = ImageDraw.Draw(img)
 
@@ -65,27 +91,25 @@ def plot_bounding_boxes(im, bounding_boxes):
     'violet',
     'gold',
     'silver',
-    ] + additional_colors
+    ] + list(additional_colors())
 
-    # Parsing out the markdown fencing
-    bounding_boxes = parse_json(bounding_boxes)
+    # Parsing out the markdown fencing e conversione vettoriale in coordinate assolute
+    # (su una copia: le box del chiamante mantengono la loro dimensione immagine)
+    if isinstance(bounding_boxes, BoundingBoxes):
+        bounding_boxes = bounding_boxes.subset(slice(None))
+    else:
+        bounding_boxes = BoundingBoxes.from_json(bounding_boxes)
+    bounding_boxes.set_image_size(width, height)
 
     # Iterate over the bounding boxes
-    for i, bounding_box in enumerate(json.loads(bounding_boxes)):
+    for i in range(len(bounding_boxes)):
+      if not bounding_boxes.has_coords[i]:
+        continue
+
       # Select a color from the list
       color = colors[i % len(colors)]
 
-      # Convert normalized coordinates to absolute coordinates
-      abs_y1 = int(bounding_box["box_2d"][0] / NORMALIZATION_DIVISOR * height)
-      abs_x1 = int(bounding_box["box_2d"][1] / NORMALIZATION_DIVISOR * width)
-      abs_y2 = int(bounding_box["box_2d"][2] / NORMALIZATION_DIVISOR * height)
-      abs_x2 = int(bounding_box["box_2d"][3] / NORMALIZATION_DIVISOR * width)
-
-      if abs_x1 > abs_x2:
-        abs_x1, abs_x2 = abs_x2, abs_x1
-
-      if abs_y1 > abs_y2:
-        abs_y1, abs_y2 = abs_y2, abs_y1
+      abs_x1, abs_y1, abs_x2, abs_y2 = (int(c) for c in bounding_boxes.absolute[i])
 
       # Draw the bounding box
       draw.rectangle(
@@ -93,83 +117,230 @@ def plot_bounding_boxes(im, bounding_boxes):
       )
 
       # Draw the text
-      if "label" in bounding_box:
-        draw.text((abs_x1 + 8, abs_y1 + 6), bounding_box["label"], fill=color)
+      if bounding_boxes.labels[i] is not None:
+        draw.text((abs_x1 + 8, abs_y1 + 6), bounding_boxes.labels[i], fill=color)
+
+    return img
+
+def plot_bounding_boxes(im, bounding_boxes):
+    """
+    Renders the overlay and opens it in the system image viewer (notebook / local use only:
+    the tools never call this, see utils/overlay.py).
+    """
+    render_bounding_boxes(im, bounding_boxes).show()
+
+def suppress_duplicate_boxes(bounding_boxes: BoundingBoxes, iou_threshold: float = BOX_DEDUP_IOU,
+                             cross_label_iou: float = BOX_DEDUP_CROSS_LABEL_IOU,
+                             prune_contained: bool = BOX_CONTAINMENT_PRUNING,
+                             containment: float = BOX_CONTAINMENT) -> np.ndarray:
+    """
+    Non-maximum suppression delle box duplicate, con soglie diverse per etichette uguali e diverse.
+
+    Il modello non restituisce punteggi: a parità di oggetto viene tenuta la prima box restituita.
+    Le matrici di IoU e contenimento vengono calcolate una sola volta in modo vettoriale, quindi il
+    costo resta piccolo anche con centinaia di box. Le box non valide non vengono mai scartate
+    (il ritaglio le segnala come prima).
+
+    Returns:
+        np.ndarray: Gli indici delle box da tenere, nell'ordine originale.
+    """
+    count = len(bounding_boxes)
+    if count < 2:
+        return np.arange(count)
+    valid = bounding_boxes.valid
+    labels = [sanitize_label(label or "", "").lower() for label in bounding_boxes.labels]
+    same_label = np.array(labels)[:, None] == np.array(labels)[None, :]
+    thresholds = np.where(same_label, iou_threshold, cross_label_iou)
+    duplicate = bounding_boxes.iou() >= thresholds
+
+    if prune_contained:
+        # contained[i, j]: la box i è quasi tutta dentro la box j, più grande
+        areas = box_areas(bounding_boxes.absolute)
+        intersection = pairwise_intersection(bounding_boxes.absolute, bounding_boxes.absolute)
+        inside = intersection >= areas[:, None] * containment
+        contained = inside & (areas[None, :] > areas[:, None]) & valid[:, None] & valid[None, :]
+        is_text = np.array([any(token in TEXT_LABEL_KEYWORDS for token in LABEL_TOKEN_SEPARATORS.split(label))
+                            for label in labels])
+        pruned = (contained & (same_label | is_text[:, None])).any(axis=1)
+    else:
+        pruned = np.zeros(count, dtype=bool)
+
+    keep = valid & ~pruned
+    for i in range(count):
+        if keep[i]:
+            # Le box successive duplicate di una box tenuta vengono soppresse
+            keep[i + 1:] &= ~duplicate[i, i + 1:]
+    keep |= ~valid
+    return np.flatnonzero(keep)
+
+def deduplicate_detection_json(result_text: str, width: int, height: int) -> str:
+    """
+    Applica suppress_duplicate_boxes alla risposta del modello. Se non viene scartato nulla,
+    o la risposta non è JSON valido, restituisce il testo invariato.
+    """
+    try:
+        items = json.loads(parse_json(result_text))
+    except (TypeError, ValueError):
+        return result_text
+    if not isinstance(items, list):
+        return result_text
+    keep = suppress_duplicate_boxes(BoundingBoxes.from_json(items, width, height))
+    removed = len(items) - len(keep)
+    observe_size("duplicate_boxes_removed", removed)
+    if not removed:
+        return result_text
+    print(f"Box duplicate scartate: {removed} su {len(items)}")
+    return json.dumps([items[i] for i in keep])
+
+def encode_crop(im: Image.Image, crop_box: tuple[int, int, int, int]) -> bytes:
+    """
+    Ritaglia la box [left, upper, right, lower] e la codifica in PNG.
+    """
+    buffer = io.BytesIO()
+    im.crop(crop_box).save(buffer, format="PNG")
+    return buffer.getvalue()
 
-    # Display the image
-    img.show()
+class CropWorker:
+    """
+    Ritaglia e codifica in un thread le box man mano che arrivano da una risposta in streaming.
+
+    I PNG vengono indicizzati per box in pixel: dopo close(), save_cropped_images
+    (encoded_crops=worker.encoded) li riusa per le box della risposta finale, dopo la soppressione
+    dei duplicati, e assegna i nomi file come per una risposta non in streaming. I ritagli di box
+    poi scartate vengono ignorati.
+    """
+
+    def __init__(self, im: Image.Image):
+        self.im = im
+        self.encoded: dict[tuple, bytes] = {}
+        self.first_crop_seconds: Optional[float] = None
+        self._started = time.perf_counter()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="crop")
+
+    def submit(self, item: dict) -> None:
+        """
+        Accoda il ritaglio di un elemento {"box_2d": [...], "label": ...} appena ricevuto
+        (anche il parsing avviene nel thread del worker).
+        """
+        self._executor.submit(self._encode, item)
+
+    def _encode(self, item: dict) -> None:
+        bounding_boxes = BoundingBoxes.from_json([item], *self.im.size)
+        if not bounding_boxes.valid[0]:
+            return
+        crop_box = tuple(int(c) for c in bounding_boxes.absolute[0])
+        if crop_box in self.encoded:
+            return
+        try:
+            self.encoded[crop_box] = encode_crop(self.im, crop_box)
+        except Exception as e:
+            print(f"Errore nel ritaglio anticipato della box {crop_box}: {e}")
+            return
+        if self.first_crop_seconds is None:
+            self.first_crop_seconds = time.perf_counter() - self._started
+            observe_latency("detection_first_crop", self.first_crop_seconds)
+
+    def close(self, cancel: bool = False) -> None:
+        """
+        Attende i ritagli in coda (o li annulla, se cancel è True) e libera il thread.
+        """
+        self._executor.shutdown(wait=True, cancel_futures=cancel)
+
+def crop_filenames(bounding_boxes: BoundingBoxes) -> dict[int, str]:
+    """
+    Assegna il nome file del ritaglio ad ogni box valida (etichetta sanificata, con suffisso _N
+    per le etichette duplicate), nello stesso ordine usato da save_cropped_images.
 
+    Returns:
+        dict[int, str]: Indice della box -> nome file (es. 'cat.png', 'cat_1.png').
+    """
+    filenames = {}
+    filename_counts = {}  # Per gestire etichette duplicate
+    for i in map(int, np.flatnonzero(bounding_boxes.valid)):
+        label = bounding_boxes.labels[i] or f"unlabeled_crop_{i}"
+        safe_label = sanitize_label(label, f"unlabeled_crop_{i}")
+
+        count = filename_counts.get(safe_label, 0)
+        filename_counts[safe_label] = count + 1
+        filenames[i] = f"{safe_label}_{count}.png" if count > 0 else f"{safe_label}.png"
+    return filenames
+
+@instrumented("save_cropped_images")
 def save_cropped_images(
-    im: Image.Image, bounding_boxes_json_str: str, output_folder: str = "output_llm"
+    im: Image.Image, bounding_boxes_json_str: Union[str, BoundingBoxes], output_folder: str = "output_llm",
+    asset_store: Optional[AssetStore] = None, write_to_disk: bool = True,
+    encoded_crops: Optional[dict[tuple, bytes]] = None,
 ) -> list[str]:
     """
     Ritaglia oggetti da un'immagine in base alle bounding box e li salva in una cartella specificata.
 
+    Ogni ritaglio viene codificato in PNG una sola volta: i byte vengono messi nell'asset_store
+    (se fornito), da cui l'embedding Draw.io li legge senza passare dal disco, e scritti
+    su disco solo se write_to_disk è True.
+
     Args:
         im: L'oggetto PIL.Image.
         bounding_boxes_json_str: Una stringa JSON contenente le bounding box.
                                  Ogni box dovrebbe avere "label" e "box_2d"
                                  (coordinate normalizzate [y1, x1, y2, x2] su base NORMALIZATION_DIVISOR).
+                                 Può essere anche un BoundingBoxes già parsato.
         output_folder: La cartella dove verranno salvate le immagini ritagliate. Default "files".
+        asset_store: L'archivio in memoria dove registrare i ritagli codificati (opzionale); viene
+                     svuotato prima di registrare i nuovi ritagli.
+        write_to_disk: Se False i ritagli non vengono scritti in output_folder.
+        encoded_crops: I PNG già codificati (CropWorker.encoded), indicizzati per box in pixel.
 
     Returns:
-        list[str]: Una lista dei percorsi ai file delle immagini ritagliate salvate con successo.
+        list[str]: Una lista dei percorsi ai file delle immagini ritagliate salvate con successo
+                   (percorsi logici in output_folder se write_to_disk è False).
     """
     saved_file_paths = []
-    os.makedirs(output_folder, exist_ok=True)
+    if write_to_disk:
+        os.makedirs(output_folder, exist_ok=True)
     width, height = im.size
 
-    # Parsing della stringa JSON
-    parsed_json_str = parse_json(bounding_boxes_json_str)
-    try:
-        bounding_boxes_list = json.loads(parsed_json_str)
-    except json.JSONDecodeError as e:
-        print(f"Errore nel decodificare JSON: {e}")
-        return saved_file_paths # Ritorna lista vuota in caso di errore JSON iniziale
+    # Parsing della stringa JSON e conversione vettoriale in coordinate assolute
+    if isinstance(bounding_boxes_json_str, BoundingBoxes):
+        bounding_boxes = bounding_boxes_json_str
+    else:
+        try:
+            bounding_boxes = BoundingBoxes.from_json(bounding_boxes_json_str)
+        except json.JSONDecodeError as e:
+            print(f"Errore nel decodificare JSON: {e}")
+            return saved_file_paths # Ritorna lista vuota in caso di errore JSON iniziale
+    bounding_boxes.set_image_size(width, height)
 
-    filename_counts = {}  # Per gestire etichette duplicate
+    filenames = crop_filenames(bounding_boxes)
+    if asset_store is not None:
+        # L'archivio contiene solo i ritagli dell'ultima detection: quelli di diagrammi precedenti
+        # (es. nella cartella condivisa output_llm) non restano in memoria né prevalgono sui file su disco
+        asset_store.clear()
 
-    for i, bounding_box in enumerate(bounding_boxes_list):
-        if "box_2d" not in bounding_box:
-            print(f"Bounding box {i} saltata: chiave 'box_2d' mancante.")
-            continue
-        if len(bounding_box["box_2d"]) != 4:
-            print(f"Bounding box {i} saltata: 'box_2d' non ha 4 coordinate.")
+    for i in range(len(bounding_boxes)):
+        if not bounding_boxes.has_coords[i]:
+            print(f"Bounding box {i} saltata: {bounding_boxes.errors[i]}.")
             continue
 
-        # Converte coordinate normalizzate in coordinate assolute
-        # box_2d è [y1, x1, y2, x2]
-        abs_y1 = int(bounding_box["box_2d"][0] / NORMALIZATION_DIVISOR * height)
-        abs_x1 = int(bounding_box["box_2d"][1] / NORMALIZATION_DIVISOR * width)
-        abs_y2 = int(bounding_box["box_2d"][2] / NORMALIZATION_DIVISOR * height)
-        abs_x2 = int(bounding_box["box_2d"][3] / NORMALIZATION_DIVISOR * width)
-
-        # Assicura che abs_x1 sia sinistra, abs_x2 destra, abs_y1 alto, abs_y2 basso
-        # per la funzione crop di PIL che richiede (left, upper, right, lower)
-        crop_left = min(abs_x1, abs_x2)
-        crop_upper = min(abs_y1, abs_y2)
-        crop_right = max(abs_x1, abs_x2)
-        crop_lower = max(abs_y1, abs_y2)
-
-        if crop_left >= crop_right or crop_upper >= crop_lower:
-            label_for_log = bounding_box.get('label', f'indice {i}')
+        crop_left, crop_upper, crop_right, crop_lower = (int(c) for c in bounding_boxes.absolute[i])
+        if not bounding_boxes.nonzero[i]:
+            label_for_log = bounding_boxes.labels[i] or f'indice {i}'
             print(f"Bounding box per '{label_for_log}' saltata: area nulla ({crop_left},{crop_upper},{crop_right},{crop_lower})")
             continue
 
-        cropped_image = im.crop((crop_left, crop_upper, crop_right, crop_lower))
-
-        label = bounding_box.get("label", f"unlabeled_crop_{i}")
-        safe_label = "".join(c for c in label if c.isalnum() or c in (' ', '_', '-')).strip().replace(' ', '_')
-        if not safe_label:
-            safe_label = f"unlabeled_crop_{i}"
-
-        count = filename_counts.get(safe_label, 0)
-        filename_counts[safe_label] = count + 1
-        output_filename = f"{safe_label}_{count}.png" if count > 0 else f"{safe_label}.png"
+        crop_box = (crop_left, crop_upper, crop_right, crop_lower)
+        output_filename = filenames[i]
         output_path = os.path.join(output_folder, output_filename)
 
         try:
-            cropped_image.save(output_path)
+            # Ritaglio già codificato dal CropWorker durante lo streaming, se disponibile
+            png_bytes = encoded_crops.get(crop_box) if encoded_crops else None
+            if png_bytes is None:
+                png_bytes = encode_crop(im, crop_box)
+            if asset_store is not None:
+                asset_store.put(output_filename, png_bytes, "image/png")
+            if write_to_disk:
+                with open(output_path, "wb") as f:
+                    f.write(png_bytes)
             saved_file_paths.append(output_path)
         except Exception as e:
             print(f"Errore nel salvare l'immagine {output_path}: {e}")
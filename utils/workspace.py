@@ -0,0 +1,164 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Optional
+
+from utils.asset_store import drop_asset_store, sanitize_label
+
+# Workspace per richiesta: ritagli, overlay e drawio_output.drawio di ogni richiesta vanno in una
+# sottocartella dedicata di WORKSPACE_ROOT, quindi più richieste possono girare in parallelo nello
+# stesso processo senza sovrascrivere i file l'una dell'altra. Un janitor in background elimina i
+# workspace più vecchi di WORKSPACE_MAX_AGE_SECONDS e, se la dimensione totale supera
+# WORKSPACE_MAX_BYTES, quelli usati meno di recente. I workspace in uso non vengono mai eliminati.
+
+WORKSPACE_ROOT = os.getenv("WORKSPACE_ROOT", os.path.join("output_llm", "workspaces"))
+WORKSPACE_MAX_BYTES = int(os.getenv("WORKSPACE_MAX_BYTES", str(1024 * 1024 * 1024)))
+WORKSPACE_MAX_AGE_SECONDS = float(os.getenv("WORKSPACE_MAX_AGE_SECONDS", str(24 * 3600)))
+WORKSPACE_JANITOR_INTERVAL = float(os.getenv("WORKSPACE_JANITOR_INTERVAL", "300"))
+
+# Cartella condivisa storica, usata dalle richieste senza workspace (chiamate dirette ai tool, script)
+DEFAULT_WORKSPACE = "output_llm"
+
+_active: set[str] = set()
+_active_lock = threading.Lock()
+_janitor: Optional["WorkspaceJanitor"] = None
+_janitor_lock = threading.Lock()
+
+
+def create_workspace(name: Optional[str] = None, root: Optional[str] = None) -> str:
+    """
+    Crea la cartella di una nuova richiesta e la segna come in uso fino a release_workspace.
+
+    Args:
+        name: Un identificativo leggibile (es. il task_id), usato come prefisso del nome della cartella.
+        root: La cartella radice (default WORKSPACE_ROOT).
+
+    Returns:
+        str: Il percorso del workspace.
+    """
+    root = root or WORKSPACE_ROOT
+    prefix = sanitize_label(name, "request")[:48] if name else "request"
+    path = os.path.join(root, f"{prefix}-{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}")
+    # Segnato come in uso prima di esistere su disco: il janitor non può mai vederlo inattivo
+    with _active_lock:
+        _active.add(os.path.abspath(path))
+    os.makedirs(path, exist_ok=True)
+    start_janitor(root)
+    return path
+
+
+def release_workspace(path: str) -> None:
+    """
+    Segna il workspace come non più in uso e libera i ritagli tenuti in memoria. I file restano
+    su disco (ad esempio per essere scaricati) finché il janitor non li elimina.
+    """
+    with _active_lock:
+        _active.discard(os.path.abspath(path))
+    drop_asset_store(path)
+
+
+def workspace_of(state: Optional[dict]) -> str:
+    """
+    Restituisce il workspace della richiesta dallo stato del grafo, o la cartella condivisa storica.
+    """
+    return (state or {}).get("workspace") or DEFAULT_WORKSPACE
+
+
+def _scan(path: str) -> tuple[int, float]:
+    total, latest = 0, os.stat(path).st_mtime
+    for directory, _, files in os.walk(path):
+        for filename in files:
+            try:
+                st = os.stat(os.path.join(directory, filename))
+            except FileNotFoundError:
+                continue
+            total += st.st_size
+            latest = max(latest, st.st_mtime)
+    return total, latest
+
+
+def enforce_quota(root: Optional[str] = None, max_bytes: int = WORKSPACE_MAX_BYTES,
+                  max_age_seconds: float = WORKSPACE_MAX_AGE_SECONDS) -> dict:
+    """
+    Elimina i workspace scaduti e, oltre max_bytes totali, quelli modificati meno di recente.
+
+    Returns:
+        dict: Workspace eliminati, byte liberati e byte rimasti.
+    """
+    root = root or WORKSPACE_ROOT
+    if not os.path.isdir(root):
+        return {"removed": [], "freed_bytes": 0, "total_bytes": 0}
+    workspaces = []
+    for entry in os.scandir(root):
+        if not entry.is_dir():
+            continue
+        try:
+            size, last_used = _scan(entry.path)
+        except FileNotFoundError:
+            continue
+        workspaces.append((last_used, size, entry.path))
+    workspaces.sort()
+
+    total = sum(size for _, size, _ in workspaces)
+    now = time.time()
+    removed, freed = [], 0
+    for last_used, size, path in workspaces:
+        expired = now - last_used > max_age_seconds
+        if not expired and total <= max_bytes:
+            continue
+        # Controllo ed eliminazione sotto lo stesso lock di create_workspace/release_workspace:
+        # un workspace diventato attivo dopo la scansione non viene mai eliminato
+        with _active_lock:
+            if os.path.abspath(path) in _active:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+        drop_asset_store(path)
+        removed.append(path)
+        freed += size
+        total -= size
+    if removed:
+        print(f"Workspace janitor: {len(removed)} workspace eliminati ({freed} byte), {total} byte rimasti in {root}")
+    return {"removed": removed, "freed_bytes": freed, "total_bytes": total}
+
+
+class WorkspaceJanitor:
+    """
+    Thread daemon che applica enforce_quota ogni interval secondi.
+    """
+
+    def __init__(self, root: str, interval: float = WORKSPACE_JANITOR_INTERVAL):
+        self.root = root
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="workspace-janitor", daemon=True)
+
+    def start(self) -> "WorkspaceJanitor":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=self.interval)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                enforce_quota(self.root)
+            except Exception as e:
+                print(f"Errore del workspace janitor: {e}")
+
+
+def start_janitor(root: Optional[str] = None) -> Optional[WorkspaceJanitor]:
+    """
+    Avvia (una sola volta per processo) il janitor sulla radice dei workspace.
+    WORKSPACE_JANITOR_INTERVAL=0 lo disabilita.
+    """
+    global _janitor
+    if WORKSPACE_JANITOR_INTERVAL <= 0:
+        return None
+    with _janitor_lock:
+        if _janitor is None:
+            _janitor = WorkspaceJanitor(root or WORKSPACE_ROOT).start()
+        return _janitor